@@ -7,6 +7,7 @@ setup(
     packages=find_packages(where="src"),
     package_dir={"": "src"},
     install_requires=["regex"],
+    extras_require={"msgpack": ["msgpack"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -11,13 +11,32 @@ from .barg_core import (
     AstAssignment,
     AstTransform,
     AstTextString,
+    AstToken,
+    AstTokens,
+    AstSkip,
+    AstPrescan,
+    AstRecover,
     InternalError,
     BadGrammarError,
     Token,
     TokenType,
     TokenIter,
+    TokenStream,
     ModuleInfo,
+    CompiledGrammar,
     parse,
+    compile_grammar,
+    iter_nodes,
+    map_children,
+    rewrite_tree,
+    cons_to_list,
+    hash_cons,
+    rule_names,
+    instrument,
+    install_actions,
+    resolve_actions,
+    push_down_transforms,
+    specialize_transforms,
     GenTyKind,
     generate_python_parser,
     generate_python_parser_deprecated,
@@ -28,9 +47,76 @@ from .barg_exec_builtins import (
     insert_transform,
     insert_all_builtins,
     TAKE_BUILTIN_NAME,
+    NCONS_PRESERVING_BUILTINS,
 )
 from .barg_codegen import (
     CodeGenerator,
     PythonCodeGenerator,
 )
+from .barg_leaf import (
+    LeafPlan,
+    plan_leaf,
+    regex_engine,
+    AlternationPlan,
+    plan_alternation,
+    MAX_ALTERNATION,
+)
+from .barg_errors import (
+    LineIndex,
+    ErrorNode,
+    ParseError,
+    parse_error,
+)
+from .barg_prescan import (
+    LeafIndex,
+    prescannable,
+    scan_pattern,
+)
+from .barg_incremental import (
+    TextEdit,
+    ParseTree,
+    parse_incremental,
+    reparse,
+)
+from .barg_lazy import (
+    LazyStruct,
+    LazyEnum,
+    materialize,
+)
+from .barg_sink import (
+    ResultSink,
+    JsonSink,
+    MsgpackSink,
+    parse_to_sink,
+)
+from .barg_profile import (
+    Profiler,
+    RuleStats,
+    mark_line_in_grammar,
+)
+from .barg_trace import Tracer
+from .barg_budget import (
+    ParseBudget,
+    ParseBudgetExceeded,
+)
+from .barg_async import (
+    parse_async,
+    iter_items_async,
+    to_plain,
+)
+from .barg_passes import (
+    PassManager,
+    PassOptions,
+    DEFAULT_PASSES,
+    optimize,
+    format_ir,
+    explain,
+)
+from .barg_analysis import (
+    GrammarWarning,
+    compute_nullable,
+    nullable_lists,
+    warn_nullable_lists,
+    lint_grammar,
+)
 PRINT_PRIVATE_STRUCT_MEMBERS = True
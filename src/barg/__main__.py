@@ -29,21 +29,6 @@ def map_call_stack_to_local_selfs():
     return mapped_objects
 
 
-def mark_line_in_grammar(grammar: str, lineno: int) -> str:
-    """a function that takes grammar[line-4:line+5], indents it all and puts an arrow before grammar[line]"""
-    lineno -= 1  # lines start at 1, indices at 0
-    max_lineno_len = max(map(lambda i: len(str(i)), range(lineno - 4, lineno + 5)))
-    lines = grammar.splitlines()[max(0, lineno - 4) : lineno + 5]
-    for i, line in enumerate(lines[: min(4, lineno)]):
-        lines[i] = str(i - 4 + lineno).ljust(max_lineno_len) + "|" + " " * 4 + line
-    for i, line in enumerate(lines[min(4, lineno) + 1 :]):
-        lines[i + min(4, lineno) + 1] = (
-            str(i + 1 + lineno).ljust(max_lineno_len) + "|" + " " * 4 + line
-        )
-    lines[min(4, lineno)] = "----> " + lines[min(4, lineno)]
-    return "\n".join(lines)
-
-
 def barg_test(args):
     print(
         "Please use `PYTHONPATH=src python -m unittest tests` to run all unit-tests from the barg project root directory. To run them for the installed package, use `python -m unittest barg.tests`. To run only a subset of all tests, use `barg.tests.{Exec,CodeGen}` or `barg.tests.{Exec,CodeGen}.test123`. Example: `python -m unittest barg.tests.Exec.test1`."
@@ -64,15 +49,42 @@ def barg_exec(args):
         text = f.read()
     with open(args.grammar) as f:
         grammar = f.read()
+    if args.format == "msgpack" and barg.barg_sink.msgpack is None:
+        print("--format msgpack requires the msgpack package (pip install msgpack)")
+        return
     errs = []
-    g = barg.parse((text,), grammar, errs, args.toplevel_name)[0]
+    profiler = barg.Profiler() if args.profile else None
+    budget = (
+        barg.ParseBudget(args.max_steps, args.timeout)
+        if args.max_steps is not None or args.timeout is not None
+        else None
+    )
+    # structured formats are written from the lazily recorded derivations, without building the result types
+    g = barg.parse(
+        (text,),
+        grammar,
+        errs,
+        args.toplevel_name,
+        lazy=args.format != "text",
+        profiler=profiler,
+        budget=budget,
+        raise_on_failure=True,
+    )[0]
     if isinstance(g, Exception):
         nl = "\n"
         print(f"FAILED! Error: {g};\nErrors: {nl.join(errs)}")
     else:
         try:
             m = next(g)[0]
-            print(m)
+            if args.format == "text":
+                print(m)
+            elif args.format == "json":
+                barg.JsonSink(sys.stdout, args.print_private_struct_members).write(m)
+            else:
+                barg.MsgpackSink(sys.stdout.buffer, args.print_private_struct_members).write(m)
+                sys.stdout.buffer.flush()
+            if profiler is not None:
+                print(profiler.report(grammar), file=sys.stderr)
         except RecursionError:
             err = "Python recursion limit exceeded. This may indicate a flawed grammar which contains infinite cycles. The Python call stack and associated barg patterns are listed below:\n"
             if args.backtrace_len_limit:
@@ -89,10 +101,16 @@ def barg_exec(args):
                 else:
                     err += (
                         f"Python function '{func}' on line {lineno} called - belongs to barg grammar:\n"
-                        + mark_line_in_grammar(grammar, s.line)
+                        + barg.mark_line_in_grammar(grammar, s.line)
                         + "\n"
                     )
             raise RecursionError(err)
+        except barg.ParseError as e:
+            print(f"FAILED! {e}", file=sys.stderr)
+        except barg.ParseBudgetExceeded as e:
+            print(e, file=sys.stderr)
+            for rule, line, kind, _ in e.hottest[:1]:
+                print(barg.mark_line_in_grammar(grammar, line), file=sys.stderr)
         except Exception as e:
             errs.append(
                 f"On line {e.__barg_line if hasattr(e, '__barg_line') and e.__barg_line != -1 else '<unknown/eof>'}: {e}\nPython {traceback.format_exc()}"
@@ -109,7 +127,8 @@ def barg_codegen(args):
     with open(f"{src_path}/barg/barg_codegen_builtins.py") as f:
         head = f.read()
     error_out = []
-    code = barg.generate_python_parser(grammar, error_out, head)
+    roots = None if args.toplevel_name is None else [args.toplevel_name]
+    code = barg.generate_python_parser(grammar, error_out, head, args.traced, roots)
     if error_out:
         print("Errors encountered:\n" + "\n---------------\n".join(error_out))
     else:
@@ -117,6 +136,44 @@ def barg_codegen(args):
             f.write(code)
 
 
+def barg_lint(args):
+    if not os.path.exists(args.grammar) or not os.path.isfile(args.grammar):
+        print("Could not find file " + args.grammar)
+        return
+    with open(args.grammar) as f:
+        grammar = f.read()
+    lexer = barg.Lexer(grammar)
+    parser = barg.Parser(lexer.tokenize())
+    ast = parser.parse()
+    errs = lexer.errors + parser.errors
+    if errs:
+        print("Errors encountered:\n" + "\n---------------\n".join(errs))
+        return
+    for line, msg in barg.lint_grammar(ast):
+        print(f"On line {line}: {msg}\n" + barg.mark_line_in_grammar(grammar, line) + "\n")
+
+
+def barg_explain(args):
+    if not os.path.exists(args.grammar) or not os.path.isfile(args.grammar):
+        print("Could not find file " + args.grammar)
+        return
+    with open(args.grammar) as f:
+        grammar = f.read()
+    errs = []
+    roots = None if args.toplevel_name is None else [args.toplevel_name]
+    out = barg.explain(grammar, errs, roots)
+    if errs:
+        print("Errors encountered:\n" + "\n---------------\n".join(errs))
+    else:
+        print(out)
+
+
+def barg_bench(args):
+    from barg import benchmarks
+
+    benchmarks.main(args)
+
+
 def barg_codegen_deprecated(args):
     src_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
     if not os.path.exists(args.grammar) or not os.path.isfile(args.grammar):
@@ -136,6 +193,9 @@ if __name__ == "__main__":
     bcg = sp.add_parser("codegen")
     bcgd = sp.add_parser("codegen-deprecated")
     btest = sp.add_parser("test")
+    bbench = sp.add_parser("bench")
+    blint = sp.add_parser("lint")
+    bexplain = sp.add_parser("explain")
 
     bex.add_argument("text_file")
     bex.add_argument("--grammar", "-g", required=True)
@@ -143,18 +203,47 @@ if __name__ == "__main__":
     bex.add_argument("--max-recursion-limit", "-rec", type=int, default=None)
     bex.add_argument("--backtrace-len-limit", "-btlen", type=int, default=None)
     bex.add_argument("--print-private-struct-members", "-ppsm", action="store_true")
+    bex.add_argument(
+        "--format", "-f", choices=("text", "json", "msgpack"), default="text", help="output format of the match"
+    )
+    bex.add_argument("--profile", action="store_true", help="print per-rule timings to stderr")
+    bex.add_argument("--max-steps", type=int, default=None, help="abort the parse after this many match steps")
+    bex.add_argument("--timeout", type=float, default=None, help="abort the parse after this many seconds")
 
     bcg.add_argument("grammar")
     bcg.add_argument("--outfile", "-o", default="barg_generated_parser.py")
+    bcg.add_argument(
+        "--traced", action="store_true", help="generate a parser with a _set_tracer_ function"
+    )
+    bcg.add_argument(
+        "--toplevel-name", "-tn", default=None, help="only generate this rule and the rules it uses"
+    )
 
     bcgd.add_argument("grammar")
     bcgd.add_argument("--toplevel-name", "-tn", default="Toplevel")
     bcgd.add_argument("--outfile", "-o", default="barg_generated_parser.py")
 
+    bbench.add_argument("--cases", nargs="+", default=None, help="default: all (json, json_skip, grammar1, deep_nesting, long_list, alternation)")
+    bbench.add_argument("--backends", nargs="+", choices=("interp", "codegen"), default=None)
+    bbench.add_argument("--sizes", nargs="+", type=int, default=[25, 50, 100, 200])
+    bbench.add_argument("--repeat", type=int, default=3)
+    bbench.add_argument("--json", default=None, help="write the results as JSON to this file ('-' for stdout)")
+    bbench.add_argument("--max-recursion-limit", "-rec", type=int, default=None)
+
+    blint.add_argument("grammar")
+
+    bexplain.add_argument("grammar")
+    bexplain.add_argument(
+        "--toplevel-name", "-tn", default=None, help="drop the rules this rule does not use"
+    )
+
     bex.set_defaults(func=barg_exec)
     bcg.set_defaults(func=barg_codegen)
     bcgd.set_defaults(func=barg_codegen_deprecated)
     btest.set_defaults(func=barg_test)
+    bbench.set_defaults(func=barg_bench)
+    blint.set_defaults(func=barg_lint)
+    bexplain.set_defaults(func=barg_explain)
     args = ap.parse_args()
     if not hasattr(args, "func"):
         print("Invalid usage. Use the -h option for more information.")
@@ -0,0 +1,138 @@
+import barg
+import regex
+import warnings
+from typing import List, Optional, Set, Tuple
+
+
+class GrammarWarning(UserWarning):
+    """Issued when a grammar is compiled for constructs that are legal but almost certainly a mistake"""
+
+
+def _string_nullable(node: "barg.AstString") -> bool:
+    try:
+        return regex.match(node.value, "") is not None
+    except regex.error:
+        return False  # reported when the grammar is matched
+
+
+def compute_nullable(toplevel: "barg.AstToplevel") -> Set[int]:
+    """
+    Returns the ids of all nodes of `toplevel` that can match the empty string.
+    Leaves are nullable if their regex matches the empty string (assertions like `\\b` or lookaheads are treated as
+    if the input was empty, so this is an approximation). Recursive definitions are resolved by fixpoint iteration.
+    """
+    definitions = {a.identifier: a.expression for a in toplevel.assignments}
+    nodes = [
+        n
+        for n in barg.iter_nodes(toplevel)
+        if not isinstance(n, (barg.AstToplevel, barg.AstAssignment))
+    ]
+    nullable: Set[int] = set()
+    changed = True
+    while changed:
+        changed = False
+        for node in nodes:
+            if id(node) in nullable:
+                continue
+            if isinstance(node, barg.AstString):
+                result = _string_nullable(node)
+            elif isinstance(node, barg.AstVariable):
+                defn = definitions.get(node.name)
+                result = defn is not None and id(defn) in nullable
+            elif isinstance(node, barg.AstStruct):
+                result = all(id(expr) in nullable for _, expr in node.fields)
+            elif isinstance(node, barg.AstEnum):
+                result = any(id(expr) in nullable for _, expr in node.variants)
+            elif isinstance(node, barg.AstList):
+                result = node.range_start == 0 or id(node.expression) in nullable
+            elif isinstance(node, barg.AstTransform):
+                result = id(node.pattern_arg) in nullable
+            elif isinstance(node, barg.AstRecover):
+                # recovery may consume nothing if a synchronization token can be empty
+                result = id(node.expression) in nullable or any(id(s) in nullable for s in node.syncs)
+            else:
+                # tokens always consume input, text strings are not matchable
+                result = False
+            if result:
+                nullable.add(id(node))
+                changed = True
+    return nullable
+
+
+def nullable_lists(
+    toplevel: "barg.AstToplevel", nullable: Optional[Set[int]] = None
+) -> List["barg.AstList"]:
+    """Lists whose item can match the empty string. Matching stops repeating such an item once it consumes nothing."""
+    if nullable is None:
+        nullable = compute_nullable(toplevel)
+    return [
+        n
+        for n in barg.iter_nodes(toplevel)
+        if isinstance(n, barg.AstList) and id(n.expression) in nullable
+    ]
+
+
+def _nullable_list_message(rule: str) -> str:
+    return f"unbounded list in rule '{rule}' repeats an expression that can match the empty string"
+
+
+def warn_nullable_lists(toplevel: "barg.AstToplevel", nullable: Optional[Set[int]] = None) -> None:
+    """Issues a GrammarWarning for every unbounded list over a nullable expression"""
+    names = barg.rule_names(toplevel)
+    for node in sorted(nullable_lists(toplevel, nullable), key=lambda n: n.line):
+        if node.range_end is None:
+            rule = names.get(id(node), "<anonymous>")
+            warnings.warn(
+                f"On line {node.line}: {_nullable_list_message(rule)}", GrammarWarning, stacklevel=2
+            )
+
+
+def _repeats(node, definitions, nullable: Set[int], seen: Set[str]) -> bool:
+    """Whether `node` can match like an unbounded list, ie. split its match into a varying number of repetitions"""
+    if isinstance(node, barg.AstVariable):
+        if node.name in seen or node.name not in definitions:
+            return False
+        return _repeats(definitions[node.name], definitions, nullable, seen | {node.name})
+    if isinstance(node, barg.AstList):
+        return node.range_end is None
+    if isinstance(node, barg.AstTransform):
+        return _repeats(node.pattern_arg, definitions, nullable, seen)
+    if isinstance(node, barg.AstRecover):
+        return _repeats(node.expression, definitions, nullable, seen)
+    if isinstance(node, barg.AstEnum):
+        return any(_repeats(expr, definitions, nullable, seen) for _, expr in node.variants)
+    if isinstance(node, barg.AstStruct):
+        # a struct repeats if one field repeats and all others can be empty
+        exprs = [expr for _, expr in node.fields]
+        for i, expr in enumerate(exprs):
+            others = exprs[:i] + exprs[i + 1 :]
+            if all(id(o) in nullable for o in others) and _repeats(
+                expr, definitions, nullable, seen
+            ):
+                return True
+    return False
+
+
+def lint_grammar(toplevel: "barg.AstToplevel") -> List[Tuple[int, str]]:
+    """
+    Static checks for grammar constructs that make matching loop or backtrack exponentially.
+    Returns (line, message) tuples, sorted by line.
+    """
+    definitions = {a.identifier: a.expression for a in toplevel.assignments}
+    nullable = compute_nullable(toplevel)
+    names = barg.rule_names(toplevel)
+    findings = []
+    for node in barg.iter_nodes(toplevel):
+        if not isinstance(node, barg.AstList) or node.range_end is not None:
+            continue
+        rule = names.get(id(node), "<anonymous>")
+        if id(node.expression) in nullable:
+            findings.append((node.line, _nullable_list_message(rule)))
+        elif _repeats(node.expression, definitions, nullable, set()):
+            findings.append(
+                (
+                    node.line,
+                    f"unbounded list in rule '{rule}' repeats another unbounded list, which may backtrack exponentially",
+                )
+            )
+    return sorted(findings, key=lambda f: f[0])
@@ -0,0 +1,163 @@
+"""
+asyncio entry points. The matchers are plain generators nested as deep as the grammar, so a match cannot be
+suspended halfway to run the event loop. Instead, `parse_async` runs the parse in an executor and `iter_items_async`
+matches a toplevel list one item at a time on the event loop, giving control back between items.
+"""
+
+import time
+import asyncio
+import concurrent.futures
+import barg
+from typing import AsyncIterator, Dict, List, Optional
+
+# node match steps between two GIL releases of a parse running in a thread
+DEFAULT_YIELD_EVERY = 1000
+
+# (grammar, id(transforms), yield_every) to (transforms, compiled grammar, grammar errors), oldest first
+_GRAMMARS: Dict[tuple, tuple] = {}
+_MAX_GRAMMARS = 32
+
+
+def to_plain(value):
+    """
+    Converts a match result to dicts, lists and scalars, eg. to send it between processes (generated types are
+    created at runtime and cannot be pickled). Structs become dicts of their fields, enums `{tag: value}`.
+    """
+    kind = getattr(value, "type_", None)
+    if kind == barg.GenTyKind.STRUCT:
+        return {k: to_plain(v) for k, v in vars(value).items() if k != "type_"}
+    if kind == barg.GenTyKind.ENUM:
+        return {value.tag: to_plain(value.value)}
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    return value
+
+
+def _install_gil_release(toplevel: "barg.AstToplevel", every: int) -> None:
+    # time.sleep(0) releases the GIL, so the event loop thread runs at least every `every` steps of the parse
+    steps = 0
+
+    def wrap(node: "barg.AstNode", match):
+        def yielding_match(string: str, module: "barg.ModuleInfo", symbol: Optional[str] = None):
+            nonlocal steps
+            gen = match(string, module, symbol)
+            while True:
+                steps += 1
+                if steps >= every:
+                    steps = 0
+                    time.sleep(0)
+                item = next(gen, None)
+                if item is None:
+                    return
+                yield item
+
+        return yielding_match
+
+    barg.instrument(toplevel, wrap)
+
+
+def _compile(
+    grammar: str, error_out: List[str], barg_exec_transforms, yield_every: Optional[int] = None
+) -> "barg.CompiledGrammar":
+    """
+    Compiles `grammar` once per process and transforms: the async entry points are called per request with the same
+    few grammars. The GIL release is installed on the cached grammar, so grammars are cached per `yield_every` too.
+    """
+    key = (grammar, id(barg_exec_transforms), yield_every)
+    cached = _GRAMMARS.get(key)
+    if cached is None:
+        errs = []
+        compiled = barg.compile_grammar(grammar, errs, barg_exec_transforms)
+        if yield_every:
+            _install_gil_release(compiled.toplevel, yield_every)
+        # the transforms are kept alive with the grammar so their id is not reused while it is cached
+        cached = barg_exec_transforms, compiled, errs
+        while len(_GRAMMARS) >= _MAX_GRAMMARS:
+            _GRAMMARS.pop(next(iter(_GRAMMARS)), None)
+        _GRAMMARS[key] = cached
+    error_out.extend(cached[2])
+    return cached[1]
+
+
+def _parse_first(
+    string: str,
+    grammar: str,
+    grammar_toplevel_name: str,
+    barg_exec_transforms,
+    yield_every: Optional[int],
+    plain: bool,
+):
+    errs = []
+    compiled = _compile(grammar, errs, barg_exec_transforms, yield_every)
+    if errs:
+        raise barg.BadGrammarError("\n".join(errs))
+    m = next(compiled.parse(string, grammar_toplevel_name), None)
+    if m is not None and plain:
+        return to_plain(m[0]), m[1]
+    return m
+
+
+async def parse_async(
+    string: str,
+    grammar: str,
+    grammar_toplevel_name: str = "Toplevel",
+    barg_exec_transforms=None,
+    executor: Optional[concurrent.futures.Executor] = None,
+    yield_every: Optional[int] = DEFAULT_YIELD_EVERY,
+):
+    """
+    Parses `string` without blocking the event loop and returns the first match as (value, ncons), or None.
+    The parse runs in `executor` (the loop's default thread pool if None) and releases the GIL every `yield_every`
+    node match steps. In a ProcessPoolExecutor, the value is returned as plain data (see `to_plain`), and
+    `barg_exec_transforms` must be picklable. Grammar errors are raised as BadGrammarError.
+    """
+    plain = isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        _parse_first,
+        string,
+        grammar,
+        grammar_toplevel_name,
+        barg_exec_transforms,
+        None if plain else yield_every,
+        plain,
+    )
+
+
+async def iter_items_async(
+    string: str,
+    grammar: str,
+    error_out: List[str],
+    grammar_toplevel_name: str = "Toplevel",
+    barg_exec_transforms=None,
+) -> AsyncIterator:
+    """
+    Streams the items of a toplevel list rule, awaiting the event loop after every item. Each item is the first
+    match of the list expression at its position and is never backtracked into, ie. the list is matched possessively.
+    Stops at the first position where no item matches or when the list range is full. Like `barg.parse`, it does not
+    require the list to consume the whole input, and the list mode (lazy/greedy) and minimum length are ignored.
+    """
+    module = _compile(grammar, error_out, barg_exec_transforms).context()
+    node = module.definitions.get(grammar_toplevel_name)
+    if not isinstance(node, barg.AstList):
+        raise barg.BadGrammarError(
+            f"streaming requires the toplevel rule '{grammar_toplevel_name}' to be a list"
+        )
+    string = string[module.begin(string):]
+    n = 0
+    while node.range_end is None or n < node.range_end:
+        m = next(node.expression.match(string, module), None)
+        if m is None or not m[1]:
+            # an item that consumes nothing would repeat forever (see AstList._empty_item)
+            break
+        item, ncons = m
+        string = string[ncons:]
+        if module.skip is not None:
+            # between the items (see AstSkip)
+            string = string[module.skip(string, 0):]
+        n += 1
+        if node.keep_attr is None or hasattr(item, node.keep_attr):
+            yield item
+        # the matchers are synchronous, the event loop runs between two items
+        await asyncio.sleep(0)
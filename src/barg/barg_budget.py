@@ -0,0 +1,104 @@
+import barg
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+# the clock is only read every this many steps, reading it on every node match would dominate the budget's overhead
+DEADLINE_CHECK_INTERVAL = 256
+
+
+class ParseBudgetExceeded(Exception):
+    """
+    Raised from inside a parse that took more match steps than its step budget or ran past its deadline.
+    `hottest` holds (rule, line, kind, steps) tuples of the nodes that took the most steps, most steps first.
+    """
+
+    def __init__(
+        self,
+        reason: str,
+        steps: int,
+        elapsed: float,
+        hottest: List[Tuple[str, int, str, int]],
+    ):
+        self.reason = reason
+        self.steps = steps
+        self.elapsed = elapsed
+        self.hottest = hottest
+        rules = "\n".join(
+            f"  {rule} (line {line}, {kind}): {n} steps" for rule, line, kind, n in hottest
+        )
+        super().__init__(
+            f"parse aborted, {reason} after {steps} steps and {elapsed:.3f}s. hottest rules:\n{rules}"
+        )
+
+
+class ParseBudget:
+    """
+    A step budget and wall-clock deadline for a parse. A step is one resumption of a node matcher (its first match
+    attempt or a backtrack into it), so pathological backtracking shows up as a large number of steps.
+    Pass it to `barg.parse(..., budget=ParseBudget(...))`. Each parse of `strings` gets the full budget, counting
+    starts when its first result is requested. `timeout` is in seconds.
+    """
+
+    def __init__(self, max_steps: Optional[int] = None, timeout: Optional[float] = None, hottest: int = 5):
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.n_hottest = hottest
+        self.steps = 0
+        self.counts: Dict[int, int] = {}
+        self._nodes: Dict[int, Tuple[str, int, str]] = {}
+        self._start = 0.0
+        self._next_check = 0
+
+    def install(self, toplevel: "barg.AstToplevel") -> None:
+        names = barg.rule_names(toplevel)
+
+        def wrap(node: "barg.AstNode", match):
+            kind = type(node).__name__.removeprefix("Ast").lower()
+            self._nodes[id(node)] = (names.get(id(node), "<anonymous>"), node.line, kind)
+            return self._budgeted(id(node), match)
+
+        barg.instrument(toplevel, wrap)
+
+    def reset(self) -> None:
+        self.steps = 0
+        self.counts.clear()
+        self._start = perf_counter()
+        self._next_check = DEADLINE_CHECK_INTERVAL
+
+    def hottest(self) -> List[Tuple[str, int, str, int]]:
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+        return [(*self._nodes[key], n) for key, n in ranked[: self.n_hottest]]
+
+    def _step(self, key: int) -> None:
+        self.steps += 1
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self._abort(f"step budget of {self.max_steps} exceeded")
+        if self.timeout is not None and self.steps >= self._next_check:
+            self._next_check += DEADLINE_CHECK_INTERVAL
+            if perf_counter() - self._start > self.timeout:
+                self._abort(f"deadline of {self.timeout}s exceeded")
+
+    def _abort(self, reason: str):
+        raise ParseBudgetExceeded(
+            reason, self.steps, perf_counter() - self._start, self.hottest()
+        )
+
+    def _budgeted(self, key: int, match):
+        step = self._step
+
+        def budgeted_match(string: str, module: "barg.ModuleInfo", symbol: Optional[str] = None):
+            gen = match(string, module, symbol)
+            while True:
+                step(key)
+                item = next(gen, None)
+                if item is None:
+                    return
+                yield item
+
+        return budgeted_match
+
+    def limit(self, results):
+        """Wraps the result generator of one parse so that the budget is reset when the parse starts"""
+        self.reset()
+        yield from results
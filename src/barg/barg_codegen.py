@@ -15,10 +15,6 @@ class CodeGenerator:
         self.mod = mod
         self.uid = 0
 
-    @staticmethod
-    def preprocess_pattern(pattern: str) -> str:
-        return "^" + pattern
-
     def next_uid(self) -> int:
         u = self.uid
         self.uid += 1
@@ -46,6 +42,12 @@ class CodeGenerator:
             self.gen_list(ast)
         elif isinstance(ast, barg.AstToplevel):
             self.gen_toplevel(ast)
+        elif isinstance(ast, barg.AstToken):
+            self.gen_token(ast)
+        elif isinstance(ast, barg.AstTokens):
+            self.gen_tokens(ast)
+        elif isinstance(ast, barg.AstRecover):
+            self.gen_recover(ast)
         else:
             raise TypeError(ast)
 
@@ -76,6 +78,15 @@ class CodeGenerator:
     def gen_toplevel(self, ast: "barg.AstToplevel"):
         raise NotImplementedError
 
+    def gen_token(self, ast: "barg.AstToken"):
+        raise NotImplementedError
+
+    def gen_tokens(self, ast: "barg.AstTokens"):
+        raise NotImplementedError
+
+    def gen_recover(self, ast: "barg.AstRecover"):
+        raise NotImplementedError
+
 
 class PyCGInternalGenSymbol:
     """
@@ -116,11 +127,25 @@ class PythonCodeGenerator(CodeGenerator):
     ```
     """
 
-    def __init__(self, ast: "barg.AstToplevel", mod: "barg.ModuleInfo"):
+    def __init__(
+        self, ast: "barg.AstToplevel", mod: "barg.ModuleInfo", traced: bool = False
+    ):
         super().__init__(ast, mod)
+        # if set, the parser gets a `_set_tracer_` function (see gen_tracing)
+        self.traced = traced
+        self.rule_names = barg.rule_names(ast)
+        # lists over these nodes need a guard against items that consume no input (see AstList._empty_item)
+        self.nullable = barg.compute_nullable(ast)
         self.match_functions: Dict["barg.AstNode", PyCGInternalGenSymbol] = {}
         self.class_defs: Dict["barg.AstNode", PyCGInternalGenSymbol] = {}
         self.glob_assigns: Dict["barg.AstNode", PyCGInternalGenSymbol] = {}
+        self.scanner_code = ""  # filled in by gen_tokens if the grammar has a tokens section
+        # if set, structs and lists call `_skip_` between their fields/items (see barg.AstSkip and gen_skip)
+        self.skip = ast.skip is not None
+        # set by gen_recover, the runtime then defines `_ErrorNode_` (see barg.ErrorNode)
+        self.recovers = False
+        # prescanned leaf pattern to the name of its per-input table (see gen_prescanned and barg.LeafIndex)
+        self.prescan_tables: Dict[str, str] = {}
         self.gen_ast(ast)
 
     def codegen(self, head: Optional[str] = None) -> str:
@@ -131,7 +156,8 @@ class PythonCodeGenerator(CodeGenerator):
         """
         head = (
             """\
-import regex
+import re as _re_
+import regex as _regex_
 from enum import Enum as _Enum_
 from typing import Any as _Any_, Dict as _Dict_, Callable as _Callable_
 
@@ -142,7 +168,8 @@ def _wrap_in_parsable_type_(func):
     class Ty:
         @staticmethod
         def parse(text: str):
-            return next(func(text))[0]
+            start = _begin_parse_(text)
+            return next(func(text[start:]))[0]
 
     return Ty
 
@@ -186,7 +213,154 @@ def _get_transform_(transforms: _Dict_[str, _Any_], full_name: str) -> _Callable
         funcs = "\n\n".join(unique_codes(self.match_functions.values()))
         classes = "\n\n".join(unique_codes(self.class_defs.values()))
         glob_assigns = "\n".join(unique_codes(self.glob_assigns.values()))
-        return "\n\n".join((head, funcs, classes, glob_assigns))
+        parts = [head, self.gen_runtime(), funcs, classes, glob_assigns]
+        if self.traced:
+            parts.append(self.gen_tracing())
+        return "\n\n".join(parts)
+
+    def gen_tracing(self) -> str:
+        """
+        Generates `_set_tracer_(tracer)`, which rebinds every matcher to a wrapper reporting its events to the tracer
+        (see barg.Tracer), and restores the plain matchers when called with None.
+        Matchers call each other through their global names, so untraced parses run the plain matchers at no cost.
+        """
+        entries = []
+        seen = set()
+        for node, symbol in self.match_functions.items():
+            if id(symbol) in seen:
+                continue
+            seen.add(id(symbol))
+            kind = type(node).__name__.removeprefix("Ast").lower()
+            rule = self.rule_names.get(id(node), "<anonymous>")
+            entries.append(f'    "{symbol.name}": ("{rule}", {node.line}, "{kind}"),')
+        entries = "\n".join(entries)
+        return f"""\
+_TRACER_ = None
+_TRACED_MATCHERS_ = {{
+{entries}
+}}
+_UNTRACED_MATCHERS_ = {{}}
+
+
+class _TracedNode_:
+    def __init__(self, rule: str, line: int, kind: str):
+        self.rule = rule
+        self.line = line
+        self.kind = kind
+
+
+def _trace_gen_(node, gen, pos):
+    tracer = _TRACER_
+    tracer.enter(node, pos)
+    try:
+        yielded = False
+        while True:
+            if yielded:
+                tracer.backtrack(node, pos)
+            item = next(gen, None)
+            if item is None:
+                return
+            if node.kind == "transform":
+                tracer.transform(node, pos, item[1])
+            tracer.match(node, pos, item[1])
+            yielded = True
+            yield item
+    finally:
+        tracer.exit(node, pos)
+
+
+def _traced_(node, match):
+    def traced(text: str, *args):
+        if args:
+            # a list matcher recursing into itself is part of the same match
+            return match(text, *args)
+        return _trace_gen_(node, match(text), _INPUT_LEN_ - len(text))
+
+    return traced
+
+
+def _set_tracer_(tracer):
+    global _TRACER_
+    g = globals()
+    if not _UNTRACED_MATCHERS_:
+        _UNTRACED_MATCHERS_.update((name, g[name]) for name in _TRACED_MATCHERS_)
+    _TRACER_ = tracer
+    for name, info in _TRACED_MATCHERS_.items():
+        match = _UNTRACED_MATCHERS_[name]
+        g[name] = match if tracer is None else _traced_(_TracedNode_(*info), match)
+"""
+
+    def gen_runtime(self) -> str:
+        """
+        Generates the per-input state, the `_begin_parse_` function every parse entry point calls before matching
+        (it returns the offset matching starts at) and the runtime helpers of the matchers.
+        """
+        start = "_skip_(text, 0)" if self.skip else "0"
+        error_node = (
+            """
+
+class _ErrorNode_:
+    type_ = _GenTyKind_.STRUCT
+
+    def __init__(self, start: int, end: int, text: str):
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def __str__(self):
+        return f"error {{start: {self.start}, end: {self.end}, text: {self.text!r}}}"
+"""
+            if self.recovers
+            else ""
+        )
+        prescan = ""
+        leaf_index = ""
+        if self.prescan_tables:
+            tables = ", ".join(self.prescan_tables.values())
+            prescan = "\n" + indent(
+                f"global {tables}\n"
+                + "\n".join(
+                    f"{table} = _leaf_index_({table}pat_, text)" for table in self.prescan_tables.values()
+                )
+            )
+            # mirrors barg.LeafIndex
+            leaf_index = """
+
+from array import array as _array_
+
+
+def _leaf_index_(pat, text: str):
+    table = _array_("q", [-1]) * (len(text) + 1)
+    matches = [(m.start(), m.end()) for m in pat.finditer(text)]
+    for start, end in reversed(matches):
+        if end - start > 1:
+            table[start + 1 : end] = _array_("q", [-2]) * (end - start - 1)
+        table[start] = end
+    return table
+"""
+        return f"""\
+_INPUT_LEN_ = 0
+_TOKEN_TYPES_ = []
+_TOKEN_STARTS_ = []
+_TOKEN_ENDS_ = []
+_TOKEN_INDEX_ = {{}}
+
+
+def _begin_parse_(text: str):
+    global _INPUT_LEN_
+    _INPUT_LEN_ = len(text)
+{indent(self.scanner_code)}{prescan}
+    return {start}
+
+
+def _cons_to_list_(cons):
+    out = []
+    while cons is not None:
+        item, cons = cons
+        out.append(item)
+    out.reverse()
+    return out
+{error_node}{leaf_index}"""
 
     def gen_string(self, ast: "barg.AstString"):
         if ast in self.match_functions:
@@ -194,18 +368,98 @@ def _get_transform_(transforms: _Dict_[str, _Any_], full_name: str) -> _Callable
 
         u = self.next_uid()
 
-        code = f"""\
+        content = ast.value.replace('"', '\\"')
+        if ast.backtrack:
+            # see barg.AstString.alternatives
+            code = f"""\
 # generated from barg grammar line {ast.line}
-# regex matcher
+# backtracking regex matcher
 def _match{u}_(text: str):
-    for m in _pat{u}_.finditer(text, overlapped=True):
-        yield m.group(0), m.end(0)
+    m = _pat{u}_longest_.match(text)
+    if m is None:
+        return
+    end = m.end()
+    yield text[:end], end
+    for end in range(end - 1, -1, -1):
+        if _pat{u}_.fullmatch(text, 0, end) is not None:
+            yield text[:end], end
 """
+            pats = (
+                f'_pat{u}_ = _regex_.compile(r"""{content}""")\n'
+                f'_pat{u}_longest_ = _regex_.compile(r"""{content}""", _regex_.POSIX)'
+            )
+        elif ast.value in self.mod.grammar.prescan:
+            code, pats = self.gen_prescanned(ast, u)
+        else:
+            code, pats = self.gen_leaf(ast, u, barg.plan_leaf(ast.value))
         self.match_functions[ast] = PyCGInternalGenSymbol(f"_match{u}_", code)
-        content = self.preprocess_pattern(ast.value).replace('"', '\\"')
-        self.glob_assigns[ast] = PyCGInternalGenSymbol(
-            f"_pat{u}_", f'_pat{u}_ = _regex_.compile(r"""{content}""")'
-        )
+        self.glob_assigns[ast] = PyCGInternalGenSymbol(f"_pat{u}_", pats)
+
+    def gen_prescanned(self, ast: "barg.AstString", u: int):
+        """
+        Returns the matcher and the global definitions of a leaf that is looked up in the table `_begin_parse_`
+        builds for its pattern (see barg.LeafIndex). Offsets the scan did not try go to the plain matcher.
+        """
+        v = self.next_uid()
+        fallback, pats = self.gen_leaf(ast, v, barg.plan_leaf(ast.value))
+        table = self.prescan_tables.get(ast.value)
+        if table is None:
+            table = f"_prescan{u}_"
+            self.prescan_tables[ast.value] = table
+            plan = barg.plan_leaf(ast.value)
+            engine = "_re_" if plan.kind == "regex" and plan.engine == "re" else "_regex_"
+            pats += f"\n{table}pat_ = {engine}.compile({ast.value!r})\n{table} = None"
+        code = f"""\
+# generated from barg grammar line {ast.line}
+# prescanned leaf matcher
+def _match{u}_(text: str):
+    pos = _INPUT_LEN_ - len(text)
+    end = {table}[pos]
+    if end >= 0:
+        yield text[: end - pos], end - pos
+    elif end == -2:
+        yield from _match{v}_(text)
+
+
+{fallback}"""
+        return code, pats
+
+    def gen_leaf(self, ast: "barg.AstString", u: int, plan: "barg.LeafPlan"):
+        """Returns the matcher and the global definitions of a non-backtracking leaf, mirroring plan.matcher()"""
+        if plan.kind == "literal":
+            code = f"""\
+# generated from barg grammar line {ast.line}
+# literal matcher
+def _match{u}_(text: str):
+    if text.startswith(_lit{u}_):
+        yield _lit{u}_, {len(plan.text)}
+"""
+            return code, f"_lit{u}_ = {plan.text!r}"
+        if plan.kind == "run":
+            empty = "\n    else:\n        yield '', 0" if plan.min_count == 0 else ""
+            code = f"""\
+# generated from barg grammar line {ast.line}
+# character class run matcher
+def _match{u}_(text: str):
+    if text and text[0] in _chars{u}_:
+        end = _pat{u}_.match(text).end()
+        yield text[:end], end{empty}
+"""
+            pats = (
+                f"_chars{u}_ = frozenset({''.join(sorted(plan.chars))!r})\n"
+                f"_pat{u}_ = _re_.compile({plan.run_pattern()!r})"
+            )
+            return code, pats
+        code = f"""\
+# generated from barg grammar line {ast.line}
+# regex matcher ({plan.engine} engine)
+def _match{u}_(text: str):
+    m = _pat{u}_.match(text)
+    if m is not None:
+        yield m.group(), m.end()
+"""
+        engine = "_re_" if plan.engine == "re" else "_regex_"
+        return code, f"_pat{u}_ = {engine}.compile({plan.pattern!r})"
 
     def gen_list(self, ast: "barg.AstList"):
         if ast in self.match_functions:
@@ -222,47 +476,69 @@ def _match{u}_(text: str):
             self.gen_ast(ast.expression)
 
         ast_matcher = self.match_functions[ast.expression]
+        # matched_exprs is a cons list of the kept items (see barg.cons_to_list), n counts the matched items
+        if ast.keep_mark is not None:
+            # filtered list (see barg.push_down_transforms): unmarked items are dropped
+            kept = f'(local_m, matched_exprs) if hasattr(local_m, "{ast.keep_attr}") else matched_exprs'
+        else:
+            kept = "(local_m, matched_exprs)"
         end_cond = (
             f"""\
-    if len(matched_exprs) >= {ast.range_end}:
+    if n >= {ast.range_end}:
         return"""
             if ast.range_end is not None
             else ""
         )
+        empty_cond = (
+            f"""\
+        if not local_ncons:
+            if n < {ast.range_start}:
+                yield _cons_to_list_({kept}), 0
+            continue"""
+            if id(ast.expression) in self.nullable
+            else ""
+        )
+
+        if self.skip:
+            # skipped input between items only counts if another item follows (see barg.AstSkip)
+            recurse = f"""\
+        start = _skip_(text, local_ncons)
+        for m, ncons in _match{u}_(
+            text[start:], {kept}, n + 1
+        ):
+            yield m, start + ncons if ncons else local_ncons"""
+        else:
+            recurse = f"""\
+        for m, ncons in _match{u}_(
+            text[local_ncons:], {kept}, n + 1
+        ):
+            yield m, local_ncons + ncons"""
 
         if ast.mode == "lazy":
             code = f"""\
 # generated from barg grammar line {ast.line}
 # lazy list matcher
-def _match{u}_(text: str, matched_exprs=None):
-    if matched_exprs is None:
-        matched_exprs = []
+def _match{u}_(text: str, matched_exprs=None, n=0):
 {end_cond}
-    if {ast.range_start} <= len(matched_exprs):
-        yield matched_exprs, 0
+    if {ast.range_start} <= n:
+        yield _cons_to_list_(matched_exprs), 0
 
     for local_m, local_ncons in {ast_matcher.name}(text):
-        for m, ncons in _match{u}_(
-            text[local_ncons:], matched_exprs + [local_m]
-        ):
-            yield m, local_ncons + ncons
+{empty_cond}
+{recurse}
 """
         else:
             code = f"""\
 # generated from barg grammar line {ast.line}
 # greedy list matcher
-def _match{u}_(text: str, matched_exprs=None):
-    if matched_exprs is None:
-        matched_exprs = []
+def _match{u}_(text: str, matched_exprs=None, n=0):
 {end_cond}
     for local_m, local_ncons in {ast_matcher.name}(text):
-        for m, ncons in _match{u}_(
-            text[local_ncons:], matched_exprs + [local_m]
-        ):
-            yield m, local_ncons + ncons
+{empty_cond}
+{recurse}
 
-    if {ast.range_start} <= len(matched_exprs):
-        yield matched_exprs, 0
+    if {ast.range_start} <= n:
+        yield _cons_to_list_(matched_exprs), 0
 
 """
         self.match_functions[ast].code = code
@@ -294,9 +570,13 @@ def _match{u}_(text: str, matched_exprs=None):
                 f"{ast.identifier} = {self.glob_assigns[ast.expression].name}",
             )
         else:
+            matcher = self.match_functions[ast.expression].name
+            if self.traced:
+                # look the matcher up on every call, _set_tracer_ rebinds it
+                matcher = f"lambda text: {matcher}(text)"
             self.glob_assigns[ast] = PyCGInternalGenSymbol(
                 ast.identifier,
-                f"{ast.identifier} = _wrap_in_parsable_type_({self.match_functions[ast.expression].name})",
+                f"{ast.identifier} = _wrap_in_parsable_type_({matcher})",
             )
 
     def gen_text_string(self, ast: "barg.AstTextString"):
@@ -304,9 +584,9 @@ def _match{u}_(text: str, matched_exprs=None):
             return
 
         u = self.next_uid()
-        content = ast.value.replace('"', '\\"')
+        # python code, so it must survive literally (quotes included)
         self.glob_assigns[ast] = PyCGInternalGenSymbol(
-            f"_text{u}_", f'_text{u}_ = _TextString_(r"""{content}""")'
+            f"_text{u}_", f"_text{u}_ = _TextString_({ast.value!r})"
         )
 
     def gen_transform(self, ast: "barg.AstTransform"):
@@ -324,6 +604,21 @@ def _match{u}_(text: str, matched_exprs=None):
             self.gen_ast(ast.pattern_arg)
 
         matcher = self.match_functions[ast.pattern_arg]
+        args_str = self.transform_args(ast)
+
+        self.match_functions[
+            ast
+        ].code = f"""\
+# generated from barg grammar line {ast.line}
+# transform matcher
+def _match{u}_(text: str):
+    transform = _get_transform_(_TRANSFORMS_, r"{ast.name}")
+    for m, ncons in {matcher.name}(text):
+        yield transform(text, ncons, m, {', '.join(args_str)})
+"""
+
+    @staticmethod
+    def transform_args(ast: "barg.AstTransform") -> List[str]:
         args_str = []
         for arg in ast.args:
             if isinstance(arg, int):
@@ -331,23 +626,67 @@ def _match{u}_(text: str, matched_exprs=None):
             elif isinstance(arg, str):
                 args_str.append(f'r"""{arg}"""')
             elif isinstance(arg, barg.AstTextString):
-                content = arg.value.replace('"', '\\"')
-                args_str.append(f'_TextString_(r"""{content}""")')
+                args_str.append(f"_TextString_({arg.value!r})")
             else:
                 raise barg.InternalError(
                     "invalid type of transform arg encountered (should have failed earlier with BadGrammarError but didn't)"
                 )
+        return args_str
 
-        self.match_functions[
-            ast
-        ].code = f"""\
-# generated from barg grammar line {ast.line}
-# transform matcher
-def _match{u}_(text: str):
-    transform = _get_transform_(_TRANSFORMS_, r"{ast.name}")
-    for m, ncons in {matcher.name}(text):
-        yield transform(text, ncons, m, {', '.join(args_str)})
-"""
+    def gen_leaf_block(self, block, name: str) -> str:
+        """
+        Returns the global definitions of a merged run of leaf variants (see barg.AstEnum.alternation): `{name}_` maps
+        (text, start) to (i, end) like AlternationPlan.first() and `{name}_vars_` holds the tag and the transforms
+        (innermost first) of each variant.
+        """
+        plan = block.plan
+        if plan.kind == "literals":
+            table = tuple(sorted(plan.table.items()))
+            lengths = tuple(len(text) for text in plan.texts)
+            first = f"""\
+{name}_table_ = {table!r}
+{name}_lengths_ = {lengths!r}
+
+
+def {name}_(text: str, start: int):
+    best = None
+    for n, by_text in {name}_table_:
+        indices = by_text.get(text[:n])
+        if indices is not None:
+            for i in indices:
+                if i >= start:
+                    if best is None or i < best:
+                        best = i
+                    break
+    return None if best is None else (best, {name}_lengths_[best])"""
+        else:
+            pats = ",\n".join(
+                f"    _regex_.compile({plan.branches(i)!r})" for i in range(len(plan.patterns))
+            )
+            first = f"""\
+{name}_pats_ = (
+{pats},
+)
+
+
+def {name}_(text: str, start: int):
+    m = {name}_pats_[start].match(text)
+    return None if m is None else (int(m.lastgroup[1:]), m.end())"""
+        variants = []
+        for tag, _, transforms in block.entries:
+            chain = ", ".join(
+                f'(r"{node.name}", ({"".join(arg + ", " for arg in self.transform_args(node))}))'
+                for node in reversed(transforms)
+            )
+            variants.append(f"    ('{tag}', ({chain}{',' if transforms else ''})),")
+        variants = "\n".join(variants)
+        return f"""\
+{first}
+
+
+{name}_vars_ = (
+{variants}
+)"""
 
     def gen_enum(self, ast: "barg.AstEnum"):
         if ast in self.class_defs or ast in self.match_functions:
@@ -375,20 +714,89 @@ class _Ty{u}_:
 
     @staticmethod
     def parse(text: str):
-        return next(_match{u}_(text))[0]
+        start = _begin_parse_(text)
+        return next(_match{u}_(text[start:]))[0]
 """,
         )
 
         # generate matching function
+        # runs of leaf variants are matched in one step (see barg.AstEnum.alternation), except in traced parsers, which
+        # report every variant
+        groups = ast.variants if self.traced else ast.alternation(self.mod)
+        blocks = []
         loops = []
-        for tag, expr in ast.variants:
+        for group in groups:
+            if not isinstance(group, tuple):
+                # a merged run of leaf variants, plain variants are (tag, expression) tuples
+                name = f"_alt{u}_{len(blocks)}"
+                blocks.append(self.gen_leaf_block(group, name))
+                value = f"""\
+tag, chain = {name}_vars_[i]
+m, ncons = text[:end], end
+for transform, args in chain:
+    m, ncons = _get_transform_(_TRANSFORMS_, transform)(text, ncons, m, *args)"""
+                if ast.mode == "all":
+                    loops.append(
+                        f"""\
+start = 0
+while start < {len(group.entries)}:
+    hit = {name}_(text, start)
+    if hit is None:
+        break
+    i, end = hit
+{indent(value)}
+    yield _Ty{u}_(tag, m), ncons
+    start = i + 1"""
+                    )
+                else:
+                    loops.append(
+                        f"""\
+hit = {name}_(text, 0)
+if hit is not None:
+    i, end = hit
+{indent(value)}
+    yield _Ty{u}_(tag, m), ncons
+    return"""
+                    )
+                continue
+            tag, expr = group
             if expr not in self.match_functions:
                 self.gen_ast(expr)
-            body = indent(f"yield _Ty{u}_('{tag}', m), ncons")
+            matcher = self.match_functions[expr].name
+            if ast.mode == "all":
+                body = indent(f"yield _Ty{u}_('{tag}', m), ncons")
+                loops.append(f"for m, ncons in {matcher}(text):\n{body}")
+            else:
+                # only the first match of each variant is considered, the generator is closed right away
+                loops.append(
+                    f"""\
+gen = {matcher}(text)
+item = next(gen, None)
+gen.close()"""
+                )
+                if ast.mode == "first":
+                    loops.append(
+                        f"""\
+if item is not None:
+    yield _Ty{u}_('{tag}', item[0]), item[1]
+    return"""
+                    )
+                else:
+                    loops.append(
+                        f"""\
+if item is not None and (best is None or item[1] > best[2]):
+    best = '{tag}', item[0], item[1]"""
+                    )
+        if ast.mode == "longest":
+            loops.insert(0, "best = None")
             loops.append(
-                f"for m, ncons in {self.match_functions[expr].name}(text):\n{body}"
+                f"""\
+if best is not None:
+    yield _Ty{u}_(best[0], best[1]), best[2]"""
             )
         loops = "\n".join(loops)
+        if blocks:
+            self.glob_assigns[ast] = PyCGInternalGenSymbol(f"_alt{u}_", "\n\n\n".join(blocks))
         self.match_functions[
             ast
         ].code = f"""\
@@ -428,7 +836,8 @@ class _Ty{u}_:
 
     @staticmethod
     def parse(text: str):
-        return next(_match{u}_(text))[0]
+        start = _begin_parse_(text)
+        return next(_match{u}_(text[start:]))[0]
 """,
         )
 
@@ -436,11 +845,33 @@ class _Ty{u}_:
         def get_local_ncons_up_to(n):
             return " + ".join("local_ncons" + str(i) for i in range(n))
 
-        nested_fors = f"yield _Ty{u}_({', '.join('local_m' + str(i) for i in range(len(ast.fields)))}), {get_local_ncons_up_to(len(ast.fields))}"
-        for i, (_, expr) in reversed(list(enumerate(ast.fields))):
-            if expr not in self.match_functions:
-                self.gen_ast(expr)
-            nested_fors = f"for local_m{i}, local_ncons{i} in {self.match_functions[expr].name}(text{('[' + get_local_ncons_up_to(i) + ':]') if i > 0 else ''}):\n{indent(nested_fors)}"
+        # discarded fields (see barg.push_down_transforms) are matched but not stored
+        field_values = (
+            "None" if discarded else f"local_m{i}"
+            for i, discarded in enumerate(ast.discarded)
+        )
+        if self.skip:
+            # end{i} is where the match of the first i + 1 fields ends, the skipped input in front of a field only
+            # counts if the field matches something (see barg.AstSkip)
+            nested_fors = f"yield _Ty{u}_({', '.join(field_values)}), end{len(ast.fields) - 1}"
+            for i, (_, expr) in reversed(list(enumerate(ast.fields))):
+                if expr not in self.match_functions:
+                    self.gen_ast(expr)
+                matcher = self.match_functions[expr].name
+                if i == 0:
+                    nested_fors = f"for local_m0, end0 in {matcher}(text):\n{indent(nested_fors)}"
+                else:
+                    nested_fors = f"""\
+start{i} = _skip_(text, end{i - 1})
+for local_m{i}, local_ncons{i} in {matcher}(text[start{i}:]):
+    end{i} = start{i} + local_ncons{i} if local_ncons{i} else end{i - 1}
+{indent(nested_fors)}"""
+        else:
+            nested_fors = f"yield _Ty{u}_({', '.join(field_values)}), {get_local_ncons_up_to(len(ast.fields))}"
+            for i, (_, expr) in reversed(list(enumerate(ast.fields))):
+                if expr not in self.match_functions:
+                    self.gen_ast(expr)
+                nested_fors = f"for local_m{i}, local_ncons{i} in {self.match_functions[expr].name}(text{('[' + get_local_ncons_up_to(i) + ':]') if i > 0 else ''}):\n{indent(nested_fors)}"
 
         self.match_functions[
             ast
@@ -451,6 +882,174 @@ def _match{u}_(text: str):
 {indent(nested_fors)}
 """
 
+    def gen_token(self, ast: "barg.AstToken"):
+        if ast in self.match_functions:
+            return
+
+        u = self.next_uid()
+
+        if ast.skip:
+            code = f"""\
+# generated from barg grammar line {ast.line}
+# skip token matcher ({ast.name})
+def _match{u}_(text: str):
+    raise _BadGrammarError_(
+        "skip token '{ast.name}' is dropped by the lexer and cannot be used in rules", {ast.line}
+    )
+    yield
+"""
+            self.match_functions[ast] = PyCGInternalGenSymbol(f"_match{u}_", code)
+            return
+
+        code = f"""\
+# generated from barg grammar line {ast.line}
+# token matcher ({ast.name})
+def _match{u}_(text: str):
+    pos = _INPUT_LEN_ - len(text)
+    i = _TOKEN_INDEX_.get(pos)
+    if i is not None and _TOKEN_TYPES_[i] == {ast.type_id}:
+        end = _TOKEN_ENDS_[i]
+        yield text[_TOKEN_STARTS_[i] - pos : end - pos], end - pos
+"""
+        self.match_functions[ast] = PyCGInternalGenSymbol(f"_match{u}_", code)
+
+    def gen_tokens(self, ast: "barg.AstTokens"):
+        content = ast.pattern.replace('"', '\\"')
+        self.glob_assigns[ast] = PyCGInternalGenSymbol(
+            "_TOKEN_PAT_", f'_TOKEN_PAT_ = _regex_.compile(r"""{content}""")'
+        )
+        groups = ", ".join(
+            f'"{group}": ({tok.type_id}, {tok.skip})'
+            for group, tok in ast.by_group.items()
+        )
+        # mirrors barg.TokenStream
+        self.scanner_code = f"""\
+global _TOKEN_TYPES_, _TOKEN_STARTS_, _TOKEN_ENDS_, _TOKEN_INDEX_
+groups = {{{groups}}}
+_TOKEN_TYPES_, _TOKEN_STARTS_, _TOKEN_ENDS_, _TOKEN_INDEX_ = [], [], [], {{}}
+pos = 0
+lead = 0
+while pos < len(text):
+    m = _TOKEN_PAT_.match(text, pos)
+    if m is None or m.end() == pos:
+        lead = None
+        pos += 1
+        continue
+    type_id, skip = groups[m.lastgroup]
+    if not skip:
+        i = len(_TOKEN_TYPES_)
+        _TOKEN_TYPES_.append(type_id)
+        _TOKEN_STARTS_.append(pos)
+        _TOKEN_ENDS_.append(m.end())
+        if lead is not None:
+            _TOKEN_INDEX_[lead] = i
+        _TOKEN_INDEX_[pos] = i
+        lead = m.end()
+    pos = m.end()"""
+
+    def gen_skip(self, ast: "barg.AstSkip"):
+        """Generates `_skip_(text, pos)`, the scanner of the %skip rule, mirroring barg.LeafPlan.scanner()"""
+        plan = barg.plan_leaf(ast.pattern)
+        if plan.kind == "literal":
+            pats = f"_SKIP_LIT_ = {plan.text!r}"
+            body = f"return pos + {len(plan.text)} if text.startswith(_SKIP_LIT_, pos) else pos"
+        elif plan.kind == "run":
+            pats = (
+                f"_SKIP_CHARS_ = frozenset({''.join(sorted(plan.chars))!r})\n"
+                f"_SKIP_PAT_ = _re_.compile({plan.run_pattern()!r})"
+            )
+            body = """\
+if pos < len(text) and text[pos] in _SKIP_CHARS_:
+    return _SKIP_PAT_.match(text, pos).end()
+return pos"""
+        else:
+            engine = "_re_" if plan.engine == "re" else "_regex_"
+            pats = f"_SKIP_PAT_ = {engine}.compile({plan.pattern!r})"
+            body = """\
+m = _SKIP_PAT_.match(text, pos)
+return pos if m is None else m.end()"""
+        # not a matcher (it yields no values), so it is not traced either
+        self.glob_assigns[ast] = PyCGInternalGenSymbol(
+            "_skip_",
+            f"""\
+{pats}
+
+
+# generated from barg grammar line {ast.line}
+# skip rule scanner
+def _skip_(text: str, pos: int) -> int:
+{indent(body)}
+""",
+        )
+
+    def gen_recover(self, ast: "barg.AstRecover"):
+        if ast in self.match_functions:
+            return
+
+        u = self.next_uid()
+        self.recovers = True
+
+        self.match_functions[ast] = PyCGInternalGenSymbol(
+            f"_match{u}_",
+            None,
+        )
+
+        if ast.expression not in self.match_functions:
+            self.gen_ast(ast.expression)
+        matcher = self.match_functions[ast.expression]
+
+        # mirrors barg.AstRecover._search
+        pattern = ast.sync_pattern(self.mod)
+        if pattern is not None:
+            self.glob_assigns[ast] = PyCGInternalGenSymbol(
+                f"_sync{u}_", f"_sync{u}_ = _regex_.compile({pattern!r})"
+            )
+            search = f"""\
+    s = _sync{u}_.search(text)
+    if s is None:
+        return
+    end = s.end()"""
+        else:
+            sync_matchers = []
+            for sync in ast.syncs:
+                if sync not in self.match_functions:
+                    self.gen_ast(sync)
+                sync_matchers.append(self.match_functions[sync].name)
+            search = f"""\
+    end = None
+    for start in range(len(text) + 1):
+        for sync in ({', '.join(sync_matchers)},):
+            for _, ncons in sync(text[start:]):
+                end = start + ncons
+                break
+            if end is not None:
+                break
+        if end is not None:
+            break
+    if end is None:
+        return"""
+
+        self.match_functions[
+            ast
+        ].code = f"""\
+# generated from barg grammar line {ast.line}
+# recovering matcher
+def _match{u}_(text: str):
+    matched = False
+    for m in {matcher.name}(text):
+        matched = True
+        yield m
+    if matched:
+        return
+{search}
+    pos = _INPUT_LEN_ - len(text)
+    yield _ErrorNode_(pos, pos + end, text[:end]), end
+"""
+
     def gen_toplevel(self, ast: "barg.AstToplevel"):
+        if ast.skip is not None:
+            self.gen_skip(ast.skip)
+        if ast.tokens is not None:
+            self.gen_tokens(ast.tokens)
         for defn in ast.assignments:
             self.gen_assignment(defn)
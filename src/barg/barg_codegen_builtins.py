@@ -1,4 +1,6 @@
 # NOTE: this code will be C-header-style inserted into the generated parsers. "Unused" imports aren't actually unused.
+import ast as _ast_
+import re as _re_
 import regex as _regex_
 from enum import Enum as _Enum_
 from typing import (
@@ -15,7 +17,8 @@ def _wrap_in_parsable_type_(func):
     class Ty:
         @staticmethod
         def parse(text: str):
-            return next(func(text))[0]
+            start = _begin_parse_(text)
+            return next(func(text[start:]))[0]
 
     return Ty
 
@@ -41,6 +44,14 @@ class _GenTyKind_(_Enum_):
     ENUM = 1
 
 
+class _BargNamespace_:
+    """What pyexpr/pyscript code sees as `barg` in generated parsers (the subset that makes sense without barg)"""
+
+    GenTyKind = _GenTyKind_
+    BadGrammarError = _BadGrammarError_
+    InternalError = _InternalError_
+
+
 # NOTE: '|Any ' in field so it can be called in non-type-safe way from other places
 def _builtin_take_(text: str, ncons: int, m, field: _Optional_[str] | _Any_ = None):
     if field is not None and not isinstance(field, str):
@@ -115,6 +126,80 @@ def _builtin_filter_(text: str, ncons: int, m, mark: str):
     return list(filter(lambda item: hasattr(item, f"mark_{mark}_"), m)), ncons
 
 
+def _builtin_strip_quotes_(text: str, ncons: int, m):
+    # same as the pyexpr `x[1:-1]`, without the eval
+    return m[1:-1], ncons
+
+
+_CONSTS_ = {}  # python literal to its value, for immutable values only
+
+
+def _immutable_literal_(value) -> bool:
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return True
+    if isinstance(value, (tuple, frozenset)):
+        return all(_immutable_literal_(item) for item in value)
+    return False
+
+
+def _builtin_const_(text: str, ncons: int, m, value: "_TextString_ | str | int | _Any_"):
+    """
+    Discards the match and returns a python literal. Immutable values are evaluated once and shared between all
+    matches, mutable ones (lists, dicts, sets) are evaluated anew for every match, like the pyexpr would.
+    """
+    if isinstance(value, int):
+        return value, ncons
+    code = value.value if isinstance(value, _TextString_) else value
+    if code in _CONSTS_:
+        return _CONSTS_[code], ncons
+    try:
+        result = _ast_.literal_eval(code)
+    except (ValueError, SyntaxError, TypeError):
+        raise _BadGrammarError_(
+            f"the value parameter of the const builtin must be a python literal, not '{code}'"
+        )
+    if _immutable_literal_(result):
+        _CONSTS_[code] = result
+    return result, ncons
+
+
+def _builtin_bool_(text: str, ncons: int, m):
+    if m == "true":
+        return True, ncons
+    elif m == "false":
+        return False, ncons
+    raise _BadGrammarError_(
+        f"the match parameter of the bool builtin must be 'true' or 'false', not {m!r}"
+    )
+
+
+_ESCAPES_ = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+# a UTF-16 surrogate pair (as JSON writes characters outside the BMP) is one escape
+_ESCAPE_PAT_ = _regex_.compile(
+    r"\\(u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F][0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|.)", _regex_.DOTALL
+)
+
+
+def _unescape_one_(m) -> str:
+    esc = m.group(1)
+    if len(esc) == 11:
+        return chr(0x10000 + ((int(esc[1:5], 16) - 0xD800) << 10) + int(esc[7:], 16) - 0xDC00)
+    if len(esc) == 5:
+        return chr(int(esc[1:], 16))
+    return _ESCAPES_.get(esc, esc)
+
+
+def _builtin_unescape_(text: str, ncons: int, m):
+    """Resolves JSON-style backslash escapes (\\n, \\", \\u00e4, ...)"""
+    if not isinstance(m, str):
+        raise _BadGrammarError_(
+            f"the match parameter of the unescape builtin must be a string match, not type {type(m)}",
+        )
+    if "\\" not in m:
+        return m, ncons
+    return _ESCAPE_PAT_.sub(_unescape_one_, m), ncons
+
+
 def _builtin_pyexpr_(
     text: str, ncons: int, m, pyexpr: "_TextString_ | str | _Any_", *args
 ):
@@ -133,7 +218,7 @@ def _builtin_pyexpr_(
                 f"variable '{pyexpr}' does not refer to a text string (but has to)"
             )
         code = defn.value
-    globs = {"x": m, "args": args, "ncons": ncons, "text": text}
+    globs = {"x": m, "args": args, "ncons": ncons, "text": text, "barg": _BargNamespace_}
     return eval(code, globs), globs["ncons"]
 
 
@@ -155,7 +240,7 @@ def _builtin_pyscript_(
                 f"variable '{pyscript}' does not refer to a text string (but has to)"
             )
         code = defn.value
-    globs = {"x": m, "args": args, "ncons": ncons, "text": text}
+    globs = {"x": m, "args": args, "ncons": ncons, "text": text, "barg": _BargNamespace_}
     exec(code, globs)
     return globs["x"], globs["ncons"]
 
@@ -191,6 +276,10 @@ def _insert_all_builtins_(transforms):
     _insert_transform_(transforms, "builtin.filter", _builtin_filter_)
     _insert_transform_(transforms, "builtin.pyexpr", _builtin_pyexpr_)
     _insert_transform_(transforms, "builtin.pyscript", _builtin_pyscript_)
+    _insert_transform_(transforms, "builtin.strip_quotes", _builtin_strip_quotes_)
+    _insert_transform_(transforms, "builtin.const", _builtin_const_)
+    _insert_transform_(transforms, "builtin.bool", _builtin_bool_)
+    _insert_transform_(transforms, "builtin.unescape", _builtin_unescape_)
 
 
 _insert_all_builtins_(_TRANSFORMS_)
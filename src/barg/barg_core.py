@@ -1,8 +1,10 @@
+import ast as python_ast
 import traceback
 import regex
 import barg
+from array import array
 from enum import Enum, auto
-from typing import Iterable, Dict, List, Tuple, Any, Optional, Generator
+from typing import Iterable, Dict, List, Tuple, Any, Optional, Generator, Callable, Iterator
 
 
 # It is strongly recommended to pass `None` as the value for parameter `line`.
@@ -52,6 +54,7 @@ class TokenType(Enum):
     PLUS = auto()
     QUESTION = auto()
     BAR = auto()
+    PERCENT = auto()
     # not actually used but typing '=' instead of ':=' will cause an error if this is a separate token
     EQUALS = auto()
 
@@ -98,6 +101,7 @@ class Lexer:
             r"\+": TokenType.PLUS,
             r"\?": TokenType.QUESTION,
             r"\|": TokenType.BAR,
+            r"%": TokenType.PERCENT,
             r"=": TokenType.EQUALS,
         }
         self.compiled_patterns = {
@@ -160,17 +164,218 @@ class TokenIter:
         return None
 
 
-class ModuleInfo:
-    def __init__(self, toplevel: "AstToplevel", barg_transforms: Dict[str, Any]):
+class TokenStream:
+    """
+    The result of running the lexer defined by a grammar's `tokens { ... }` section over an input once.
+    Tokens are stored as parallel arrays of type ids and start/end offsets (skip tokens are dropped).
+    `index` maps every offset a rule can resume matching at (the start of a token or the end of the preceding
+    non-skip token) to the index of the token found there, so matching a token is a dict lookup and an int comparison.
+    """
+
+    def __init__(self, string: str, tokens: "AstTokens", pattern):
+        self.length = len(string)
+        self.types = array("i")
+        self.starts = array("i")
+        self.ends = array("i")
+        self.index: Dict[int, int] = {}
+        self.errors: List[int] = []  # offsets of characters no token pattern matched
+        pos = 0
+        lead: Optional[int] = 0
+        while pos < len(string):
+            m = pattern.match(string, pos)
+            if m is None or m.end() == pos:
+                # unknown character: break the chain so it cannot be silently skipped over
+                self.errors.append(pos)
+                lead = None
+                pos += 1
+                continue
+            tok = tokens.by_group[m.lastgroup]
+            if not tok.skip:
+                i = len(self.types)
+                self.types.append(tok.type_id)
+                self.starts.append(pos)
+                self.ends.append(m.end())
+                if lead is not None:
+                    self.index[lead] = i
+                self.index[pos] = i
+                lead = m.end()
+            pos = m.end()
+
+
+class CompiledGrammar:
+    """
+    The read-only part of a grammar: its AST, definitions and transforms, plus the compiled regexes and generated
+    types, which are all built here instead of on first use. After construction nothing writes to it while matching,
+    so one CompiledGrammar can be shared by parses in many threads. Per-parse state lives in a ModuleInfo, which
+    `context()` creates. Instrumenting the grammar (tracers, profilers, ...) affects every parse that shares it.
+    Leaves with the patterns in `prescan` (for example `Profiler.hot_leaves()`) are indexed per input like the rules
+    of a `%prescan` directive, patterns that are no prescannable leaf of the grammar are ignored.
+    """
+
+    def __init__(
+        self,
+        toplevel: "AstToplevel",
+        barg_transforms: Dict[str, Any],
+        prescan: Optional[Iterable[str]] = None,
+    ):
         self.toplevel = toplevel
         self.definitions: Dict[str, AstNode] = {
             ast_assign.identifier: ast_assign.expression
             for ast_assign in toplevel.assignments
         }
+        self.barg_transforms = barg_transforms
         self.regex_cache = {}  # pattern to compiled regex object
         self.generated_types = {}  # generated classes are uniqued
-        self.barg_transforms = barg_transforms
+        self.tracer: "Optional[barg.Tracer]" = None
+        self._uninstall_tracer = None
+        # the scanner of the %skip rule, None if the grammar has none (see AstSkip)
+        self.skip: Optional[Callable[[str, int], int]] = None
+        # leaf pattern to the compiled pattern that finds its matches in a whole input (see ModuleInfo.index_leaves)
+        self.prescan: Dict[str, Any] = {}
+        self._prepare(prescan)
+
+    def _prepare(self, prescan: Optional[Iterable[str]] = None) -> None:
+        # errors (eg. invalid regexes) are not raised here but when the node is matched, with the grammar line attached
+        leaves = set()
+        for node in iter_nodes(self.toplevel):
+            try:
+                if isinstance(node, AstString) and not node.backtrack:
+                    node.leaf(self)
+                    leaves.add(node.value)
+                elif isinstance(node, AstString):
+                    node.compiled(self)
+                    node.compiled_longest(self)
+                elif isinstance(node, AstTokens):
+                    node.compiled(self)
+                elif isinstance(node, AstStruct):
+                    node.generated_type(self)
+                elif isinstance(node, AstEnum):
+                    node.generated_type(self)
+                    node.alternation(self)
+                elif isinstance(node, AstRecover):
+                    node._search(self)
+            except Exception:
+                pass
+        if self.toplevel.tokens is not None:
+            # the section is no node of the tree, only its tokens are
+            try:
+                self.toplevel.tokens.compiled(self)
+            except Exception:
+                pass
+        if self.toplevel.skip is not None:
+            # unlike leaves, the skip rule is matched everywhere, so an invalid regex is reported right away
+            self.skip = self.toplevel.skip.scanner(self)
+        patterns = []
+        if self.toplevel.prescan is not None:
+            # like the skip rule, the directive is checked right away
+            patterns = self.toplevel.prescan.patterns(self.definitions)
+        for pattern in (*patterns, *(prescan or ())):
+            if pattern in leaves and pattern not in self.prescan and barg.prescannable(pattern):
+                self.prescan[pattern] = barg.scan_pattern(pattern)
+
+    def context(self) -> "ModuleInfo":
+        return ModuleInfo(self)
+
+    def parse(self, string: str, grammar_toplevel_name: str = "Toplevel") -> Generator:
+        """Matches `string` against the rule `grammar_toplevel_name` in a fresh context. Safe to call concurrently."""
+        return self.toplevel.match(string, self.context(), grammar_toplevel_name)
+
+    def set_tracer(self, tracer: "Optional[barg.Tracer]") -> None:
+        """
+        Installs `tracer` (replacing the current one) by wrapping the matchers of the grammar, or removes it if None.
+        Tracing is zero-cost when disabled: without a tracer, the original matchers are in place.
+        """
+        if self._uninstall_tracer is not None:
+            self._uninstall_tracer()
+            self._uninstall_tracer = None
+        self.tracer = tracer
+        if tracer is not None:
+            self._uninstall_tracer = instrument(
+                self.toplevel, barg.barg_trace.traced_matcher(tracer)
+            )
+
+    def __str__(self):
+        return f"CompiledGrammar({self.toplevel}, {self.definitions}, {self.barg_transforms})"
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+class ModuleInfo:
+    """
+    The state of one parse. The grammar part is shared with `grammar` (a CompiledGrammar, which is created from
+    `toplevel` and `barg_transforms` if an AstToplevel is passed), so creating a ModuleInfo per parse is cheap.
+    """
+
+    def __init__(
+        self,
+        toplevel: "AstToplevel | CompiledGrammar",
+        barg_transforms: Optional[Dict[str, Any]] = None,
+    ):
+        if not isinstance(toplevel, CompiledGrammar):
+            toplevel = CompiledGrammar(
+                toplevel, barg_transforms if barg_transforms is not None else {}
+            )
+        self.grammar = toplevel
+        # shared with the grammar, copied here so matchers keep a single attribute lookup
+        self.toplevel = toplevel.toplevel
+        self.definitions = toplevel.definitions
+        self.barg_transforms = toplevel.barg_transforms
+        self.regex_cache = toplevel.regex_cache
+        self.generated_types = toplevel.generated_types
+        self.skip = toplevel.skip
         self.internal_vars = {}
+        self.token_stream: Optional[TokenStream] = None  # set per input if the grammar has a tokens section
+        self.input = ""  # the input being parsed, matchers see its suffixes
+        self.input_length = 0  # length of the input being parsed (offsets are input_length - len(string))
+        # the farthest offset a leaf failed to match at and the leaves that failed there (see fail)
+        self.failure_pos = -1
+        self.failure_expected: set = set()
+        self.line_index: "Optional[barg.LineIndex]" = None  # built when an error is reported
+        self.leaf_indexes: Dict[str, "barg.LeafIndex"] = {}  # set per input if the grammar prescans leaves
+
+    def fail(self, pos: int, node: "AstNode") -> None:
+        """Records that the leaf `node` did not match at offset `pos`. Leaves only call this if pos >= failure_pos."""
+        if pos > self.failure_pos:
+            self.failure_pos = pos
+            self.failure_expected = {node}
+        else:
+            self.failure_expected.add(node)
+
+    def begin(self, string: str) -> int:
+        """
+        Sets up the per-input state for matching the whole input `string` (its length, the token stream, the leaf
+        indexes) and returns the offset after the skip in front of the first match. Every parse entry point calls it.
+        """
+        self.input = string
+        self.input_length = len(string)
+        if self.toplevel.tokens is not None:
+            self.token_stream = self.toplevel.tokens.scan(string, self)
+        if self.grammar.prescan:
+            self.index_leaves(string)
+        return 0 if self.skip is None else self.skip(string, 0)
+
+    def index_leaves(self, string: str) -> None:
+        """
+        Scans the input `string` once for each prescanned leaf pattern of the grammar (see barg.LeafIndex). For this
+        parse, the leaves with these patterns then match by looking up their position in the scan results.
+        """
+        self.leaf_indexes = {
+            pattern: barg.LeafIndex(string, scan) for pattern, scan in self.grammar.prescan.items()
+        }
+        # the indexed matchers only hold for this input, so they replace the shared ones in a copy of the cache
+        self.regex_cache = dict(self.grammar.regex_cache)
+        for pattern, index in self.leaf_indexes.items():
+            key = ("leaf", pattern)
+            self.regex_cache[key] = index.matcher(self.grammar.regex_cache[key])
+
+    @property
+    def tracer(self) -> "Optional[barg.Tracer]":
+        return self.grammar.tracer
+
+    def set_tracer(self, tracer: "Optional[barg.Tracer]") -> None:
+        """See CompiledGrammar.set_tracer, the tracer is installed on the shared grammar"""
+        self.grammar.set_tracer(tracer)
 
     def __str__(self):
         return f"ModuleInfo({self.toplevel}, {self.definitions}, {self.regex_cache}, {self.generated_types}, {self.barg_transforms}, {self.internal_vars})"
@@ -196,11 +401,37 @@ class AstNode:
     ):
         raise NotImplementedError()
 
-    def __hash__(self):
+    def recognize(self, string: str, module: "ModuleInfo"):
+        """Like match, but only yields the ncons of each match. Used where the matched value is thrown away anyway."""
+        for _, ncons in self.match(string, module):
+            yield ncons
+
+    def _key(self) -> tuple:
+        """The structural identity of the node: nodes with equal keys (and types) match the same way"""
         raise NotImplementedError()
 
+    def _freeze(self) -> None:
+        # called at the end of __init__, children are frozen first, so hashing is O(1) here
+        object.__setattr__(self, "_hash", hash((type(self).__name__, self._key())))
+
+    def __setattr__(self, name: str, value) -> None:
+        # nodes are immutable so their hash can be cached and equal nodes shared (see Parser.hash_cons).
+        # only instrumentation (instance level match/recognize, see `instrument`) may be replaced
+        if "_hash" in self.__dict__ and name not in ("match", "recognize"):
+            raise AttributeError(
+                f"cannot set '{name}': AST nodes are immutable, build a new node instead"
+            )
+        object.__setattr__(self, name, value)
+
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other: object, /) -> bool:
-        raise NotImplementedError()
+        return self is other or (
+            type(self) is type(other)
+            and self._hash == other._hash
+            and self._key() == other._key()
+        )
 
 
 class AstAssignment(AstNode):
@@ -208,6 +439,7 @@ class AstAssignment(AstNode):
         self.line = line
         self.identifier = identifier
         self.expression = expression
+        self._freeze()
 
     def __str__(self):
         return (
@@ -218,20 +450,15 @@ class AstAssignment(AstNode):
         for m, ncons in self.expression.match(string, module):
             yield m, ncons
 
-    def __hash__(self):
-        return hash((self.identifier, self.expression))
-
-    def __eq__(self, other: object, /) -> bool:
-        return isinstance(other, AstAssignment) and (
-            self.identifier,
-            self.expression,
-        ) == (other.identifier, other.expression)
+    def _key(self) -> tuple:
+        return self.identifier, self.expression
 
 
 class AstVariable(AstNode):
     def __init__(self, line: int, name: str):
         self.line = line
         self.name = name
+        self._freeze()
 
     def __str__(self):
         return f"AstVariable(name={self.name})"
@@ -245,44 +472,140 @@ class AstVariable(AstNode):
         for m, ncons in defn.match(string, module):
             yield m, ncons
 
-    def __hash__(self):
-        return hash((self.name,))
+    def recognize(self, string: str, module: "ModuleInfo"):
+        if self.name not in module.definitions:
+            raise BadGrammarError(
+                f"usage of undefined variable '{self.name}'", self.line
+            )
+        for ncons in module.definitions[self.name].recognize(string, module):
+            yield ncons
 
-    def __eq__(self, other: object, /) -> bool:
-        return isinstance(other, AstVariable) and self.name == other.name
+    def _key(self) -> tuple:
+        return (self.name,)
 
 
 class AstString(AstNode):
-    def __init__(self, line: int, value: str):
+    """
+    A regex leaf. It is matched anchored at the current position and yields at most one match: the one the regex
+    engine picks. A backtracking leaf (`$builtin.backtrack("regex")` in a grammar) instead yields every length the
+    regex can match, longest first, so enclosing rules can backtrack into it (see `alternatives`).
+    """
+
+    def __init__(self, line: int, value: str, backtrack: bool = False):
         self.line = line
         self.value = value
+        self.backtrack = backtrack
+        self._freeze()
 
     def __str__(self):
+        if self.backtrack:
+            return f'AstString(value="{self.value}", backtrack=True)'
         return f'AstString(value="{self.value}")'
 
+    def _compile(self, module: "ModuleInfo", key, flags: int = 0):
+        if key in module.regex_cache:
+            return module.regex_cache[key]
+        try:
+            pat = regex.compile(self.value, flags)
+        except Exception as e:
+            e.__barg_line = self.line
+            raise e
+        module.regex_cache[key] = pat
+        return pat
+
+    def compiled(self, module: "ModuleInfo"):
+        return self._compile(module, self.value)
+
+    def leaf(self, module: "ModuleInfo") -> Callable[[str], Optional[int]]:
+        """
+        The matcher of a non-backtracking leaf: maps a string to the length of the match at its start, or None.
+        Literal patterns and character class runs get fast paths, other patterns the faster regex engine that
+        matches them the same way (see barg_leaf.py).
+        """
+        key = ("leaf", self.value)
+        if key in module.regex_cache:
+            return module.regex_cache[key]
+        try:
+            matcher = barg.plan_leaf(self.value).matcher()
+        except Exception as e:
+            e.__barg_line = self.line
+            raise e
+        module.regex_cache[key] = matcher
+        return matcher
+
+    def compiled_longest(self, module: "ModuleInfo"):
+        """The pattern with POSIX (leftmost longest) matching, which backtracking leaves start from"""
+        return self._compile(module, ("posix", self.value), regex.POSIX)
+
+    def alternatives(self, string: str, module: "ModuleInfo") -> Iterator[int]:
+        """
+        The lengths of the prefixes of `string` that the regex matches, longest first. Every length below the longest
+        match is tested by fully matching the regex against that prefix alone, so assertions at the end of the
+        pattern (`$`, `\\b`, lookaheads) see the end of the prefix as the end of the input. This costs one match
+        attempt per shorter length, which is why leaves only do it when declared as backtracking.
+        """
+        m = self.compiled_longest(module).match(string)
+        if m is None:
+            if module.input_length - len(string) >= module.failure_pos:
+                module.fail(module.input_length - len(string), self)
+            return
+        yield m.end()
+        pat = self.compiled(module)
+        for end in range(m.end() - 1, -1, -1):
+            if pat.fullmatch(string, 0, end) is not None:
+                yield end
+
+    def ends(self, string: str, module: "ModuleInfo") -> Iterator[int]:
+        """The lengths this leaf can match at the start of `string`, in the order they are tried"""
+        if self.backtrack:
+            yield from self.alternatives(string, module)
+            return
+        end = self.leaf(module)(string)
+        if end is not None:
+            yield end
+        elif module.input_length - len(string) >= module.failure_pos:
+            module.fail(module.input_length - len(string), self)
+
     def match(self, string: str, module: "ModuleInfo", symbol: Optional[str] = None):
-        str_pat = "^" + self.value
-        if string in module.regex_cache:
-            pat = module.regex_cache[str_pat]
-        else:
-            try:
-                pat = regex.compile(str_pat)
-            except Exception as e:
-                e.__barg_line = self.line
-                raise e
-            module.regex_cache[str_pat] = pat
-        for m in pat.finditer(string, overlapped=True):
-            yield m.group(0), m.end(0)
+        if self.backtrack:
+            for end in self.alternatives(string, module):
+                yield string[:end], end
+            return
+        end = self.leaf(module)(string)
+        if end is not None:
+            yield string[:end], end
+        elif module.input_length - len(string) >= module.failure_pos:
+            # farthest failure tracking, for error messages (see barg_errors.py)
+            module.fail(module.input_length - len(string), self)
 
-    def __hash__(self):
-        return hash((self.value,))
+    def recognize(self, string: str, module: "ModuleInfo"):
+        return self.ends(string, module)
 
-    def __eq__(self, other: object, /) -> bool:
-        return isinstance(other, AstString) and self.value == other.value
+    def _key(self) -> tuple:
+        return (self.value, self.backtrack)
+
+
+def cons_to_list(cons) -> List:
+    """
+    Materializes a cons list into a python list. Matchers accumulate partial results as immutable cons cells
+    `(item, rest)` (None is the empty list, the head is the item added last), so extending a partial result is O(1)
+    and shares it with the alternatives that backtracking still has to try.
+    """
+    out = []
+    while cons is not None:
+        item, cons = cons
+        out.append(item)
+    out.reverse()
+    return out
 
 
 class AstStruct(AstNode):
-    def __init__(self, line: int, fields: Tuple[Tuple[str, Any], ...]):
+    def __init__(
+        self,
+        line: int,
+        fields: Tuple[Tuple[str, Any], ...],
+        discard: Tuple[str, ...] = tuple(),
+    ):
         self.line = line
         fields_used = []
         for f in fields:
@@ -295,22 +618,27 @@ class AstStruct(AstNode):
             else:
                 fields_used.append(fname)
         self.fields = fields  # fields is a list of (fieldname, expression) tuples
+        # fields that are only recognized and set to None (see push_down_transforms)
+        self.discard = discard
+        self.discarded = tuple(name in discard for name, _ in fields)
+        self._freeze()
 
     def __str__(self):
-        return f"AstStruct(fields={self.fields})"
-
-    def _match(self, string: str, module: "ModuleInfo", matched_fields: List):
-        if len(matched_fields) == len(self.fields):
-            field_names = list(map(lambda p: p[0], self.fields))
-            if self not in module.generated_types:
-                g = {"GenTyKind_": GenTyKind}
-                field_args = ", ".join(field_names)
-                field_assigns = ("\n" + " " * 8).join(
-                    map(lambda name: f"self.{name} = {name}", field_names)
-                )
-                field_names_printed = field_names if barg.PRINT_PRIVATE_STRUCT_MEMBERS else [f for f in field_names if not f.startswith('_')]
-                code = f"""\
+        return f"AstStruct(fields={self.fields}, discard={self.discard})"
+
+    def generated_type(self, module: "ModuleInfo"):
+        field_names = list(map(lambda p: p[0], self.fields))
+        if self not in module.generated_types:
+            g = {"GenTyKind_": GenTyKind}
+            field_args = ", ".join(field_names)
+            field_assigns = ("\n" + " " * 8).join(
+                map(lambda name: f"self.{name} = {name}", field_names)
+            )
+            field_names_printed = field_names if barg.PRINT_PRIVATE_STRUCT_MEMBERS else [f for f in field_names if not f.startswith('_')]
+            code = f"""\
 class BargGeneratedType:
+    fields_ = {tuple(field_names)!r}  # the declared fields, instances may carry marks besides them
+
     def __init__(self, {field_args}):
         self.type_ = GenTyKind_.STRUCT
         {field_assigns}
@@ -328,44 +656,157 @@ class BargGeneratedType:
     def __repr__(self):
         return str(self)
 """
-                try:
-                    exec(code, g)
-                except Exception as e:
-                    e.__barg_line = self.line
-                    raise e
-                typ = g["BargGeneratedType"]
-                module.generated_types[self] = typ
-            else:
-                typ = module.generated_types[self]
-            yield typ(*matched_fields), 0
+            try:
+                exec(code, g)
+            except Exception as e:
+                e.__barg_line = self.line
+                raise e
+            typ = g["BargGeneratedType"]
+            module.generated_types[self] = typ
+        else:
+            typ = module.generated_types[self]
+        return typ
+
+    def _match(self, string: str, module: "ModuleInfo", make, i: int = 0, matched_fields=None):
+        # matched_fields is a cons list of the values of the first i fields (see cons_to_list)
+        if i == len(self.fields):
+            yield make(*cons_to_list(matched_fields)), 0
+        elif self.discarded[i]:
+            for local_ncons in self.fields[i][1].recognize(string, module):
+                start = local_ncons
+                if module.skip is not None and i + 1 < len(self.fields):
+                    start = module.skip(string, local_ncons)
+                for m, ncons in self._match(
+                    string[start:], module, make, i + 1, (None, matched_fields)
+                ):
+                    yield m, start + ncons if ncons else local_ncons
+        elif module.skip is not None and i + 1 < len(self.fields):
+            # skipped input only counts if the remaining fields match something after it (see AstSkip)
+            for local_m, local_ncons in self.fields[i][1].match(string, module):
+                start = module.skip(string, local_ncons)
+                for m, ncons in self._match(
+                    string[start:], module, make, i + 1, (local_m, matched_fields)
+                ):
+                    yield m, start + ncons if ncons else local_ncons
         else:
-            pat = self.fields[len(matched_fields)][1]
-            for local_m, local_ncons in pat.match(string, module):
+            for local_m, local_ncons in self.fields[i][1].match(string, module):
                 for m, ncons in self._match(
-                    string[local_ncons:], module, matched_fields + [local_m]
+                    string[local_ncons:], module, make, i + 1, (local_m, matched_fields)
                 ):
                     yield m, local_ncons + ncons
 
     def match(self, string: str, module: "ModuleInfo", symbol: Optional[str] = None):
-        for m in self._match(string, module, []):
+        for m in self._match(string, module, self.generated_type(module)):
             yield m
 
-    def __hash__(self):
-        return hash((self.fields,))
+    def _recognize(self, string: str, module: "ModuleInfo", i: int):
+        if i == len(self.fields):
+            yield 0
+        elif module.skip is not None and i + 1 < len(self.fields):
+            for local_ncons in self.fields[i][1].recognize(string, module):
+                start = module.skip(string, local_ncons)
+                for ncons in self._recognize(string[start:], module, i + 1):
+                    yield start + ncons if ncons else local_ncons
+        else:
+            for local_ncons in self.fields[i][1].recognize(string, module):
+                for ncons in self._recognize(string[local_ncons:], module, i + 1):
+                    yield local_ncons + ncons
 
-    def __eq__(self, other: object, /) -> bool:
-        return isinstance(other, AstStruct) and self.fields == other.fields
+    def recognize(self, string: str, module: "ModuleInfo"):
+        for ncons in self._recognize(string, module, 0):
+            yield ncons
+
+    def _key(self) -> tuple:
+        return self.fields, self.discard
+
+
+class _LeafBlock:
+    """
+    A run of enum variants that are non-backtracking leaves, possibly wrapped in transforms, which is matched by one
+    AlternationPlan. `entries[i]` is (tag, leaf, transforms) of its i-th variant, transforms from the outermost in.
+    """
+
+    def __init__(self, variants, chains, plan: "barg.AlternationPlan"):
+        self.variants = variants
+        self.entries = [(tag, leaf, transforms) for (tag, _), (transforms, leaf) in zip(variants, chains)]
+        self.first = plan.first()
+        self.plan = plan
+        self.nodes = tuple(node for transforms, leaf in chains for node in (*transforms, leaf))
+
+    def instrumented(self) -> bool:
+        """Whether matchers of the variants were replaced (see `instrument`), which then have to run themselves"""
+        for node in self.nodes:
+            if "match" in node.__dict__:
+                return True
+        return False
+
+    def failed(self, string: str, module: "ModuleInfo", start: int, end: int) -> None:
+        """Records the failures of the leaves of the variants start..end-1 like AstString.match would"""
+        pos = module.input_length - len(string)
+        if pos >= module.failure_pos:
+            for i in range(start, end):
+                module.fail(pos, self.entries[i][1])
+
+    def value(self, i: int, string: str, end: int, module: "ModuleInfo"):
+        """The (value, ncons) variant i matches, given that its leaf matched `end` characters"""
+        m, ncons = string[:end], end
+        for node in reversed(self.entries[i][2]):
+            transform = barg.get_transform(module.barg_transforms, node.name)
+            try:
+                m, ncons = transform(module, string, ncons, m, *node.args)
+            except Exception as e:
+                e.__barg_line = node.line  # attach barg grammar line info
+                raise e
+        return m, ncons
+
+    def ncons(self, i: int, string: str, end: int, module: "ModuleInfo") -> int:
+        for node in self.entries[i][2]:
+            if barg.get_transform(module.barg_transforms, node.name) not in barg.NCONS_PRESERVING_BUILTINS:
+                return self.value(i, string, end, module)[1]
+        return end
+
+    def hits(self, string: str, module: "ModuleInfo") -> Iterator[Tuple[int, int]]:
+        """(i, end) for every variant that matches, in declared order"""
+        start = 0
+        while start < len(self.entries):
+            hit = self.first(string, start)
+            if hit is None:
+                self.failed(string, module, start, len(self.entries))
+                return
+            i, end = hit
+            self.failed(string, module, start, i)
+            yield i, end
+            start = i + 1
+
+
+def _leaf_chain(expr) -> Optional[Tuple[Tuple["AstTransform", ...], "AstString"]]:
+    transforms = []
+    while isinstance(expr, AstTransform):
+        transforms.append(expr)
+        expr = expr.pattern_arg
+    if isinstance(expr, AstString) and not expr.backtrack:
+        return tuple(transforms), expr
+    return None
 
 
 class AstEnum(AstNode):
-    def __init__(self, line: int, variants: Tuple[Tuple[str, Any], ...]):
+    def __init__(self, line: int, variants: Tuple[Tuple[str, Any], ...], mode: str = "all"):
         self.line = line
         self.variants = variants  # variants is a list of (tag, expression) tuples
+        # all: every match of every variant, in order. first: only the first match of the first matching variant
+        # (ordered choice). longest: only the longest first-match among all variants (earliest variant on ties)
+        if mode not in ("all", "first", "longest"):
+            raise BadGrammarError(
+                "unknown enum matching mode '" + mode + "': modes are 'all', 'first', 'longest'",
+                line,
+            )
+        self.mode = mode
+        self._freeze()
 
     def __str__(self):
-        return f"AstEnum(variants={self.variants})"
+        return f"AstEnum(mode={self.mode}, variants={self.variants})"
 
-    def match(self, string: str, module: "ModuleInfo", symbol: Optional[str] = None):
+    def generated_type(self, module: "ModuleInfo"):
         if self not in module.generated_types:
             g = {"GenTyKind_": GenTyKind}
             code = """\
@@ -391,16 +832,126 @@ class BargGeneratedType:
             module.generated_types[self] = typ
         else:
             typ: Any = module.generated_types[self]
+        return typ
+
+    def alternation(self, module: "ModuleInfo") -> List["Tuple[str, AstNode] | _LeafBlock"]:
+        """
+        The variants, with runs of (transformed) leaves merged into _LeafBlocks that find the first matching variant
+        of the run in one step (see barg.AlternationPlan). Longest enums try every variant anyway and are not merged.
+        """
+        key = ("alternation", self)
+        if key in module.regex_cache:
+            return module.regex_cache[key]
+        groups = []
+        run = []
+
+        def flush():
+            if not run:
+                return
+            chains = [_leaf_chain(expr) for _, expr in run]
+            step = len(run)
+            plan = barg.plan_alternation([leaf.value for _, leaf in chains])
+            if plan is None and len(run) > barg.MAX_ALTERNATION:
+                step = barg.MAX_ALTERNATION
+            for i in range(0, len(run), step):
+                if step != len(run):
+                    plan = barg.plan_alternation([leaf.value for _, leaf in chains[i : i + step]])
+                if plan is None:
+                    groups.extend(run[i : i + step])
+                else:
+                    groups.append(_LeafBlock(run[i : i + step], chains[i : i + step], plan))
+            run.clear()
+
+        for variant in self.variants:
+            if self.mode != "longest" and _leaf_chain(variant[1]) is not None:
+                run.append(variant)
+                continue
+            flush()
+            groups.append(variant)
+        flush()
+        module.regex_cache[key] = groups
+        return groups
+
+    def _chosen(self, string: str, module: "ModuleInfo", matcher, ncons_of, recognizing: bool = False):
+        """The (tag, first match) a first/longest enum commits to, or None. Generators of losing variants are closed."""
+        best = None
+        for group in self.alternation(module):
+            if isinstance(group, _LeafBlock):
+                if not group.instrumented():
+                    # only first enums have blocks, the first hit is the first matching variant
+                    hit = next(group.hits(string, module), None)
+                    if hit is not None:
+                        i, end = hit
+                        if recognizing:
+                            return group.entries[i][0], group.ncons(i, string, end, module)
+                        return group.entries[i][0], group.value(i, string, end, module)
+                    continue
+                variants = group.variants
+            else:
+                variants = (group,)
+            for tag, expr in variants:
+                item = self._first(expr, string, module, matcher)
+                if item is None:
+                    continue
+                if self.mode == "first":
+                    return tag, item
+                if best is None or ncons_of(item) > ncons_of(best[1]):
+                    best = tag, item
+        return best
+
+    @staticmethod
+    def _first(expr, string: str, module: "ModuleInfo", matcher):
+        gen = matcher(expr)(string, module)
+        item = next(gen, None)
+        gen.close()
+        return item
+
+    def _match(self, string: str, module: "ModuleInfo", make):
+        if self.mode != "all":
+            chosen = self._chosen(string, module, lambda expr: expr.match, lambda m: m[1])
+            if chosen is not None:
+                tag, (m, ncons) = chosen
+                yield make(tag, m), ncons
+            return
+        for group in self.alternation(module):
+            if isinstance(group, _LeafBlock):
+                if not group.instrumented():
+                    for i, end in group.hits(string, module):
+                        m, ncons = group.value(i, string, end, module)
+                        yield make(group.entries[i][0], m), ncons
+                    continue
+                variants = group.variants
+            else:
+                variants = (group,)
+            for tag, expr in variants:
+                for m, ncons in expr.match(string, module):
+                    yield make(tag, m), ncons
 
-        for tag, expr in self.variants:
-            for m, ncons in expr.match(string, module):
-                yield typ(tag, m), ncons
+    def match(self, string: str, module: "ModuleInfo", symbol: Optional[str] = None):
+        for m in self._match(string, module, self.generated_type(module)):
+            yield m
 
-    def __hash__(self):
-        return hash((self.variants,))
+    def recognize(self, string: str, module: "ModuleInfo"):
+        if self.mode != "all":
+            chosen = self._chosen(string, module, lambda expr: expr.recognize, lambda n: n, True)
+            if chosen is not None:
+                yield chosen[1]
+            return
+        for group in self.alternation(module):
+            if isinstance(group, _LeafBlock):
+                if not group.instrumented():
+                    for i, end in group.hits(string, module):
+                        yield group.ncons(i, string, end, module)
+                    continue
+                variants = group.variants
+            else:
+                variants = (group,)
+            for _, expr in variants:
+                for ncons in expr.recognize(string, module):
+                    yield ncons
 
-    def __eq__(self, other: object, /) -> bool:
-        return isinstance(other, AstEnum) and self.variants == other.variants
+    def _key(self) -> tuple:
+        return self.mode, self.variants
 
 
 class AstTransform(AstNode):
@@ -409,6 +960,7 @@ class AstTransform(AstNode):
         self.name = name
         self.pattern_arg = pattern_arg
         self.args = args
+        self._freeze()
 
     def __str__(self):
         return f"AstTransform(name={self.name}, args={self.args})"
@@ -422,19 +974,30 @@ class AstTransform(AstNode):
                 e.__barg_line = self.line  # attach barg grammar line info
                 raise e
 
-    def __hash__(self):
-        return hash((self.name, self.pattern_arg, self.args))
+    def recognize(self, string: str, module: "ModuleInfo"):
+        transform = barg.get_transform(module.barg_transforms, self.name)
+        if transform not in barg.NCONS_PRESERVING_BUILTINS:
+            # arbitrary transforms may change ncons or fail, so they have to run
+            for _, ncons in self.match(string, module):
+                yield ncons
+        else:
+            for ncons in self.pattern_arg.recognize(string, module):
+                yield ncons
 
-    def __eq__(self, other: object, /) -> bool:
-        return isinstance(other, AstTransform) and (
-            self.name,
-            self.pattern_arg,
-            self.args,
-        ) == (other.name, other.pattern_arg, other.args)
+    def _key(self) -> tuple:
+        return self.name, self.pattern_arg, self.args
 
 
 class AstList(AstNode):
-    def __init__(self, line: int, range_start, range_end, mode, expression):
+    def __init__(
+        self,
+        line: int,
+        range_start,
+        range_end,
+        mode,
+        expression,
+        keep_mark: Optional[str] = None,
+    ):
         self.line = line
         if mode not in ("greedy", "lazy"):
             raise BadGrammarError(
@@ -444,66 +1007,234 @@ class AstList(AstNode):
         self.range_end = range_end
         self.mode = mode
         self.expression = expression
+        # if set, only items with this mark are kept (see push_down_transforms)
+        self.keep_mark = keep_mark
+        self.keep_attr = f"mark_{keep_mark}_" if keep_mark is not None else None
+        self._freeze()
 
     def __str__(self):
-        return f"AstList(mode={self.mode}, range=[{self.range_start}..{self.range_end if self.range_end is not None else ''}], expression={self.expression})"
-
-    def _match_lazy(self, string: str, module: "ModuleInfo", matched_exprs: List):
-        if self.range_end is not None and len(matched_exprs) >= self.range_end:
+        return f"AstList(mode={self.mode}, range=[{self.range_start}..{self.range_end if self.range_end is not None else ''}], keep_mark={self.keep_mark}, expression={self.expression})"
+
+    def _keep(self, matched_exprs, m):
+        # matched_exprs is a cons list of the kept items (see cons_to_list)
+        if self.keep_attr is not None and not hasattr(m, self.keep_attr):
+            return matched_exprs
+        return m, matched_exprs
+
+    def _empty_item(self, matched_exprs, m, n: int):
+        """
+        An item that consumed no input ends the list instead of being repeated forever. It is only kept if the list
+        could not end without it (n < range_start), and then counts as reaching range_start, because any number of
+        further empty items would match in the same place.
+        """
+        if n < self.range_start:
+            yield cons_to_list(self._keep(matched_exprs, m)), 0
+
+    def _match_lazy(self, string: str, module: "ModuleInfo", matched_exprs, n: int):
+        # n is the number of matched items, which differs from the length of matched_exprs if items are filtered out
+        if self.range_end is not None and n >= self.range_end:
             return
 
-        if self.range_start <= len(matched_exprs):
-            yield matched_exprs, 0
+        if self.range_start <= n:
+            yield cons_to_list(matched_exprs), 0
 
         for local_m, local_ncons in self.expression.match(string, module):
+            if not local_ncons:
+                # repeating an empty match would never end, see _empty_item
+                yield from self._empty_item(matched_exprs, local_m, n)
+                continue
+            start = local_ncons if module.skip is None else module.skip(string, local_ncons)
             for m, ncons in self._match_lazy(
-                string[local_ncons:], module, matched_exprs + [local_m]
+                string[start:], module, self._keep(matched_exprs, local_m), n + 1
             ):
-                yield m, local_ncons + ncons
+                yield m, start + ncons if ncons else local_ncons
 
-    def _match_greedy(self, string: str, module: "ModuleInfo", matched_exprs: List):
-        if self.range_end is not None and len(matched_exprs) >= self.range_end:
+    def _match_greedy(self, string: str, module: "ModuleInfo", matched_exprs, n: int):
+        if self.range_end is not None and n >= self.range_end:
             return
 
         for local_m, local_ncons in self.expression.match(string, module):
+            if not local_ncons:
+                yield from self._empty_item(matched_exprs, local_m, n)
+                continue
+            # skipped input between items only counts if another item follows (see AstSkip)
+            start = local_ncons if module.skip is None else module.skip(string, local_ncons)
             for m, ncons in self._match_greedy(
-                string[local_ncons:], module, matched_exprs + [local_m]
+                string[start:], module, self._keep(matched_exprs, local_m), n + 1
             ):
-                yield m, local_ncons + ncons
+                yield m, start + ncons if ncons else local_ncons
 
-        if self.range_start <= len(matched_exprs):
-            yield matched_exprs, 0
+        if self.range_start <= n:
+            yield cons_to_list(matched_exprs), 0
 
     def match(self, string: str, module: "ModuleInfo", symbol: Optional[str] = None):
         for m, ncons in (
             self._match_lazy if self.mode == "lazy" else self._match_greedy
-        )(string, module, []):
+        )(string, module, None, 0):
             yield m, ncons
 
-    def __hash__(self):
-        return hash((self.mode, self.range_start, self.range_end, self.expression))
+    def _recognize(self, string: str, module: "ModuleInfo", n: int):
+        if self.range_end is not None and n >= self.range_end:
+            return
 
-    def __eq__(self, other: object, /) -> bool:
-        return isinstance(other, AstList) and (
-            self.mode,
-            self.range_start,
-            self.range_end,
-            self.expression,
-        ) == (other.mode, other.range_start, other.range_end, other.expression)
+        if self.mode == "lazy" and self.range_start <= n:
+            yield 0
+
+        for local_ncons in self.expression.recognize(string, module):
+            if not local_ncons:
+                if n < self.range_start:
+                    yield 0
+                continue
+            start = local_ncons if module.skip is None else module.skip(string, local_ncons)
+            for ncons in self._recognize(string[start:], module, n + 1):
+                yield start + ncons if ncons else local_ncons
+
+        if self.mode == "greedy" and self.range_start <= n:
+            yield 0
+
+    def recognize(self, string: str, module: "ModuleInfo"):
+        for ncons in self._recognize(string, module, 0):
+            yield ncons
+
+    def _key(self) -> tuple:
+        return self.mode, self.range_start, self.range_end, self.keep_mark, self.expression
+
+
+class AstRecover(AstNode):
+    """
+    `$builtin.recover(Expr, Sync1, Sync2, ...)`: yields the matches of `expression`. If it has none, the input is
+    skipped up to and including the first match of one of the synchronization rules `syncs` (tried in order at every
+    position), and an ErrorNode spanning the skipped input is yielded instead. Recovery does not backtrack: it only
+    happens if the expression has no match at all. If no synchronization token follows, there is no match.
+    """
+
+    def __init__(self, line: int, expression, syncs: Tuple[AstNode, ...]):
+        self.line = line
+        self.expression = expression
+        self.syncs = syncs
+        self._freeze()
+
+    def __str__(self):
+        return f"AstRecover(syncs={self.syncs}, expression={self.expression})"
+
+    def sync_pattern(self, module: "ModuleInfo") -> Optional[str]:
+        """One regex that finds the synchronization set, if all its rules are (non-backtracking) regex leaves"""
+        patterns = []
+        for sync in self.syncs:
+            while isinstance(sync, AstVariable):
+                if sync.name not in module.definitions:
+                    raise BadGrammarError(f"usage of undefined variable '{sync.name}'", sync.line)
+                sync = module.definitions[sync.name]
+            if not isinstance(sync, AstString) or sync.backtrack:
+                return None
+            patterns.append(f"(?:{sync.value})")
+        return "|".join(patterns)
+
+    def _search(self, module: "ModuleInfo"):
+        key = ("recover", self)
+        if key in module.regex_cache:
+            return module.regex_cache[key]
+        pattern = self.sync_pattern(module)
+        if pattern is not None:
+            # one scan over the input instead of trying every rule at every position
+            try:
+                pat = regex.compile(pattern)
+            except Exception as e:
+                e.__barg_line = self.line
+                raise e
+
+            def search(string: str, module: "ModuleInfo") -> Optional[Tuple[int, int]]:
+                m = pat.search(string)
+                return None if m is None else m.span()
+
+        else:
+
+            def search(string: str, module: "ModuleInfo") -> Optional[Tuple[int, int]]:
+                for start in range(len(string) + 1):
+                    for sync in self.syncs:
+                        ncons = next(iter(sync.recognize(string[start:], module)), None)
+                        if ncons is not None:
+                            return start, start + ncons
+                return None
+
+        module.regex_cache[key] = search
+        return search
+
+    def _recover(self, string: str, module: "ModuleInfo") -> Optional[Tuple["barg.ErrorNode", int]]:
+        span = self._search(module)(string, module)
+        if span is None:
+            return None
+        pos = module.input_length - len(string)
+        end = span[1]
+        return barg.ErrorNode(pos, pos + end, string[:end]), end
+
+    def match(self, string: str, module: "ModuleInfo", symbol: Optional[str] = None):
+        matched = False
+        for m in self.expression.match(string, module):
+            matched = True
+            yield m
+        if not matched:
+            recovered = self._recover(string, module)
+            if recovered is not None:
+                yield recovered
+
+    def recognize(self, string: str, module: "ModuleInfo"):
+        matched = False
+        for ncons in self.expression.recognize(string, module):
+            matched = True
+            yield ncons
+        if not matched:
+            recovered = self._recover(string, module)
+            if recovered is not None:
+                yield recovered[1]
+
+    def _key(self) -> tuple:
+        return self.expression, self.syncs
 
 
 class AstToplevel(AstNode):
     def __init__(self, line: int, statements: Tuple[AstAssignment | AstNode]):
         self.line = line
+        self.tokens: Optional[AstTokens] = None
+        self.skip: Optional[AstSkip] = None
+        self.prescan: Optional[AstPrescan] = None
         assignments = []
         n = 0
         for stmt in statements:
             if isinstance(stmt, AstAssignment):
                 assignments.append(stmt)
+            elif isinstance(stmt, AstTokens):
+                if self.tokens is not None:
+                    raise BadGrammarError(
+                        "a grammar may only contain one tokens section", stmt.line
+                    )
+                self.tokens = stmt
+                # token names are usable like any other definition
+                for tok in stmt.tokens:
+                    assignments.append(AstAssignment(tok.line, tok.name, tok))
+            elif isinstance(stmt, AstSkip):
+                if self.skip is not None:
+                    raise BadGrammarError(
+                        "a grammar may only contain one %skip rule", stmt.line
+                    )
+                self.skip = stmt
+            elif isinstance(stmt, AstPrescan):
+                if self.prescan is not None:
+                    raise BadGrammarError(
+                        "a grammar may only contain one %prescan directive", stmt.line
+                    )
+                self.prescan = stmt
             else:
                 assignments.append(AstAssignment(stmt.line, f"_{n}", stmt))
                 n += 1
         self.assignments: List[AstAssignment] = assignments
+        if self.prescan is not None:
+            defined = {a.identifier for a in assignments}
+            for name in self.prescan.names:
+                if name not in defined:
+                    raise BadGrammarError(
+                        f"%prescan names the undefined rule '{name}'", self.prescan.line
+                    )
 
     def __str__(self) -> str:
         return f"AstToplevel(assignments={self.assignments})"
@@ -518,29 +1249,184 @@ class AstToplevel(AstNode):
                 f"specified toplevel symbol is not defined: '{symbol}'", -1
             )
         expr = module.definitions[symbol]
-        for m, ncons in expr.match(string, module):
-            yield m, ncons
+        start = module.begin(string)
+        for m, ncons in expr.match(string[start:], module):
+            yield m, start + ncons
+
+    # the toplevel is the one mutable node: compile passes replace its assignments (see rewrite_tree)
+    __setattr__ = object.__setattr__
+
+    def _key(self) -> tuple:
+        return tuple(self.assignments), self.tokens, self.skip, self.prescan
 
     def __hash__(self):
-        return hash((self.assignments,))
+        return hash(self._key())
 
     def __eq__(self, other: object, /) -> bool:
-        return isinstance(other, AstToplevel) and self.assignments == other.assignments
+        return isinstance(other, AstToplevel) and self._key() == other._key()
 
 
 class AstTextString(AstNode):
     def __init__(self, line: int, value: str):
         self.line = line
         self.value = value
+        self._freeze()
 
     def __str__(self) -> str:
         return f"AstToplevel(value=```{self.value}```)"
 
-    def __hash__(self):
-        return hash((self.value,))
+    def _key(self) -> tuple:
+        return (self.value,)
 
-    def __eq__(self, other: object, /) -> bool:
-        return isinstance(other, AstToplevel) and self.value == other.value
+
+class AstToken(AstNode):
+    def __init__(self, line: int, name: str, type_id: int, pattern: str, skip: bool):
+        self.line = line
+        self.name = name
+        self.type_id = type_id
+        self.pattern = pattern
+        self.skip = skip
+        self._freeze()
+
+    def __str__(self) -> str:
+        return f'AstToken(name={self.name}, type_id={self.type_id}, pattern="{self.pattern}", skip={self.skip})'
+
+    def match(self, string: str, module: "ModuleInfo", symbol: Optional[str] = None):
+        if self.skip:
+            raise BadGrammarError(
+                f"skip token '{self.name}' is dropped by the lexer and cannot be used in rules",
+                self.line,
+            )
+        stream = module.token_stream
+        pos = stream.length - len(string)
+        i = stream.index.get(pos)
+        if i is not None and stream.types[i] == self.type_id:
+            end = stream.ends[i]
+            yield string[stream.starts[i] - pos : end - pos], end - pos
+        else:
+            # the failure is at the token found here, not at the skipped input in front of it
+            at = pos if i is None else stream.starts[i]
+            if at >= module.failure_pos:
+                module.fail(at, self)
+
+    def _key(self) -> tuple:
+        return self.name, self.type_id, self.pattern, self.skip
+
+
+class AstTokens(AstNode):
+    def __init__(self, line: int, tokens: Tuple[AstToken, ...]):
+        self.line = line
+        names_used = []
+        for tok in tokens:
+            if tok.name in names_used:
+                raise BadGrammarError(
+                    f"token name '{tok.name}' used multiple times in tokens section",
+                    tok.line,
+                )
+            names_used.append(tok.name)
+        self.tokens = tokens
+        # each token pattern becomes a named group of one combined pattern, so the lexer needs one regex call per token
+        self.by_group = {f"_t{tok.type_id}_": tok for tok in tokens}
+        self.pattern = "|".join(f"(?P<_t{tok.type_id}_>{tok.pattern})" for tok in tokens)
+        self._freeze()
+
+    def __str__(self) -> str:
+        return f"AstTokens(tokens={self.tokens})"
+
+    def compiled(self, module: "ModuleInfo"):
+        if self.pattern in module.regex_cache:
+            pat = module.regex_cache[self.pattern]
+        else:
+            try:
+                pat = regex.compile(self.pattern)
+            except Exception as e:
+                e.__barg_line = self.line
+                raise e
+            module.regex_cache[self.pattern] = pat
+        return pat
+
+    def scan(self, string: str, module: "ModuleInfo") -> TokenStream:
+        return TokenStream(string, self, self.compiled(module))
+
+    def _key(self) -> tuple:
+        return (self.tokens,)
+
+
+class AstSkip(AstNode):
+    """
+    The `%skip := "regex";` directive. Input the regex matches is skipped in front of every struct field but the
+    first, in front of every list item but the first and in front of the toplevel rule, with one scan that produces
+    no value. Skipped input only becomes part of a match if something is matched after it, so no match ends in
+    skipped input. The regex is matched in place (inside the input), so `^` only matches at its start.
+    """
+
+    def __init__(self, line: int, pattern: str):
+        self.line = line
+        self.pattern = pattern
+        self._freeze()
+
+    def __str__(self) -> str:
+        return f'AstSkip(pattern="{self.pattern}")'
+
+    def scanner(self, module: "ModuleInfo") -> Callable[[str, int], int]:
+        key = ("skip", self.pattern)
+        if key in module.regex_cache:
+            return module.regex_cache[key]
+        try:
+            scan = barg.plan_leaf(self.pattern).scanner()
+        except Exception as e:
+            e.__barg_line = self.line
+            raise e
+        module.regex_cache[key] = scan
+        return scan
+
+    def _key(self) -> tuple:
+        return (self.pattern,)
+
+
+class AstPrescan(AstNode):
+    """
+    The `%prescan := Rule, ...;` directive. The named rules are leaves that are scanned for once over every input
+    before matching, so matching them is a lookup in their matches instead of a regex call (see barg_prescan.py).
+    """
+
+    def __init__(self, line: int, names: Tuple[str, ...]):
+        self.line = line
+        self.names = names
+        self._freeze()
+
+    def __str__(self) -> str:
+        return f"AstPrescan(names={self.names})"
+
+    def patterns(self, definitions: Dict[str, "AstNode"]) -> List[str]:
+        """
+        The patterns of the named rules, following aliases (`A := B;`). Rules that are not defined (anymore, see
+        barg.eliminate_dead_rules) are never matched and left out.
+        """
+        patterns = []
+        for name in self.names:
+            expr = definitions.get(name)
+            seen = {name}
+            while isinstance(expr, AstVariable) and expr.name not in seen:
+                seen.add(expr.name)
+                expr = definitions.get(expr.name)
+            if expr is None:
+                continue
+            if not isinstance(expr, AstString) or expr.backtrack:
+                raise BadGrammarError(
+                    f"%prescan rule '{name}' is not a (non-backtracking) leaf", self.line
+                )
+            if not barg.prescannable(expr.value):
+                raise BadGrammarError(
+                    f"%prescan rule '{name}' looks at the input in front of its match (anchors, word boundaries, "
+                    "lookbehinds or inline flags), so it cannot be scanned for in place",
+                    self.line,
+                )
+            patterns.append(expr.value)
+        return patterns
+
+    def _key(self) -> tuple:
+        return (self.names,)
 
 
 class Parser:
@@ -548,6 +1434,7 @@ class Parser:
         self.tokens = TokenIter(tokens)
         self.ast = None
         self.errors = []
+        self.has_tokens_section = False
 
     def parse(self):
         if self.ast is None:
@@ -572,9 +1459,20 @@ class Parser:
                     ):
                         pass
             self.ast = AstToplevel(0, tuple(assignments))
+            hash_cons(self.ast)
         return self.ast
 
     def parse_assignment(self):
+        if (
+            self.tokens.peek(1)
+            and self.tokens.peek().type_ == TokenType.IDENTIFIER
+            and self.tokens.peek().value == "tokens"
+            and self.tokens.peek(1).type_ == TokenType.LBRACE
+        ):
+            # `tokens` is no keyword: only a section header where a statement starts with `tokens {`
+            return self.parse_tokens()
+        if self.tokens.peek() and self.tokens.peek().type_ == TokenType.PERCENT:
+            return self.parse_directive()
         if (
             self.tokens.peek(1)
             and self.tokens.peek().type_ == TokenType.IDENTIFIER
@@ -739,9 +1637,25 @@ class Parser:
                 )
             token = self.expect_one_of(TokenType.RPAREN, TokenType.COMMA)
 
-        return AstTransform(
-            dollar.line, ".".join(transform_path), pattern_arg, tuple(args)
-        )
+        name = ".".join(transform_path)
+        if name == "builtin.backtrack":
+            # not a transform: marks a leaf as backtracking, see AstString
+            if not isinstance(pattern_arg, AstString) or args:
+                raise BadGrammarError(
+                    "builtin.backtrack takes exactly one argument, which must be a regex string", dollar.line
+                )
+            return AstString(pattern_arg.line, pattern_arg.value, True)
+        if name == "builtin.recover":
+            # not a transform either, see AstRecover
+            if not args or not all(isinstance(arg, str) for arg in args):
+                raise BadGrammarError(
+                    "builtin.recover takes an expression and the names of one or more synchronization rules",
+                    dollar.line,
+                )
+            return AstRecover(
+                dollar.line, pattern_arg, tuple(AstVariable(dollar.line, arg) for arg in args)
+            )
+        return AstTransform(dollar.line, name, pattern_arg, tuple(args))
 
     def parse_struct(self):
         struct_kwd = self.expect(TokenType.STRUCT)
@@ -770,7 +1684,12 @@ class Parser:
         return AstStruct(struct_kwd.line, tuple(fields))
 
     def parse_enum(self):
+        mode = "all"
         enum_kwd = self.expect(TokenType.ENUM)
+        if self.tokens.peek() and self.tokens.peek().type_ == TokenType.LBRACKET:
+            self.tokens.next()
+            mode = self.expect(TokenType.IDENTIFIER).value
+            self.expect(TokenType.RBRACKET)
         variants = []
         self.expect(TokenType.LBRACE)
         while self.tokens.peek() and self.tokens.peek().type_ != TokenType.RBRACE:
@@ -793,7 +1712,65 @@ class Parser:
             if self.tokens.peek() and self.tokens.peek().type_ == TokenType.COMMA:
                 self.tokens.next()
         self.expect(TokenType.RBRACE)
-        return AstEnum(enum_kwd.line, tuple(variants))
+        return AstEnum(enum_kwd.line, tuple(variants), mode)
+
+    def parse_tokens(self):
+        tokens_kwd = self.expect(TokenType.IDENTIFIER)
+        if self.has_tokens_section:
+            raise BadGrammarError(
+                "a grammar may only contain one tokens section", tokens_kwd.line
+            )
+        self.has_tokens_section = True
+        tokens = []
+        self.expect(TokenType.LBRACE)
+        while self.tokens.peek() and self.tokens.peek().type_ != TokenType.RBRACE:
+            # `skip Name: "pattern"` defines a token the lexer consumes but drops (whitespace, comments)
+            skip = False
+            if (
+                self.tokens.peek(1)
+                and self.tokens.peek().type_ == TokenType.IDENTIFIER
+                and self.tokens.peek().value == "skip"
+                and self.tokens.peek(1).type_ == TokenType.IDENTIFIER
+            ):
+                self.tokens.next()
+                skip = True
+            name = self.expect(TokenType.IDENTIFIER)
+            self.expect(TokenType.COLON)
+            token = self.expect_one_of(TokenType.STRING, TokenType.MULTILINE_STRING)
+            if token.type_ == TokenType.STRING:
+                pattern = token.value[1:-1].replace('\\"', '"')
+            else:
+                pattern = token.value[3:-3].replace('\\"', '"')
+            tokens.append(AstToken(name.line, name.value, len(tokens), pattern, skip))
+            if self.tokens.peek() and self.tokens.peek().type_ == TokenType.COMMA:
+                self.tokens.next()
+        self.expect(TokenType.RBRACE)
+        if self.tokens.peek() and self.tokens.peek().type_ == TokenType.SEMICOLON:
+            self.tokens.next()
+        return AstTokens(tokens_kwd.line, tuple(tokens))
+
+    def parse_directive(self):
+        percent = self.expect(TokenType.PERCENT)
+        name = self.expect(TokenType.IDENTIFIER)
+        if name.value not in ("skip", "prescan"):
+            raise BadGrammarError(
+                f"unknown directive '%{name.value}': the directives are '%skip' and '%prescan'", name.line
+            )
+        self.expect(TokenType.ASSIGN)
+        if name.value == "prescan":
+            names = [self.expect(TokenType.IDENTIFIER).value]
+            while self.tokens.peek() and self.tokens.peek().type_ == TokenType.COMMA:
+                self.tokens.next()
+                names.append(self.expect(TokenType.IDENTIFIER).value)
+            self.expect(TokenType.SEMICOLON)
+            return AstPrescan(percent.line, tuple(names))
+        token = self.expect_one_of(TokenType.STRING, TokenType.MULTILINE_STRING)
+        if token.type_ == TokenType.STRING:
+            pattern = token.value[1:-1].replace('\\"', '"')
+        else:
+            pattern = token.value[3:-3].replace('\\"', '"')
+        self.expect(TokenType.SEMICOLON)
+        return AstSkip(percent.line, pattern)
 
     def parse_list(self):
         mode = "greedy"
@@ -838,13 +1815,392 @@ class Parser:
         return token
 
 
-def parse(
-    strings: Iterable[str],
+def iter_nodes(ast: AstNode, stop: Iterable[int] = ()) -> Generator[AstNode, None, None]:
+    """
+    Yields every node of the tree rooted at `ast` once (variables are not followed). Nodes whose id is in `stop` are
+    neither yielded nor descended into.
+    """
+    seen = set(stop)
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        yield node
+        if isinstance(node, AstToplevel):
+            stack.extend(node.assignments)
+        elif isinstance(node, AstAssignment):
+            stack.append(node.expression)
+        elif isinstance(node, AstStruct):
+            stack.extend(expr for _, expr in node.fields)
+        elif isinstance(node, AstEnum):
+            stack.extend(expr for _, expr in node.variants)
+        elif isinstance(node, AstList):
+            stack.append(node.expression)
+        elif isinstance(node, AstTransform):
+            stack.append(node.pattern_arg)
+        elif isinstance(node, AstRecover):
+            stack.append(node.expression)
+            stack.extend(node.syncs)
+
+
+def map_children(node: AstNode, fn: Callable[[AstNode], AstNode]) -> AstNode:
+    """Returns `node` with every child replaced by fn(child). Nodes are immutable, so a new node is built if needed."""
+    if isinstance(node, AstStruct):
+        fields = tuple((name, fn(expr)) for name, expr in node.fields)
+        if any(new is not old for (_, new), (_, old) in zip(fields, node.fields)):
+            return AstStruct(node.line, fields, node.discard)
+    elif isinstance(node, AstEnum):
+        variants = tuple((tag, fn(expr)) for tag, expr in node.variants)
+        if any(new is not old for (_, new), (_, old) in zip(variants, node.variants)):
+            return AstEnum(node.line, variants, node.mode)
+    elif isinstance(node, AstList):
+        expression = fn(node.expression)
+        if expression is not node.expression:
+            return AstList(
+                node.line,
+                node.range_start,
+                node.range_end,
+                node.mode,
+                expression,
+                node.keep_mark,
+            )
+    elif isinstance(node, AstTransform):
+        pattern_arg = fn(node.pattern_arg)
+        if pattern_arg is not node.pattern_arg:
+            return AstTransform(node.line, node.name, pattern_arg, node.args)
+    elif isinstance(node, AstRecover):
+        expression = fn(node.expression)
+        syncs = tuple(fn(sync) for sync in node.syncs)
+        if expression is not node.expression or any(new is not old for new, old in zip(syncs, node.syncs)):
+            return AstRecover(node.line, expression, syncs)
+    return node
+
+
+def rewrite_tree(
+    toplevel: AstToplevel, post: Callable[[AstNode], AstNode], roots: bool = True
+) -> None:
+    """
+    Rebuilds the rules of `toplevel` bottom-up: the children of a node are rewritten first, then `post(node)` returns
+    the node to use in its place. Shared nodes are rewritten once. If `roots` is False, `post` is not applied to the
+    expressions of the assignments themselves.
+    """
+    memo = {}  # id -> (node, rewritten), the node is kept alive so its id is not reused
+
+    def visit(node):
+        entry = memo.get(id(node))
+        if entry is None:
+            entry = memo[id(node)] = (node, post(map_children(node, visit)))
+        return entry[1]
+
+    for i, assignment in enumerate(toplevel.assignments):
+        expr = assignment.expression
+        new = visit(expr) if roots else map_children(expr, visit)
+        if new is not expr:
+            toplevel.assignments[i] = AstAssignment(assignment.line, assignment.identifier, new)
+
+
+def hash_cons(toplevel: AstToplevel) -> None:
+    """
+    Makes structurally identical sub-expressions of `toplevel` the same node object, so they share compiled state
+    (generated types, regexes, codegen matchers) and compare by identity. The expressions of the rules themselves
+    stay distinct objects, so per-rule hooks (actions, profiling) only apply to their rule.
+    """
+    interned = {}
+    rewrite_tree(toplevel, lambda node: interned.setdefault(node, node), roots=False)
+
+
+def rule_names(toplevel: AstToplevel) -> Dict[int, str]:
+    """
+    Maps the id of every node of `toplevel` to the name of the rule (assignment) it is defined in.
+    Nodes shared between rules (see hash_cons) get the names of all of them, separated by commas. Rules referenced
+    directly (see barg_passes.resolve_variables) keep their own name.
+    """
+    roots = {id(a.expression) for a in toplevel.assignments}
+    names: Dict[int, List[str]] = {}
+    for assignment in toplevel.assignments:
+        for node in iter_nodes(assignment.expression, roots - {id(assignment.expression)}):
+            names.setdefault(id(node), []).append(assignment.identifier)
+    return {key: ", ".join(rules) for key, rules in names.items()}
+
+
+def instrument(toplevel: AstToplevel, wrap):
+    """
+    Replaces the match method of every matchable node of `toplevel` by `wrap(node, original_match)`.
+    Instrumentation is installed per node instance, so uninstrumented grammars pay nothing for it.
+    Recognizing goes through the instrumented matchers as well.
+    Returns a function that restores the previous matchers (undo instrumentations in reverse order).
+    """
+    previous = []
+    for node in iter_nodes(toplevel):
+        if isinstance(node, (AstToplevel, AstAssignment, AstTextString)):
+            continue
+        previous.append((node, node.__dict__.get("match"), node.__dict__.get("recognize")))
+        node.match = wrap(node, node.match)
+        node.recognize = _recognize_with(node.match)
+
+    def uninstall():
+        for node, match, recognize in previous:
+            for name, method in (("match", match), ("recognize", recognize)):
+                if method is None:
+                    delattr(node, name)
+                else:
+                    setattr(node, name, method)
+
+    return uninstall
+
+
+def install_actions(
+    toplevel: AstToplevel, actions: Dict[str, Callable[[Any], Any]], lazy: bool = False
+):
+    """
+    Installs semantic actions: the matches of the rule `name` are passed to `actions[name]` and replaced by its
+    return value. Matching only records which matches need an action, the actions run once per match in the
+    committed result, innermost rules first (see resolve_actions), so matches that are backtracked out of never reach
+    them. The exception are matches passed to a transform: the transform sees the action's result, so the action runs
+    when the transform does. Filters and marks pushed into matching (see push_down_transforms) see the match itself.
+    With `lazy` set, actions receive forced values instead of derivations (see barg_lazy.py).
+    Returns a function that removes the actions again.
+    """
+    definitions = {a.identifier: a.expression for a in toplevel.assignments}
+    for name in actions:
+        if name not in definitions:
+            raise BadGrammarError(f"semantic action for undefined rule '{name}'")
+    previous = []
+    if not lazy:
+        for node in iter_nodes(toplevel):
+            if isinstance(node, AstTransform):
+                previous.append((node, node.__dict__.get("match")))
+                node.match = _with_resolved_args(node)
+    for name, action in actions.items():
+        node = definitions[name]
+        previous.append((node, node.__dict__.get("match")))
+        node.match = _with_action(node, node.match, action)
+
+    def uninstall():
+        for node, match in reversed(previous):
+            if match is None:
+                delattr(node, "match")
+            else:
+                node.match = match
+
+    return uninstall
+
+
+class _PendingAction:
+    """
+    A match of a rule with a semantic action, whose action has not run yet. The action runs once, when the match is
+    committed to (see resolve_actions) or passed to a transform. Attribute lookups (eg. marks) see the match itself.
+    """
+
+    __slots__ = ("node", "action", "value", "result", "done")
+
+    def __init__(self, node: AstNode, action, value):
+        self.node = node
+        self.action = action
+        self.value = value
+        self.result = None
+        self.done = False
+
+    def __getattr__(self, name: str):
+        return getattr(self.value, name)
+
+    def resolve(self, force):
+        """Runs the action on the match, after `force` resolved the actions of the rules inside it"""
+        if not self.done:
+            try:
+                self.result = self.action(force(self.value))
+            except Exception as e:
+                e.__barg_line = self.node.line  # attach barg grammar line info
+                raise e
+            self.done = True
+            self.value = None
+        return self.result
+
+
+def resolve_actions(value):
+    """
+    Runs the pending semantic actions in a match result, innermost rules first, and returns the result with each
+    rule match replaced by what its action returned. Lists and structs are updated in place.
+    """
+    if isinstance(value, _PendingAction):
+        return value.resolve(resolve_actions)
+    if isinstance(value, list):
+        for i, item in enumerate(value):
+            value[i] = resolve_actions(item)
+    elif isinstance(value, tuple):
+        return tuple(map(resolve_actions, value))
+    else:
+        kind = getattr(value, "type_", None)
+        if kind == GenTyKind.STRUCT:
+            for name in getattr(type(value), "fields_", ()):
+                setattr(value, name, resolve_actions(getattr(value, name)))
+        elif kind == GenTyKind.ENUM:
+            value.value = resolve_actions(value.value)
+    return value
+
+
+def _with_action(node: AstNode, match, action):
+    def action_match(string: str, module: "ModuleInfo", symbol: Optional[str] = None):
+        for m, ncons in match(string, module, symbol):
+            yield _PendingAction(node, action, m), ncons
+
+    return action_match
+
+
+def _with_resolved_args(node: "AstTransform"):
+    # transforms see the results of the actions of the rules they are applied to, so those run when the transform
+    # runs (lazy matchers force the argument, which resolves them, see barg_lazy._force)
+    def resolved_match(string: str, module: "ModuleInfo", symbol: Optional[str] = None):
+        transform = barg.get_transform(module.barg_transforms, node.name)
+        for pattern_arg, ncons in node.pattern_arg.match(string, module):
+            try:
+                yield transform(module, string, ncons, resolve_actions(pattern_arg), *node.args)
+            except Exception as e:
+                e.__barg_line = node.line  # attach barg grammar line info
+                raise e
+
+    return resolved_match
+
+
+def _recognize_with(match):
+    def recognize(string: str, module: "ModuleInfo"):
+        for _, ncons in match(string, module):
+            yield ncons
+
+    return recognize
+
+
+def _resolves_to_builtin(
+    transforms: Optional[Dict[str, Any]], name: str, builtin
+) -> bool:
+    if transforms is None:
+        return True  # codegen: the generated parser only has the builtins
+    try:
+        return barg.get_transform(transforms, name) is builtin
+    except (BadGrammarError, InternalError):
+        return False
+
+
+def push_down_transforms(
+    toplevel: AstToplevel, transforms: Optional[Dict[str, Any]] = None
+) -> None:
+    """
+    Compile-time rewrite of transforms whose effect can be applied while matching:
+    `$builtin.delete(struct {...}, f)` only recognizes field f instead of building its value and
+    `$builtin.filter(X*, mark)` drops unmarked items as the list is matched.
+    If `transforms` is given, only names that resolve to the builtin implementations are rewritten.
+    """
+
+    def is_builtin(name: str, builtin) -> bool:
+        return _resolves_to_builtin(transforms, name, builtin)
+
+    def rewrite(node):
+        if isinstance(node, AstTransform):
+            arg = node.pattern_arg
+            field = node.args[0] if len(node.args) == 1 else None
+            if not isinstance(field, str) or not field:
+                return node
+            if (
+                node.name == "builtin.delete"
+                and is_builtin(node.name, barg.barg_exec_builtins.builtin_delete)
+                and isinstance(arg, AstStruct)
+                and field in map(lambda f: f[0], arg.fields)
+            ):
+                return AstStruct(arg.line, arg.fields, arg.discard + (field,))
+            if (
+                node.name == "builtin.filter"
+                and is_builtin(node.name, barg.barg_exec_builtins.builtin_filter)
+                and isinstance(arg, AstList)
+                and arg.keep_mark is None
+            ):
+                return AstList(
+                    arg.line,
+                    arg.range_start,
+                    arg.range_end,
+                    arg.mode,
+                    arg.expression,
+                    field,
+                )
+        return node
+
+    rewrite_tree(toplevel, rewrite)
+
+
+def specialize_transforms(
+    toplevel: AstToplevel, transforms: Optional[Dict[str, Any]] = None
+) -> None:
+    """
+    Compile-time rewrite of common pyexpr snippets to the equivalent native builtins:
+    `x[1:-1]` becomes `builtin.strip_quotes`, immutable python literals like `None` become `builtin.const`
+    and `int(x)`/`float(x)` applied to a leaf become `builtin.int`/`builtin.float`.
+    If `transforms` is given, only names that resolve to the builtin implementations are rewritten.
+    """
+    builtins = barg.barg_exec_builtins
+    definitions = {a.identifier: a.expression for a in toplevel.assignments}
+
+    def pyexpr_code(node: AstTransform) -> Optional[str]:
+        if (
+            node.name != "builtin.pyexpr"
+            or len(node.args) != 1
+            or not _resolves_to_builtin(transforms, node.name, builtins.builtin_pyexpr)
+        ):
+            return None
+        arg = node.args[0]
+        if isinstance(arg, str):
+            arg = definitions.get(arg)
+        return arg.value.strip() if isinstance(arg, AstTextString) else None
+
+    def is_leaf(node) -> bool:
+        if isinstance(node, AstVariable):
+            node = definitions.get(node.name)
+        return isinstance(node, (AstString, AstToken))
+
+    def specialize(node: AstTransform, code: str):
+        compact = "".join(code.split())
+        if compact == "x[1:-1]":
+            name, args = "builtin.strip_quotes", tuple()
+        elif compact in ("int(x)", "float(x)") and is_leaf(node.pattern_arg):
+            # the builtins only accept strings, which is all a leaf can match
+            name, args = f"builtin.{compact[:-3]}", tuple()
+        else:
+            try:
+                value = python_ast.literal_eval(code)
+            except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                return node
+            if not builtins.immutable_literal(value):
+                # the pyexpr builds a new list/dict/set for every match, which the caller may mutate
+                return node
+            name, args = "builtin.const", (AstTextString(node.line, code),)
+        builtin = getattr(builtins, name.replace(".", "_"))
+        if not _resolves_to_builtin(transforms, name, builtin):
+            return node
+        return AstTransform(node.line, name, node.pattern_arg, args)
+
+    def rewrite(node):
+        if isinstance(node, AstTransform):
+            code = pyexpr_code(node)
+            if code is not None:
+                return specialize(node, code)
+        return node
+
+    rewrite_tree(toplevel, rewrite)
+
+
+def compile_grammar(
     grammar: str,
     error_out: List[str],
-    grammar_toplevel_name: str = "Toplevel",
     barg_exec_transforms=None,
-) -> List[Generator]:
+    roots: Optional[Iterable[str]] = None,
+    prescan: Optional[Iterable[str]] = None,
+) -> CompiledGrammar:
+    """
+    Lexes and parses `grammar` and runs the compile passes on it (see barg_passes.py). Recoverable grammar errors are
+    appended to `error_out`. The result can be shared between threads, see `CompiledGrammar.parse`.
+    If `roots` is given, only those rules can be matched and everything they do not use is dropped.
+    `prescan` names leaf patterns to index per input, see CompiledGrammar.
+    """
     if barg_exec_transforms is None:
         barg_exec_transforms = barg.BARG_EXEC_BUILTINS
     lexer = Lexer(grammar)
@@ -853,8 +2209,64 @@ def parse(
     parser = Parser(tokens)
     ast = parser.parse()
     error_out.extend(parser.errors)
-    module = ModuleInfo(ast, barg_exec_transforms)
-    out = [ast.match(string, module, grammar_toplevel_name) for string in strings]
+    barg.optimize(ast, barg_exec_transforms, roots)
+    barg.warn_nullable_lists(ast)
+    return CompiledGrammar(ast, barg_exec_transforms, prescan)
+
+
+def parse(
+    strings: Iterable[str],
+    grammar: str,
+    error_out: List[str],
+    grammar_toplevel_name: str = "Toplevel",
+    barg_exec_transforms=None,
+    lazy: bool = False,
+    profiler: "Optional[barg.Profiler]" = None,
+    tracer: "Optional[barg.Tracer]" = None,
+    budget: "Optional[barg.ParseBudget]" = None,
+    actions: Optional[Dict[str, Callable[[Any], Any]]] = None,
+    raise_on_failure: bool = False,
+) -> List[Generator]:
+    """
+    If `lazy` is set, matching only records the chosen derivations and structs/enums are built on attribute access
+    (see barg_lazy.py). Use `barg.materialize` to turn such a result into the eagerly generated types.
+    If a `profiler` is given, it is installed on the grammar and records statistics for all parses of `strings`.
+    A `tracer` receives the match events of all parses (see `ModuleInfo.set_tracer`).
+    A `budget` limits the match steps and wall-clock time of each parse, exceeding it raises
+    `barg.ParseBudgetExceeded` from the result generator.
+    `actions` maps rule names to functions that replace the matches of the rule in the result by their return value
+    (see `install_actions`).
+    With `raise_on_failure` set, a generator that has no match raises a `barg.ParseError` with the farthest position
+    the parse got to and the leaves expected there, instead of just stopping.
+    """
+    # rules with actions are installed by name, so they are kept as well
+    roots = [grammar_toplevel_name, *(actions or ())]
+    compiled = compile_grammar(grammar, error_out, barg_exec_transforms, roots)
+    ast = compiled.toplevel
+    if lazy:
+        barg.barg_lazy.install_lazy_matchers(ast)
+    if actions:
+        install_actions(ast, actions, lazy)
+    if profiler is not None:
+        profiler.install(ast)
+    if tracer is not None:
+        compiled.set_tracer(tracer)
+    if budget is not None:
+        budget.install(ast)
+    out = []
+    for string in strings:
+        # every parse gets its own context, so the generators can be consumed in any order
+        module = compiled.context()
+        results = ast.match(string, module, grammar_toplevel_name)
+        if lazy:
+            results = barg.barg_lazy.lazy_results(results, module)
+        elif actions:
+            results = ((resolve_actions(m), ncons) for m, ncons in results)
+        if raise_on_failure:
+            results = barg.barg_errors.raise_on_failure(results, module, string)
+        out.append(results)
+    if budget is not None:
+        out = [budget.limit(results) for results in out]
     return out
 
 
@@ -896,7 +2308,11 @@ def parse(
 
 
 def generate_python_parser(
-    grammar: str, error_out: List[str], head: Optional[str] = None
+    grammar: str,
+    error_out: List[str],
+    head: Optional[str] = None,
+    traced: bool = False,
+    roots: Optional[Iterable[str]] = None,
 ):
     """
     Generate python code from the given grammar and return it in a string.
@@ -904,6 +2320,8 @@ def generate_python_parser(
         grammar: the barg grammar
         error_out: a list where recoverable grammar errors will be written out to as strings.
         head: optional string to be inserted at the top of the generated parser. should contain builtins and imports. if None, then a very minimalistic default will be used.
+        traced: generate a parser with a `_set_tracer_(tracer)` function that reports match events (see barg.Tracer).
+        roots: if given, the parser only contains these rules and the rules they use.
     """
     lexer = Lexer(grammar)
     tokens = lexer.tokenize()
@@ -911,6 +2329,8 @@ def generate_python_parser(
     parser = Parser(tokens)
     ast = parser.parse()
     error_out.extend(parser.errors)
+    barg.optimize(ast, None, roots)
     module = ModuleInfo(ast, {})
-    pycg = barg.PythonCodeGenerator(ast, module)
+    pycg = barg.PythonCodeGenerator(ast, module, traced)
+    barg.warn_nullable_lists(ast, pycg.nullable)
     return pycg.codegen(head)
@@ -0,0 +1,109 @@
+import barg
+from array import array
+from bisect import bisect_right
+from typing import Iterator, List, Tuple
+
+
+class LineIndex:
+    """
+    The offsets at which the lines of an input start. Built once per input, it maps an offset to its (line, column)
+    by binary search instead of counting newlines in front of it.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.starts = array("q", [0])
+        pos = text.find("\n")
+        while pos != -1:
+            self.starts.append(pos + 1)
+            pos = text.find("\n", pos + 1)
+
+    def position(self, offset: int) -> Tuple[int, int]:
+        """The 1-based (line, column) of `offset`"""
+        i = bisect_right(self.starts, offset) - 1
+        return i + 1, offset - self.starts[i] + 1
+
+    def line_text(self, line: int) -> str:
+        start = self.starts[line - 1]
+        end = self.starts[line] - 1 if line < len(self.starts) else len(self.text)
+        return self.text[start:end]
+
+
+class ErrorNode:
+    """
+    The value of a `$builtin.recover(...)` expression whose rule did not match: the input from `start` up to `end`
+    (offsets into the whole input) was skipped, up to and including the next synchronization token.
+    It looks like a struct with the fields start, end and text to transforms, sinks and `to_plain`.
+    """
+
+    type_ = barg.GenTyKind.STRUCT
+    fields_ = ("start", "end", "text")
+
+    def __init__(self, start: int, end: int, text: str):
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def __str__(self):
+        return f"error {{start: {self.start}, end: {self.end}, text: {self.text!r}}}"
+
+    def __repr__(self):
+        return str(self)
+
+
+class ParseError(Exception):
+    """
+    Raised from the result generator of `barg.parse(..., raise_on_failure=True)` if the input does not match at all.
+    `offset` is the farthest input offset any leaf was tried at (where the input most likely stops making sense),
+    `line` and `column` are its 1-based position and `expected` describes the leaves that failed to match there.
+    """
+
+    def __init__(self, offset: int, line: int, column: int, expected: List[str], source_line: str):
+        self.offset = offset
+        self.line = line
+        self.column = column
+        self.expected = expected
+        self.source_line = source_line
+        super().__init__(str(self))
+
+    def __str__(self):
+        found = self.source_line[self.column - 1 : self.column + 19]
+        found = repr(found) if found else "the end of the line"
+        expected = f"expected one of {', '.join(self.expected)}" if self.expected else "nothing could be matched"
+        return (
+            f"On line {self.line}, column {self.column}: {expected} but found {found}\n"
+            + self.source_line
+            + "\n"
+            + " " * (self.column - 1)
+            + "^"
+        )
+
+
+def describe_leaf(node: "barg.AstNode", definitions) -> str:
+    """A leaf is described by the name of the rule it is the whole expression of, else by its regex"""
+    for name, expr in definitions.items():
+        if expr is node:
+            return name
+    if isinstance(node, barg.AstToken):
+        return node.name
+    return f'"{node.value}"'
+
+
+def parse_error(module: "barg.ModuleInfo", text: str) -> ParseError:
+    """The ParseError for a parse of `text` in `module` that did not match (see ModuleInfo.fail)"""
+    if module.line_index is None or module.line_index.text is not text:
+        module.line_index = LineIndex(text)
+    offset = max(module.failure_pos, 0)
+    line, column = module.line_index.position(offset)
+    expected = sorted({describe_leaf(node, module.definitions) for node in module.failure_expected})
+    return ParseError(offset, line, column, expected, module.line_index.line_text(line))
+
+
+def raise_on_failure(results: Iterator, module: "barg.ModuleInfo", text: str) -> Iterator:
+    """Passes the matches of `results` through and raises a ParseError if there are none"""
+    matched = False
+    for item in results:
+        matched = True
+        yield item
+    if not matched:
+        raise parse_error(module, text)
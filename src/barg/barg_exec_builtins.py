@@ -1,4 +1,6 @@
+import ast
 import barg
+import regex
 from typing import Optional, Any, Dict, Callable
 
 
@@ -78,6 +80,83 @@ def builtin_filter(module, text: str, ncons: int, m, mark: str):
     return list(filter(lambda item: hasattr(item, f"mark_{mark}_"), m)), ncons
 
 
+def builtin_strip_quotes(module, text: str, ncons: int, m):
+    # same as the pyexpr `x[1:-1]`, without the eval
+    return m[1:-1], ncons
+
+
+_CONSTS = {}  # python literal to its value, for immutable values only
+
+
+def immutable_literal(value) -> bool:
+    """Whether a python literal's value can be shared between matches: no lists, dicts or sets, also not nested"""
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return True
+    if isinstance(value, (tuple, frozenset)):
+        return all(immutable_literal(item) for item in value)
+    return False
+
+
+def builtin_const(
+    module, text: str, ncons: int, m, value: "barg.AstTextString | str | int | Any"
+):
+    """
+    Discards the match and returns a python literal. Immutable values are evaluated once and shared between all
+    matches, mutable ones (lists, dicts, sets) are evaluated anew for every match, like the pyexpr would.
+    """
+    if isinstance(value, int):
+        return value, ncons
+    code = value.value if isinstance(value, barg.AstTextString) else value
+    if code in _CONSTS:
+        return _CONSTS[code], ncons
+    try:
+        result = ast.literal_eval(code)
+    except (ValueError, SyntaxError, TypeError):
+        raise barg.BadGrammarError(
+            f"the value parameter of the const builtin must be a python literal, not '{code}'"
+        )
+    if immutable_literal(result):
+        _CONSTS[code] = result
+    return result, ncons
+
+
+def builtin_bool(module, text: str, ncons: int, m):
+    if m == "true":
+        return True, ncons
+    elif m == "false":
+        return False, ncons
+    raise barg.BadGrammarError(
+        f"the match parameter of the bool builtin must be 'true' or 'false', not {m!r}"
+    )
+
+
+_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+# a UTF-16 surrogate pair (as JSON writes characters outside the BMP) is one escape
+_ESCAPE_PAT = regex.compile(
+    r"\\(u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F][0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|.)", regex.DOTALL
+)
+
+
+def _unescape_one(m) -> str:
+    esc = m.group(1)
+    if len(esc) == 11:
+        return chr(0x10000 + ((int(esc[1:5], 16) - 0xD800) << 10) + int(esc[7:], 16) - 0xDC00)
+    if len(esc) == 5:
+        return chr(int(esc[1:], 16))
+    return _ESCAPES.get(esc, esc)
+
+
+def builtin_unescape(module, text: str, ncons: int, m):
+    """Resolves JSON-style backslash escapes (\\n, \\", \\u00e4, ...)"""
+    if not isinstance(m, str):
+        raise barg.BadGrammarError(
+            f"the match parameter of the unescape builtin must be a string match, not type {type(m)}",
+        )
+    if "\\" not in m:
+        return m, ncons
+    return _ESCAPE_PAT.sub(_unescape_one, m), ncons
+
+
 def builtin_pyexpr(
     module, text: str, ncons: int, m, pyexpr: "barg.AstTextString | str | Any", *args
 ):
@@ -168,8 +247,14 @@ def insert_all_builtins(transforms):
     insert_transform(transforms, "builtin.filter", builtin_filter)
     insert_transform(transforms, "builtin.pyexpr", builtin_pyexpr)
     insert_transform(transforms, "builtin.pyscript", builtin_pyscript)
+    insert_transform(transforms, "builtin.strip_quotes", builtin_strip_quotes)
+    insert_transform(transforms, "builtin.const", builtin_const)
+    insert_transform(transforms, "builtin.bool", builtin_bool)
+    insert_transform(transforms, "builtin.unescape", builtin_unescape)
 
 
 TAKE_BUILTIN_NAME = "builtin.take"
+# builtins that return the ncons they got, so their argument can be recognized instead of matched if the result is discarded
+NCONS_PRESERVING_BUILTINS = (builtin_take, builtin_delete, builtin_mark, builtin_filter)
 BARG_EXEC_BUILTINS = {}
 insert_all_builtins(BARG_EXEC_BUILTINS)
@@ -0,0 +1,277 @@
+import barg
+import regex
+from typing import Iterable, List, Optional, Dict, Tuple, Any
+
+
+class TextEdit:
+    """
+    Replaces `text[start:end]` of a document with `text`.
+    When several edits are passed to `reparse` at once, each edit's offsets refer to the document with all previous edits applied.
+    """
+
+    def __init__(self, start: int, end: int, text: str):
+        if start < 0 or end < start:
+            raise ValueError(f"invalid edit range [{start}, {end})")
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def __str__(self):
+        return f"TextEdit(start={self.start}, end={self.end}, text={self.text!r})"
+
+    def __repr__(self):
+        return str(self)
+
+
+def _viable_prefix_len(pat, string: str, pos: int = 0) -> int:
+    """
+    Length of the longest prefix of `string[pos:]` that a match of `pat` could still start with.
+    The regex engine cannot have looked further than one character past it, whether the match succeeded or not.
+    """
+    n = len(string) - pos
+    lo, hi = 0, 1
+    while hi <= n and pat.fullmatch(string, pos, pos + hi, partial=True) is not None:
+        lo, hi = hi, hi * 2
+    hi = min(hi, n + 1)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if pat.fullmatch(string, pos, pos + mid, partial=True) is not None:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def _contains_error_node(value, seen: Dict[int, bool]) -> bool:
+    """Whether a matched value has an ErrorNode somewhere inside (results are shared, so `seen` caches by id)"""
+    if isinstance(value, barg.ErrorNode):
+        return True
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return False
+    key = id(value)
+    if key not in seen:
+        seen[key] = False  # values are trees, this only guards against revisiting shared ones
+        if isinstance(value, (list, tuple)):
+            children = value
+        else:
+            children = vars(value).values() if hasattr(value, "__dict__") else ()
+        seen[key] = any(_contains_error_node(child, seen) for child in children)
+    return seen[key]
+
+
+class _MemoEntry:
+    """
+    The memoized result stream of one node at one input offset. `items` is the prefix of the stream produced so far,
+    `reach` is the (exclusive) end of the input region that was examined to produce it.
+    """
+
+    __slots__ = ("items", "gen", "skip", "exhausted", "reach")
+
+    def __init__(self, start: int):
+        self.items: List[Tuple[Any, int]] = []
+        self.gen = None
+        self.skip = 0  # items to drop from a freshly created generator (they are already in `items`)
+        self.exhausted = False
+        self.reach = start
+
+
+class _Session:
+    """Memo table and bookkeeping shared by a parse tree and all trees reparsed from it"""
+
+    def __init__(self, module: "barg.ModuleInfo", toplevel_name: str):
+        self.module = module
+        self.toplevel_name = toplevel_name
+        self.memo: Dict[Tuple[int, int], _MemoEntry] = {}
+        self.length = 0
+        self.reach = 0
+        self.computed = 0  # number of results computed by running a matcher (as opposed to replayed from the memo)
+        # recovered errors (see barg.AstRecover) hold absolute offsets, results holding them cannot be moved by an edit
+        self.recovers = any(isinstance(n, barg.AstRecover) for n in barg.iter_nodes(module.toplevel))
+        self.sync_patterns: Dict[str, Any] = {}  # synchronization pattern to its compiled regex (see recover_reach)
+        barg.instrument(module.toplevel, self.memoize)
+
+    def memoize(self, node: "barg.AstNode", match):
+        if isinstance(node, barg.AstVariable):
+            return match  # only forwards to the definition, which is memoized itself
+
+        memo = self.memo
+        node_id = id(node)
+        is_leaf = isinstance(node, (barg.AstString, barg.AstToken))
+        is_recover = isinstance(node, barg.AstRecover)
+
+        def memo_match(string: str, module: "barg.ModuleInfo", symbol: Optional[str] = None):
+            start = self.length - len(string)
+            key = (node_id, start)
+            entry = memo.get(key)
+            if entry is None:
+                entry = memo[key] = _MemoEntry(start)
+            i = 0
+            while True:
+                if entry.reach > self.reach:
+                    # whoever consumes this result depends on the same input region
+                    self.reach = entry.reach
+                if i < len(entry.items):
+                    yield entry.items[i]
+                    i += 1
+                    continue
+                if entry.exhausted:
+                    return
+                outer_reach = self.reach
+                self.reach = start
+                item = None
+                try:
+                    if entry.gen is None:
+                        entry.gen = match(string, module, symbol)
+                        while entry.skip:
+                            next(entry.gen)
+                            entry.skip -= 1
+                    item = next(entry.gen)
+                    self.computed += 1
+                except StopIteration:
+                    entry.exhausted = True
+                    entry.gen = None
+                if is_leaf:
+                    leaf_reach = self.leaf_reach(node, string, module, start)
+                    if leaf_reach > self.reach:
+                        self.reach = leaf_reach
+                elif is_recover and not entry.items and (item is None or isinstance(item[0], barg.ErrorNode)):
+                    # the expression did not match, so the synchronization set was searched for
+                    recover_reach = self.recover_reach(node, string, module, start)
+                    if recover_reach > self.reach:
+                        self.reach = recover_reach
+                entry.reach = max(entry.reach, self.reach)
+                self.reach = max(outer_reach, entry.reach)
+                if item is None:
+                    return
+                entry.items.append(item)
+
+        return memo_match
+
+    @staticmethod
+    def leaf_reach(node: "barg.AstNode", string: str, module: "barg.ModuleInfo", start: int) -> int:
+        if isinstance(node, barg.AstString):
+            return start + _viable_prefix_len(node.compiled(module), string) + 1
+        # tokens: the lexer decided the extent of the token found here by running the combined token pattern
+        stream = module.token_stream
+        i = stream.index.get(start)
+        if i is None:
+            return start + 1
+        pat = module.regex_cache[module.toplevel.tokens.pattern]
+        token_start = stream.starts[i] - start
+        return stream.starts[i] + _viable_prefix_len(pat, string, token_start) + 1
+
+    def recover_reach(self, node: "barg.AstRecover", string: str, module: "barg.ModuleInfo", start: int) -> int:
+        pattern = node.sync_pattern(module)
+        if pattern is None:
+            return start  # the synchronization rules were tried one by one, through their memoized matchers
+        pat = self.sync_patterns.get(pattern)
+        if pat is None:
+            pat = self.sync_patterns[pattern] = regex.compile(pattern)
+        # one scan found the synchronization set (see AstRecover._search), it tried every offset up to the match
+        m = pat.search(string)
+        if m is None:
+            return self.length + 1  # any text appended to the input may hold a synchronization token
+        return start + max(pos + _viable_prefix_len(pat, string, pos) for pos in range(m.start() + 1)) + 1
+
+    def run(self, text: str) -> "ParseTree":
+        self.length = len(text)
+        self.reach = 0
+        self.computed = 0
+        g = self.module.toplevel.match(text, self.module, self.toplevel_name)
+        try:
+            value, ncons = next(g)
+            matched = True
+        except StopIteration:
+            value, ncons = None, 0
+            matched = False
+        g.close()
+        # suspended generators keep their (sliced) input alive, only the results are needed for reparsing
+        for entry in self.memo.values():
+            if entry.gen is not None:
+                entry.gen.close()
+                entry.gen = None
+                entry.skip = len(entry.items)
+        return ParseTree(text, matched, value, ncons, self)
+
+    def apply_edit(self, edit: TextEdit, old_length: int):
+        if edit.end > old_length:
+            raise ValueError(
+                f"edit range [{edit.start}, {edit.end}) is out of bounds for a document of length {old_length}"
+            )
+        delta = len(edit.text) - (edit.end - edit.start)
+        # the lexer may split the input after an edit differently, so with a tokens section nothing after it is reused
+        reuse_after = self.module.toplevel.tokens is None
+        memo = {}
+        seen: Dict[int, bool] = {}
+        for (node_id, start), entry in self.memo.items():
+            if start >= edit.end and reuse_after:
+                # matchers only see the input from their start offset on, which the edit did not touch
+                if delta and self.recovers and _contains_error_node(entry.items, seen):
+                    continue
+                entry.reach += delta
+                memo[(node_id, start + delta)] = entry
+            elif start < edit.start and entry.reach <= edit.start:
+                memo[(node_id, start)] = entry
+        # updated in place, the instrumented matchers hold a reference to it
+        self.memo.clear()
+        self.memo.update(memo)
+
+
+class ParseTree:
+    """
+    The result of an incremental parse. `value` and `ncons` are the first match of the toplevel rule (if `matched`).
+    Pass it to `reparse` together with the edits made to `text` to get the tree of the edited document.
+    """
+
+    def __init__(self, text: str, matched: bool, value, ncons: int, session: _Session):
+        self.text = text
+        self.matched = matched
+        self.value = value
+        self.ncons = ncons
+        self.computed = session.computed
+        self._session = session
+
+    def __str__(self):
+        return f"ParseTree(matched={self.matched}, ncons={self.ncons}, value={self.value})"
+
+    def __repr__(self):
+        return str(self)
+
+
+def parse_incremental(
+    text: str,
+    grammar: str,
+    error_out: List[str],
+    grammar_toplevel_name: str = "Toplevel",
+    barg_exec_transforms=None,
+) -> ParseTree:
+    """
+    Parse `text` like `barg.parse`, but memoize the result streams of all nodes by input offset so the returned tree can be reparsed after edits.
+    Transforms must not depend on anything but their match: results are shared between all derivations that reach the same node at the same offset.
+    """
+    if barg_exec_transforms is None:
+        barg_exec_transforms = barg.BARG_EXEC_BUILTINS
+    lexer = barg.Lexer(grammar)
+    tokens = lexer.tokenize()
+    error_out.extend(lexer.errors)
+    parser = barg.Parser(tokens)
+    ast = parser.parse()
+    error_out.extend(parser.errors)
+    # the same passes as every other parse: results are memoized per node, which the passes keep shared
+    barg.optimize(ast, barg_exec_transforms)
+    barg.warn_nullable_lists(ast)
+    module = barg.ModuleInfo(ast, barg_exec_transforms)
+    return _Session(module, grammar_toplevel_name).run(text)
+
+
+def reparse(old_tree: ParseTree, edits: Iterable[TextEdit]) -> ParseTree:
+    """
+    Parse the document obtained by applying `edits` to `old_tree.text`, reusing every memoized result whose input region was not touched by an edit.
+    `old_tree` must not be reparsed again afterwards (its memo table is updated in place).
+    """
+    session = old_tree._session
+    text = old_tree.text
+    for edit in edits:
+        session.apply_edit(edit, len(text))
+        text = text[: edit.start] + edit.text + text[edit.end :]
+    return session.run(text)
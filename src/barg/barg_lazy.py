@@ -0,0 +1,190 @@
+import barg
+from typing import Optional
+
+
+class _LeafDerivation:
+    """
+    A leaf match, recorded as its span in the whole input. All leaves of a parse share the input string instead of
+    keeping the suffix they were matched on, which would retain memory quadratic in the input length.
+    """
+
+    __slots__ = ("text", "start", "end")
+
+    def __init__(self, text: str, start: int, end: int):
+        self.text = text
+        self.start = start
+        self.end = end
+
+    def value(self) -> str:
+        return self.text[self.start : self.end]
+
+
+class _StructDerivation:
+    """A struct match, recorded as the struct node and the derivations of its fields"""
+
+    __slots__ = ("node", "fields")
+
+    def __init__(self, node: "barg.AstStruct", fields: tuple):
+        self.node = node
+        self.fields = fields
+
+
+class _EnumDerivation:
+    """An enum match, recorded as the enum node, the tag of the matched variant and its derivation"""
+
+    __slots__ = ("node", "tag", "value")
+
+    def __init__(self, node: "barg.AstEnum", tag: str, value):
+        self.node = node
+        self.tag = tag
+        self.value = value
+
+
+def _force(value, module: "barg.ModuleInfo"):
+    """Turns a derivation into the value a transform or user sees. Struct and enum derivations become lazy objects."""
+    if isinstance(value, _LeafDerivation):
+        return value.value()
+    elif isinstance(value, _StructDerivation):
+        return LazyStruct(value.node, module, value.fields)
+    elif isinstance(value, _EnumDerivation):
+        return LazyEnum(value.node, module, value.tag, value.value)
+    elif isinstance(value, list):
+        return [_force(item, module) for item in value]
+    elif isinstance(value, barg.barg_core._PendingAction):
+        return value.resolve(lambda v: _force(v, module))
+    return value
+
+
+class LazyStruct:
+    """
+    A struct match whose fields are only built when they are accessed (and then cached).
+    Behaves like the eagerly generated struct type for attribute access, marks and printing.
+    """
+
+    type_ = barg.GenTyKind.STRUCT
+
+    def __init__(self, node: "barg.AstStruct", module: "barg.ModuleInfo", fields: tuple):
+        self._lazy_node = node
+        self._lazy_module = module
+        self._lazy_fields = {
+            name: deriv for (name, _), deriv in zip(node.fields, fields)
+        }
+
+    def __getattr__(self, name: str):
+        if name.startswith("_lazy_") or name not in self._lazy_fields:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'"
+            )
+        value = _force(self._lazy_fields.pop(name), self._lazy_module)
+        setattr(self, name, value)
+        return value
+
+    def __str__(self):
+        return str(materialize(self))
+
+    def __repr__(self):
+        return str(self)
+
+
+class LazyEnum:
+    """An enum match whose value is only built when it is accessed (and then cached)"""
+
+    type_ = barg.GenTyKind.ENUM
+
+    def __init__(self, node: "barg.AstEnum", module: "barg.ModuleInfo", tag: str, value):
+        self._lazy_node = node
+        self._lazy_module = module
+        self._lazy_value = value
+        self.tag = tag
+
+    def __getattr__(self, name: str):
+        if name != "value":
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'"
+            )
+        value = _force(self._lazy_value, self._lazy_module)
+        self.value = value
+        del self._lazy_value
+        return value
+
+    def __str__(self):
+        return str(materialize(self))
+
+    def __repr__(self):
+        return str(self)
+
+
+def materialize(value):
+    """Recursively replaces all lazy structs and enums in `value` by instances of the eagerly generated types"""
+    if isinstance(value, LazyStruct):
+        node = value._lazy_node
+        typ = node.generated_type(value._lazy_module)
+        out = typ(*(materialize(getattr(value, name)) for name, _ in node.fields))
+        for name, attr in vars(value).items():
+            # marks and attributes set by transforms
+            if not name.startswith("_lazy_") and not hasattr(out, name):
+                setattr(out, name, attr)
+        return out
+    elif isinstance(value, LazyEnum):
+        typ = value._lazy_node.generated_type(value._lazy_module)
+        out = typ(value.tag, materialize(value.value))
+        for name, attr in vars(value).items():
+            if not name.startswith("_lazy_") and not hasattr(out, name):
+                setattr(out, name, attr)
+        return out
+    elif isinstance(value, list):
+        return [materialize(item) for item in value]
+    return value
+
+
+def _lazy_matcher(node: "barg.AstNode", match):
+    if isinstance(node, barg.AstString):
+
+        def lazy_match(string: str, module: "barg.ModuleInfo", symbol: Optional[str] = None):
+            start = module.input_length - len(string)
+            for end in node.ends(string, module):
+                yield _LeafDerivation(module.input, start, start + end), end
+
+    elif isinstance(node, barg.AstStruct):
+
+        def make(*fields):
+            return _StructDerivation(node, fields)
+
+        def lazy_match(string: str, module: "barg.ModuleInfo", symbol: Optional[str] = None):
+            return node._match(string, module, make)
+
+    elif isinstance(node, barg.AstEnum):
+
+        def make(tag, value):
+            return _EnumDerivation(node, tag, value)
+
+        def lazy_match(string: str, module: "barg.ModuleInfo", symbol: Optional[str] = None):
+            return node._match(string, module, make)
+
+    elif isinstance(node, barg.AstTransform):
+
+        def lazy_match(string: str, module: "barg.ModuleInfo", symbol: Optional[str] = None):
+            # transforms run during matching (they may change ncons or mark items), so they see forced values
+            transform = barg.get_transform(module.barg_transforms, node.name)
+            for pattern_arg, ncons in node.pattern_arg.match(string, module):
+                try:
+                    yield transform(
+                        module, string, ncons, _force(pattern_arg, module), *node.args
+                    )
+                except Exception as e:
+                    e.__barg_line = node.line  # attach barg grammar line info
+                    raise e
+
+    else:
+        return match
+    return lazy_match
+
+
+def install_lazy_matchers(toplevel: "barg.AstToplevel") -> None:
+    """Makes every match of `toplevel` record derivations instead of building result objects"""
+    barg.instrument(toplevel, _lazy_matcher)
+
+
+def lazy_results(matches, module: "barg.ModuleInfo"):
+    for m, ncons in matches:
+        yield _force(m, module), ncons
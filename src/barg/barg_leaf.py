@@ -0,0 +1,349 @@
+import re
+import regex
+import warnings
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+# characters outside of a character class that make a pattern more than a literal
+_META = frozenset(".^$*+?{}[]|()")
+# escapes that stand for a single character, besides escaped punctuation
+_CHAR_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v"}
+# the regex module's \s is the Unicode White_Space property, which has no characters above U+3000
+_WHITESPACE = frozenset(regex.findall(r"\s", "".join(map(chr, range(0x3001)))))
+# character classes with more members are left to the regex engines
+MAX_RUN_CHARS = 1024
+
+# constructs that both engines accept but match differently (Unicode classes, POSIX classes, inline flags)
+_ENGINE_SENSITIVE = regex.compile(r"\\(.)|\(\?([a-zA-Z])|\[:", regex.DOTALL)
+# constructs that change meaning when the pattern becomes one branch of a bigger one: backreferences, named groups,
+# inline flags, conditionals, ... (escaped parentheses are rejected as well, which is merely conservative)
+_UNMERGEABLE = regex.compile(r"\\(?:[1-9]|g)|\(\?(?![:=!>]|<[=!])")
+# longer runs of leaves are split into alternations of at most this many (unless they are all literals), since each
+# start index needs a regex of its own (see AlternationPlan)
+MAX_ALTERNATION = 64
+
+
+class LeafPlan:
+    """
+    How a regex leaf is matched, decided once when the grammar is compiled (see `plan_leaf`):
+    - "literal": the pattern matches exactly `text`, which is tested with `str.startswith`
+    - "run": the pattern is a greedy run (`*` or `+`) of one character class with the members `chars`. The first
+      character is tested against the set, so a run that matches nothing costs no regex call
+    - "regex": anything else, compiled with `engine` ("re" if the stdlib engine matches the pattern the same way as
+      the regex module, which is faster, otherwise "regex")
+    All kinds match anchored at the start of the string and find the same match as the regex module would.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        pattern: str,
+        engine: str = "regex",
+        text: Optional[str] = None,
+        chars: Optional[FrozenSet[str]] = None,
+        min_count: int = 0,
+    ):
+        self.kind = kind
+        self.pattern = pattern
+        self.engine = engine
+        self.text = text
+        self.chars = chars
+        self.min_count = min_count
+
+    def __str__(self):
+        if self.kind == "literal":
+            return f"LeafPlan(kind=literal, text={self.text!r})"
+        elif self.kind == "run":
+            return f"LeafPlan(kind=run, chars={''.join(sorted(self.chars))!r}, min_count={self.min_count})"
+        return f"LeafPlan(kind=regex, engine={self.engine}, pattern={self.pattern!r})"
+
+    def __repr__(self):
+        return str(self)
+
+    def run_pattern(self) -> str:
+        """A stdlib `re` pattern for the rest of a run: one or more of `chars`, spelled out explicitly"""
+        return "[" + "".join(re.escape(c) for c in sorted(self.chars)) + "]+"
+
+    def matcher(self) -> Callable[[str], Optional[int]]:
+        """Returns a function that maps a string to the length of the match at its start, or None"""
+        if self.kind == "literal":
+            text = self.text
+            n = len(text)
+
+            def match_literal(string: str) -> Optional[int]:
+                return n if string.startswith(text) else None
+
+            return match_literal
+        elif self.kind == "run":
+            chars = self.chars
+            rest = re.compile(self.run_pattern())
+            empty = 0 if self.min_count == 0 else None
+
+            def match_run(string: str) -> Optional[int]:
+                if string and string[0] in chars:
+                    return rest.match(string).end()
+                return empty
+
+            return match_run
+        pat = (re if self.engine == "re" else regex).compile(self.pattern)
+
+        def match_regex(string: str) -> Optional[int]:
+            m = pat.match(string)
+            return None if m is None else m.end()
+
+        return match_regex
+
+    def scanner(self) -> Callable[[str, int], int]:
+        """
+        Returns a function that maps (string, pos) to the end of the match at `pos`, or `pos` if there is none.
+        Used for skip rules, which are optional and scanned in place instead of on a slice of the input.
+        """
+        if self.kind == "literal":
+            text = self.text
+            n = len(text)
+
+            def scan_literal(string: str, pos: int) -> int:
+                return pos + n if string.startswith(text, pos) else pos
+
+            return scan_literal
+        elif self.kind == "run":
+            chars = self.chars
+            rest = re.compile(self.run_pattern())
+
+            def scan_run(string: str, pos: int) -> int:
+                if pos < len(string) and string[pos] in chars:
+                    return rest.match(string, pos).end()
+                return pos
+
+            return scan_run
+        pat = (re if self.engine == "re" else regex).compile(self.pattern)
+
+        def scan_regex(string: str, pos: int) -> int:
+            m = pat.match(string, pos)
+            return pos if m is None else m.end()
+
+        return scan_regex
+
+
+def _literal(pattern: str) -> Optional[str]:
+    """The text a pattern matches if it contains no regex constructs (after resolving escapes), else None"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            if i + 1 == len(pattern):
+                return None
+            c = pattern[i + 1]
+            if c in _CHAR_ESCAPES:
+                c = _CHAR_ESCAPES[c]
+            elif c.isascii() and (c.isalnum() or c == "_"):
+                return None  # classes (\d), anchors (\b), backreferences, ...
+            i += 2
+        elif c in _META:
+            return None
+        else:
+            i += 1
+        out.append(c)
+    return "".join(out)
+
+
+def _class_char(pattern: str, i: int):
+    """Parses one character of a character class at `i`. Returns (char or set of chars, next index) or None."""
+    c = pattern[i]
+    if c == "]":
+        return None  # ends the class early, the rest of the pattern is not part of it
+    if c != "\\":
+        return c, i + 1
+    if i + 1 == len(pattern):
+        return None
+    c = pattern[i + 1]
+    if c == "s":
+        return _WHITESPACE, i + 2
+    if c in _CHAR_ESCAPES:
+        return _CHAR_ESCAPES[c], i + 2
+    if c.isascii() and (c.isalnum() or c == "_"):
+        return None
+    return c, i + 2
+
+
+def _char_class(pattern: str) -> Optional[FrozenSet[str]]:
+    """The members of a positive character class `[...]` that spans all of `pattern`, if they can be enumerated"""
+    if len(pattern) < 3 or pattern[0] != "[" or pattern[-1] != "]" or pattern[1] in "^]":
+        return None
+    body = pattern[1:-1]
+    # nested sets and set operations mean different things to the two engines (and between regex versions)
+    if "[" in body or any(op in body for op in ("&&", "||", "--", "~~")):
+        return None
+    chars = set()
+    i = 0
+    while i < len(body):
+        parsed = _class_char(body, i)
+        if parsed is None:
+            return None
+        lo, i = parsed
+        if i + 1 < len(body) and body[i] == "-":
+            if not isinstance(lo, str):
+                return None  # a range starting at a class
+            parsed = _class_char(body, i + 1)
+            if parsed is None or not isinstance(parsed[0], str) or parsed[0] < lo:
+                return None
+            hi, i = parsed
+            if ord(hi) - ord(lo) >= MAX_RUN_CHARS:
+                return None
+            chars.update(map(chr, range(ord(lo), ord(hi) + 1)))
+        elif isinstance(lo, str):
+            chars.add(lo)
+        else:
+            chars.update(lo)
+        if len(chars) > MAX_RUN_CHARS:
+            return None
+    return frozenset(chars)
+
+
+def _run(pattern: str) -> Optional[LeafPlan]:
+    """A plan for a greedy run of one character class (`[a-z_]+`, `\\s*`, `a*`), or None"""
+    if len(pattern) < 2 or pattern[-1] not in "*+" or pattern[-2:] in ("\\*", "\\+"):
+        return None
+    atom = pattern[:-1]
+    if atom[-1:] in ("*", "+", "?", "}") and not atom.endswith(("\\*", "\\+", "\\?", "\\}")):
+        return None  # lazy or possessive quantifier, or a quantified atom
+    if atom == "\\s":
+        chars = _WHITESPACE
+    elif atom.startswith("["):
+        chars = _char_class(atom)
+    else:
+        literal = _literal(atom)
+        chars = frozenset(literal) if literal is not None and len(literal) == 1 else None
+    if chars is None:
+        return None
+    return LeafPlan("run", pattern, "re", chars=chars, min_count=1 if pattern[-1] == "+" else 0)
+
+
+def regex_engine(pattern: str) -> str:
+    """
+    "re" if the stdlib engine compiles `pattern` and matches it exactly like the regex module, else "regex".
+    Patterns with Unicode-dependent classes (\\s, \\w, \\d, \\b and their negations), POSIX classes or inline flags
+    stay with the regex module, which is the engine grammars are written against.
+    """
+    for m in _ENGINE_SENSITIVE.finditer(pattern):
+        if m.group(1) is not None and m.group(1) in "sSwWdDbB":
+            return "regex"
+        if m.group(2) is not None and m.group(2) != "P":
+            return "regex"
+        if m.group(0) == "[:":
+            return "regex"
+    try:
+        with warnings.catch_warnings():
+            # eg. "possible nested set", which the regex module may parse differently
+            warnings.simplefilter("error")
+            re.compile(pattern)
+    except (re.error, Warning, RecursionError, OverflowError):
+        return "regex"
+    return "re"
+
+
+def plan_leaf(pattern: str) -> LeafPlan:
+    """
+    Decides how the (non-backtracking) leaf `pattern` is matched, see LeafPlan.
+    Raises the regex module's error for invalid patterns, so they are reported like before.
+    """
+    regex.compile(pattern)
+    literal = _literal(pattern)
+    if literal is not None:
+        return LeafPlan("literal", pattern, text=literal)
+    run = _run(pattern)
+    if run is not None:
+        return run
+    return LeafPlan("regex", pattern, regex_engine(pattern))
+
+
+class AlternationPlan:
+    """
+    How a run of alternatives that are all non-backtracking leaves (eg. the variants of an enum) is matched in one
+    step instead of one match attempt per alternative (see `plan_alternation`):
+    - "literals": every alternative is a literal. `table` maps each length to the alternatives of that length by
+      their text, so finding the ones that match costs one dict lookup per distinct length
+    - "regex": `pats[i]` alternates the patterns from the i-th on, each in a group named `_k` (k is its index). The
+      group that matches is the first alternative from i on that matches on its own, with the same match
+    """
+
+    def __init__(self, kind: str, patterns: List[str], texts: Optional[List[str]] = None):
+        self.kind = kind
+        self.patterns = patterns
+        self.texts = texts
+        self.table: Dict[int, Dict[str, Tuple[int, ...]]] = {}
+        self.pats = []
+        if kind == "literals":
+            for i, text in enumerate(texts):
+                by_text = self.table.setdefault(len(text), {})
+                by_text[text] = by_text.get(text, ()) + (i,)
+        else:
+            self.pats = [regex.compile(self.branches(i)) for i in range(len(patterns))]
+
+    def __str__(self):
+        return f"AlternationPlan(kind={self.kind}, patterns={self.patterns!r})"
+
+    def __repr__(self):
+        return str(self)
+
+    def branches(self, start: int) -> str:
+        """The pattern of `pats[start]`"""
+        return "|".join(f"(?P<_{i}>{self.patterns[i]})" for i in range(start, len(self.patterns)))
+
+    def first(self) -> Callable[[str, int], Optional[Tuple[int, int]]]:
+        """
+        Returns a function that maps (string, start) to (i, end) for the first alternative i >= start that matches
+        at the start of the string, where end is the length of its match, or to None if none of them matches.
+        """
+        if self.kind == "literals":
+            table = sorted(self.table.items())
+            lengths = [len(text) for text in self.texts]
+
+            def first_literal(string: str, start: int) -> Optional[Tuple[int, int]]:
+                best = None
+                for n, by_text in table:
+                    indices = by_text.get(string[:n])
+                    if indices is not None:
+                        for i in indices:
+                            if i >= start:
+                                if best is None or i < best:
+                                    best = i
+                                break
+                return None if best is None else (best, lengths[best])
+
+            return first_literal
+        pats = self.pats
+
+        def first_regex(string: str, start: int) -> Optional[Tuple[int, int]]:
+            m = pats[start].match(string)
+            if m is None:
+                return None
+            return int(m.lastgroup[1:]), m.end()
+
+        return first_regex
+
+
+def plan_alternation(patterns: List[str]) -> Optional[AlternationPlan]:
+    """
+    An AlternationPlan for the leaves `patterns` (in declared order), or None if they cannot be merged: there are
+    fewer than two, too many regexes, or one of them is invalid or uses constructs that are not self-contained.
+    """
+    if len(patterns) < 2:
+        return None
+    texts = []
+    for pattern in patterns:
+        try:
+            plan = plan_leaf(pattern)
+        except Exception:
+            return None  # reported when the leaf itself is matched
+        if plan.kind != "literal" and _UNMERGEABLE.search(pattern) is not None:
+            return None
+        texts.append(plan.text)
+    if all(text is not None for text in texts):
+        return AlternationPlan("literals", patterns, texts)
+    if len(patterns) > MAX_ALTERNATION:
+        return None
+    try:
+        return AlternationPlan("regex", patterns)
+    except Exception:
+        return None
@@ -0,0 +1,359 @@
+import barg
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# a pass rewrites the grammar in place and returns a short summary of what it did (or None)
+GrammarPass = Callable[["barg.AstToplevel", "PassOptions"], Optional[str]]
+
+
+class PassOptions:
+    """
+    What the passes know about how the grammar is used:
+    `transforms` are the transforms of the interpreter (None for codegen, where only the builtins exist) and
+    `roots` are the rules that are matched from outside (None if any rule may be, which disables dead-rule elimination).
+    """
+
+    def __init__(self, transforms: Optional[Dict[str, Any]] = None, roots: Optional[Iterable[str]] = None):
+        self.transforms = transforms
+        self.roots = None if roots is None else list(roots)
+
+
+def _is_pyexpr_like(node: "barg.AstTransform", transforms: Optional[Dict[str, Any]]) -> bool:
+    builtins = barg.barg_exec_builtins
+    return (
+        node.name == "builtin.pyexpr"
+        and barg.barg_core._resolves_to_builtin(transforms, node.name, builtins.builtin_pyexpr)
+    ) or (
+        node.name == "builtin.pyscript"
+        and barg.barg_core._resolves_to_builtin(transforms, node.name, builtins.builtin_pyscript)
+    )
+
+
+def propagate_text_strings(toplevel: "barg.AstToplevel", options: PassOptions) -> str:
+    """
+    Replaces the code argument of `$builtin.pyexpr(X, Name)` and `$builtin.pyscript(X, Name)` by the text string
+    `Name` is defined as, so the code is not looked up by name on every match.
+    """
+    definitions = {a.identifier: a.expression for a in toplevel.assignments}
+    n = 0
+
+    def rewrite(node):
+        nonlocal n
+        if (
+            isinstance(node, barg.AstTransform)
+            and node.args
+            and isinstance(node.args[0], str)
+            and isinstance(definitions.get(node.args[0]), barg.AstTextString)
+            and _is_pyexpr_like(node, options.transforms)
+        ):
+            n += 1
+            args = (definitions[node.args[0]],) + node.args[1:]
+            return barg.AstTransform(node.line, node.name, node.pattern_arg, args)
+        return node
+
+    barg.rewrite_tree(toplevel, rewrite)
+    return f"text string arguments propagated: {n}"
+
+
+def specialize_transforms(toplevel: "barg.AstToplevel", options: PassOptions) -> None:
+    barg.specialize_transforms(toplevel, options.transforms)
+
+
+def push_down_transforms(toplevel: "barg.AstToplevel", options: PassOptions) -> None:
+    barg.push_down_transforms(toplevel, options.transforms)
+
+
+def share_subexpressions(toplevel: "barg.AstToplevel", options: PassOptions) -> None:
+    # the rewrites above build new nodes, which may duplicate existing ones
+    barg.hash_cons(toplevel)
+
+
+def _references(node: "barg.AstNode") -> Set[str]:
+    return {n.name for n in barg.iter_nodes(node) if isinstance(n, barg.AstVariable)}
+
+
+def _components(graph: Dict[str, Set[str]]) -> Dict[str, int]:
+    """Numbers the strongly connected components of the rule reference graph (Tarjan's algorithm, iteratively)"""
+    index: Dict[str, int] = {}
+    low: Dict[str, int] = {}
+    component: Dict[str, int] = {}
+    stack: List[str] = []
+    n = 0
+    for start in graph:
+        if start in index:
+            continue
+        work = [(start, iter(sorted(graph[start])))]
+        index[start] = low[start] = len(index)
+        stack.append(start)
+        while work:
+            name, targets = work[-1]
+            target = next(targets, None)
+            if target is not None:
+                if target not in graph:
+                    continue
+                if target not in index:
+                    index[target] = low[target] = len(index)
+                    stack.append(target)
+                    work.append((target, iter(sorted(graph[target]))))
+                elif target not in component:
+                    low[name] = min(low[name], index[target])
+                continue
+            work.pop()
+            if work:
+                low[work[-1][0]] = min(low[work[-1][0]], low[name])
+            if low[name] == index[name]:
+                while True:
+                    member = stack.pop()
+                    component[member] = n
+                    if member == name:
+                        break
+                n += 1
+    return component
+
+
+def _recursion_breakers(graph: Dict[str, Set[str]], order: List[str]) -> Set[str]:
+    """
+    Rules such that every cycle of rule references passes through one of them: the targets of the back edges of a
+    depth-first search over the references, started from the rules in `order`.
+    """
+    breakers = set()
+    done = set()
+    active = set()
+    for start in order:
+        if start in done:
+            continue
+        stack = [(start, iter(sorted(graph[start])))]
+        active.add(start)
+        while stack:
+            name, targets = stack[-1]
+            target = next(targets, None)
+            if target is None:
+                stack.pop()
+                active.discard(name)
+                done.add(name)
+            elif target in active:
+                breakers.add(target)
+            elif target in graph and target not in done:
+                active.add(target)
+                stack.append((target, iter(sorted(graph[target]))))
+    return breakers
+
+
+def resolve_variables(toplevel: "barg.AstToplevel", options: PassOptions) -> str:
+    """
+    Replaces references to rules by the rules' expressions themselves, so matching them needs no lookup by name and
+    no extra generator frame. Nodes are immutable, so the grammar must stay acyclic: within a group of mutually
+    recursive rules, references to a few rules that break every cycle (see _recursion_breakers) are kept and still
+    looked up by name. A rule that is only an alias (`A := B;`) keeps its variable, so it stays a node of its own for
+    actions and profiling.
+    """
+    definitions = {a.identifier: a.expression for a in toplevel.assignments}
+    graph = {name: _references(expr) for name, expr in definitions.items()}
+    order = [name for name in options.roots or () if name in definitions] + list(definitions)
+    breakers = _recursion_breakers(graph, order)
+    component = _components(graph)
+    resolved: Dict[str, "barg.AstNode"] = {}
+    # (id, component of the rule it is rewritten in) -> (node, rewritten). Shared nodes are rewritten once per
+    # component, because whether a reference closes a cycle depends on where it is
+    memo = {}
+    n = 0
+
+    def resolve(name: str) -> "barg.AstNode":
+        # without the kept references, rule references form a DAG, so the target is resolved before its referrer
+        if name not in resolved:
+            expr = definitions[name]
+            if isinstance(expr, barg.AstVariable):
+                resolved[name] = expr
+            else:
+                resolved[name] = barg.map_children(expr, lambda child: visit(child, component[name]))
+        return resolved[name]
+
+    def visit(node, where: int):
+        nonlocal n
+        entry = memo.get((id(node), where))
+        if entry is None:
+            if isinstance(node, barg.AstVariable):
+                name = node.name
+                if name in definitions and (name not in breakers or component[name] != where):
+                    n += 1
+                    new = resolve(name)
+                else:
+                    new = node
+            else:
+                new = barg.map_children(node, lambda child: visit(child, where))
+            entry = memo[(id(node), where)] = (node, new)
+        return entry[1]
+
+    for i, assignment in enumerate(toplevel.assignments):
+        new = resolve(assignment.identifier)
+        if new is not assignment.expression:
+            toplevel.assignments[i] = barg.AstAssignment(assignment.line, assignment.identifier, new)
+    return f"references resolved: {n} (looked up by name inside cycles: {', '.join(sorted(breakers)) or 'none'})"
+
+
+def eliminate_dead_rules(toplevel: "barg.AstToplevel", options: PassOptions) -> Optional[str]:
+    """
+    Removes the rules that cannot be reached from `options.roots`, by reference, by name (variables, transform
+    arguments) or as the (resolved) expression of a reachable rule.
+    """
+    definitions = {a.identifier: a.expression for a in toplevel.assignments}
+    if options.roots is None or not all(root in definitions for root in options.roots):
+        return None  # an unknown root is reported when it is matched
+    rule_of = {id(expr): name for name, expr in definitions.items()}
+    live = set()
+    pending = list(options.roots)
+    while pending:
+        name = pending.pop()
+        if name in live:
+            continue
+        live.add(name)
+        for node in barg.iter_nodes(definitions[name]):
+            if id(node) in rule_of:
+                pending.append(rule_of[id(node)])
+            if isinstance(node, barg.AstVariable) and node.name in definitions:
+                pending.append(node.name)
+            elif isinstance(node, barg.AstTransform):
+                # eg. the name of a text string passed to a transform
+                pending.extend(arg for arg in node.args if isinstance(arg, str) and arg in definitions)
+    before = len(toplevel.assignments)
+    toplevel.assignments = [a for a in toplevel.assignments if a.identifier in live]
+    return f"unreachable rules removed: {before - len(toplevel.assignments)}"
+
+
+# in order: the transform rewrites see the grammar as written, the others see their results
+DEFAULT_PASSES: List[Tuple[str, GrammarPass]] = [
+    ("propagate-text-strings", propagate_text_strings),
+    ("specialize-transforms", specialize_transforms),
+    ("push-down-transforms", push_down_transforms),
+    ("share-subexpressions", share_subexpressions),
+    ("resolve-variables", resolve_variables),
+    ("eliminate-dead-rules", eliminate_dead_rules),
+]
+
+
+class PassManager:
+    """
+    Runs a pipeline of passes over the grammar IR (the AstToplevel from the parser) before it is matched or compiled
+    to a parser. `log` records, for each pass that ran, its name, summary and the size of the IR afterwards.
+    """
+
+    def __init__(self, passes: Optional[List[Tuple[str, GrammarPass]]] = None):
+        self.passes = list(DEFAULT_PASSES if passes is None else passes)
+        self.log: List[Tuple[str, Optional[str], int, int]] = []
+
+    def run(
+        self,
+        toplevel: "barg.AstToplevel",
+        transforms: Optional[Dict[str, Any]] = None,
+        roots: Optional[Iterable[str]] = None,
+    ) -> "barg.AstToplevel":
+        options = PassOptions(transforms, roots)
+        for name, grammar_pass in self.passes:
+            summary = grammar_pass(toplevel, options)
+            nodes = sum(1 for _ in barg.iter_nodes(toplevel)) - len(toplevel.assignments) - 1
+            self.log.append((name, summary, len(toplevel.assignments), nodes))
+        return toplevel
+
+
+def optimize(
+    toplevel: "barg.AstToplevel",
+    transforms: Optional[Dict[str, Any]] = None,
+    roots: Optional[Iterable[str]] = None,
+) -> "barg.AstToplevel":
+    """Runs the default passes over `toplevel` (see PassOptions for the arguments)"""
+    return PassManager().run(toplevel, transforms, roots)
+
+
+def format_ir(toplevel: "barg.AstToplevel") -> str:
+    """
+    Prints the IR in grammar syntax, one rule per line. `@Name` is a resolved reference to the rule Name, a plain
+    `Name` is still looked up by name. Sub-expressions that are shared (see hash_cons) are labeled `#n=` where they
+    first appear and printed as `#n` afterwards.
+    """
+    roots = {id(a.expression): a.identifier for a in toplevel.assignments}
+    uses: Dict[int, int] = {}
+    for node in barg.iter_nodes(toplevel):
+        children = []
+        if isinstance(node, barg.AstStruct):
+            children = [expr for _, expr in node.fields]
+        elif isinstance(node, barg.AstEnum):
+            children = [expr for _, expr in node.variants]
+        elif isinstance(node, (barg.AstList, barg.AstRecover)):
+            children = [node.expression]
+        elif isinstance(node, barg.AstTransform):
+            children = [node.pattern_arg]
+        for child in children:
+            uses[id(child)] = uses.get(id(child), 0) + 1
+    labels: Dict[int, int] = {}
+
+    def fmt(node, top: bool = False) -> str:
+        if not top and id(node) in roots:
+            return f"@{roots[id(node)]}"
+        if isinstance(node, barg.AstVariable):
+            return node.name
+        if isinstance(node, barg.AstString):
+            leaf = '"' + node.value.replace('"', '\\"') + '"'
+            return f"$builtin.backtrack({leaf})" if node.backtrack else leaf
+        if isinstance(node, barg.AstTextString):
+            return f"`{node.value}`"
+        if isinstance(node, barg.AstToken):
+            return f"token {node.name}: \"{node.pattern}\"" if top else node.name
+        shared = not top and uses.get(id(node), 0) > 1
+        if shared and id(node) in labels:
+            return f"#{labels[id(node)]}"
+        if isinstance(node, barg.AstStruct):
+            fields = ", ".join(
+                f"{name}: {'~' if name in node.discard else ''}{fmt(expr)}" for name, expr in node.fields
+            )
+            out = f"struct {{ {fields} }}"
+        elif isinstance(node, barg.AstEnum):
+            mode = "" if node.mode == "all" else f"[{node.mode}]"
+            out = f"enum{mode} {{ {', '.join(f'{tag}: {fmt(expr)}' for tag, expr in node.variants)} }}"
+        elif isinstance(node, barg.AstList):
+            end = "" if node.range_end is None else node.range_end
+            keep = "" if node.keep_mark is None else f" keep {node.keep_mark}"
+            out = f"list[{node.mode} {node.range_start}..{end}{keep}] {{ {fmt(node.expression)} }}"
+        elif isinstance(node, barg.AstTransform):
+            args = [fmt(node.pattern_arg)]
+            args += [fmt(arg) if isinstance(arg, barg.AstNode) else str(arg) for arg in node.args]
+            out = f"${node.name}({', '.join(args)})"
+        elif isinstance(node, barg.AstRecover):
+            out = f"$builtin.recover({', '.join(fmt(n) for n in (node.expression,) + node.syncs)})"
+        else:
+            out = str(node)
+        if shared:
+            labels[id(node)] = len(labels) + 1
+            out = f"#{labels[id(node)]}={out}"
+        return out
+
+    lines = []
+    if toplevel.skip is not None:
+        lines.append(f'%skip := "{toplevel.skip.pattern}";')
+    if toplevel.prescan is not None:
+        lines.append(f"%prescan := {', '.join(toplevel.prescan.names)};")
+    for assignment in toplevel.assignments:
+        lines.append(f"{assignment.identifier} := {fmt(assignment.expression, True)};")
+    return "\n".join(lines)
+
+
+def explain(
+    grammar: str,
+    error_out: List[str],
+    roots: Optional[Iterable[str]] = None,
+    passes: Optional[List[Tuple[str, GrammarPass]]] = None,
+) -> str:
+    """The passes that ran over `grammar` (what they did and the size of the IR after them) and the resulting IR"""
+    lexer = barg.Lexer(grammar)
+    tokens = lexer.tokenize()
+    error_out.extend(lexer.errors)
+    parser = barg.Parser(tokens)
+    ast = parser.parse()
+    error_out.extend(parser.errors)
+    manager = PassManager(passes)
+    manager.run(ast, None, roots)
+    lines = ["# passes"]
+    for name, summary, rules, nodes in manager.log:
+        lines.append(f"{name}: {summary + ', ' if summary else ''}{rules} rules, {nodes} nodes")
+    lines.append("")
+    lines.append("# ir")
+    lines.append(format_ir(ast))
+    return "\n".join(lines)
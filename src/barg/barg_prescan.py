@@ -0,0 +1,80 @@
+import barg
+import re
+import regex
+from array import array
+from typing import Callable, Optional
+
+# constructs that look at the input in front of the match position (anchors, word boundaries, lookbehinds) or that
+# may do so (inline flags), skipping escapes and character classes, where `^` negates
+_IN_CONTEXT = regex.compile(
+    r"\\(.)|\[\^?\]?(?:\\.|[^\]])*\]|(\^|\(\?<[=!]|\(\?(?!P)[a-zA-Z])", regex.DOTALL
+)
+
+
+def prescannable(pattern: str) -> bool:
+    """
+    Whether the matches of the leaf `pattern` can be found by scanning the whole input. Leaves are matched on the
+    input from their position on, so a pattern that looks at the input in front of it (`^`, `\\b`, `\\A`, `\\G`,
+    lookbehinds, ...) matches differently when scanned for in place.
+    """
+    for m in _IN_CONTEXT.finditer(pattern):
+        if m.group(2) is not None or (m.group(1) is not None and m.group(1) in "AbBGmMK"):
+            return False
+    return True
+
+
+def scan_pattern(pattern: str):
+    """The compiled pattern a LeafIndex scans with, with the engine the leaf itself is matched with"""
+    plan = barg.plan_leaf(pattern)
+    return (re if plan.kind == "regex" and plan.engine == "re" else regex).compile(pattern)
+
+
+class LeafIndex:
+    """
+    The matches of one leaf pattern in one input, found by a single `finditer` scan over the whole input and stored
+    as sorted arrays of their start and end offsets. For matching, `table` maps every offset of the input to
+    - the end of the match starting there: the scan tried the offset and found what matching the leaf there finds
+    - MISS if the offset is not inside an earlier match: the scan tried it and found nothing
+    - UNTRIED if it is: the scan resumes after each match, so the leaf's own matcher has to run there
+    A binary search in the sorted arrays costs as much as the regex call it would replace when done in python, the
+    table (4 or 8 bytes per input character) makes a lookup one array access.
+    """
+
+    MISS = -1
+    UNTRIED = -2
+
+    def __init__(self, text: str, pattern):
+        self.length = len(text)
+        self.starts = array("q")
+        self.ends = array("q")
+        for m in pattern.finditer(text):
+            self.starts.append(m.start())
+            self.ends.append(m.end())
+        self.table = array("i" if self.length < 2**31 - 1 else "q", [self.MISS]) * (self.length + 1)
+        untried = array(self.table.typecode, [self.UNTRIED])
+        # in reverse, so the first of several matches at one offset (an empty one, then a longer one) is kept
+        for start, end in zip(reversed(self.starts), reversed(self.ends)):
+            if end - start > 1:
+                self.table[start + 1 : end] = untried * (end - start - 1)
+            self.table[start] = end
+
+    def __len__(self):
+        return len(self.starts)
+
+    def matcher(self, fallback: Callable[[str], Optional[int]]) -> Callable[[str], Optional[int]]:
+        """
+        A leaf matcher (see AstString.leaf) for the suffixes of the scanned input, which calls `fallback` at offsets
+        the scan did not try
+        """
+        table, length, miss = self.table, self.length, self.MISS
+
+        def match_indexed(string: str) -> Optional[int]:
+            pos = length - len(string)
+            end = table[pos]
+            if end >= 0:
+                return end - pos
+            if end == miss:
+                return None
+            return fallback(string)
+
+        return match_indexed
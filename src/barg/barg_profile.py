@@ -0,0 +1,158 @@
+import barg
+from time import perf_counter
+from typing import List, Optional
+
+
+def mark_line_in_grammar(grammar: str, lineno: int) -> str:
+    """a function that takes grammar[line-4:line+5], indents it all and puts an arrow before grammar[line]"""
+    lines = grammar.splitlines()
+    first, last = max(1, lineno - 4), min(len(lines), lineno + 4)
+    max_lineno_len = len(str(last))
+    out = []
+    for n in range(first, last + 1):
+        if n == lineno:
+            out.append("----> " + lines[n - 1])
+        else:
+            out.append(str(n).ljust(max_lineno_len) + "|" + " " * 4 + lines[n - 1])
+    return "\n".join(out)
+
+
+class RuleStats:
+    """
+    What the profiler measured for one grammar node. Times are in seconds.
+    A backtrack is a resumption of the node's matcher after it already yielded a match.
+    Regex time is the time spent in leaf matchers (regexes and tokens).
+    """
+
+    __slots__ = (
+        "node",
+        "rule",
+        "calls",
+        "matches",
+        "backtracks",
+        "cum_time",
+        "self_time",
+        "regex_time",
+        "active",
+    )
+
+    def __init__(self, node: "barg.AstNode", rule: str):
+        self.node = node
+        self.rule = rule
+        self.calls = 0
+        self.matches = 0
+        self.backtracks = 0
+        self.cum_time = 0.0
+        self.self_time = 0.0
+        self.regex_time = 0.0
+        self.active = 0  # resumptions of this node currently on the stack (recursion is only counted once in cum_time)
+
+    @property
+    def kind(self) -> str:
+        return type(self.node).__name__.removeprefix("Ast").lower()
+
+
+class Profiler:
+    """
+    Per-node profiler for the interpreter. Pass it to `barg.parse(..., profiler=Profiler())` (or `install` it on a
+    parsed grammar yourself), consume the results and print `report()`.
+    """
+
+    def __init__(self):
+        self.stats: List[RuleStats] = []
+        self._child_time: List[float] = []
+
+    def install(self, toplevel: "barg.AstToplevel") -> None:
+        names = barg.rule_names(toplevel)
+
+        def wrap(node: "barg.AstNode", match):
+            stats = RuleStats(node, names.get(id(node), "<anonymous>"))
+            self.stats.append(stats)
+            return self._profiled(stats, match)
+
+        barg.instrument(toplevel, wrap)
+
+    def _profiled(self, stats: RuleStats, match):
+        is_leaf = isinstance(stats.node, (barg.AstString, barg.AstToken))
+        child_time = self._child_time
+
+        def profiled_match(string: str, module: "barg.ModuleInfo", symbol: Optional[str] = None):
+            stats.calls += 1
+            gen = match(string, module, symbol)
+            yielded = False
+            while True:
+                if yielded:
+                    stats.backtracks += 1
+                child_time.append(0.0)
+                stats.active += 1
+                t0 = perf_counter()
+                try:
+                    item = next(gen, None)
+                finally:
+                    elapsed = perf_counter() - t0
+                    stats.active -= 1
+                    stats.self_time += elapsed - child_time.pop()
+                    if not stats.active:
+                        stats.cum_time += elapsed
+                    if is_leaf:
+                        stats.regex_time += elapsed
+                    if child_time:
+                        child_time[-1] += elapsed
+                if item is None:
+                    return
+                stats.matches += 1
+                yielded = True
+                yield item
+
+        return profiled_match
+
+    def ranked(self, key: str = "self_time") -> List[RuleStats]:
+        return sorted(
+            (s for s in self.stats if s.calls),
+            key=lambda s: getattr(s, key),
+            reverse=True,
+        )
+
+    def hot_leaves(self, limit: int = 3) -> List[str]:
+        """
+        The patterns of the `limit` (non-backtracking) leaves that took the most time to match, for
+        `barg.compile_grammar(..., prescan=profiler.hot_leaves())` (see barg_prescan.py)
+        """
+        patterns = []
+        for s in self.ranked("regex_time"):
+            node = s.node
+            if (
+                isinstance(node, barg.AstString)
+                and not node.backtrack
+                and node.value not in patterns
+                and barg.prescannable(node.value)
+            ):
+                patterns.append(node.value)
+                if len(patterns) == limit:
+                    break
+        return patterns
+
+    def report(
+        self, grammar: Optional[str] = None, limit: int = 15, key: str = "self_time"
+    ) -> str:
+        """
+        A table of the `limit` most expensive nodes by `key` (any RuleStats field).
+        If `grammar` is given, each of them is followed by an excerpt of the grammar source around its line.
+        """
+        rows = self.ranked(key)[:limit]
+        header = f"{'rule':<20} {'line':>5} {'kind':<10} {'calls':>9} {'matches':>9} {'backtracks':>10} {'cum ms':>10} {'self ms':>10} {'regex ms':>10}"
+        lines = [header, "-" * len(header)]
+        for s in rows:
+            lines.append(
+                f"{s.rule[:20]:<20} {s.node.line:>5} {s.kind:<10} {s.calls:>9} {s.matches:>9} {s.backtracks:>10} "
+                f"{s.cum_time * 1000:>10.2f} {s.self_time * 1000:>10.2f} {s.regex_time * 1000:>10.2f}"
+            )
+        if grammar is not None:
+            for i, s in enumerate(rows):
+                if s.node.line < 1:
+                    continue
+                lines.append(
+                    f"\n#{i + 1} {s.rule} ({s.kind}, line {s.node.line}):\n"
+                    + mark_line_in_grammar(grammar, s.node.line)
+                )
+        return "\n".join(lines)
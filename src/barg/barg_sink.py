@@ -0,0 +1,160 @@
+"""
+Result sinks write a match straight to a JSON or msgpack stream. Used together with lazy matching (see barg_lazy.py),
+the result is serialized from the recorded derivations and the generated struct/enum types are never built.
+Structs are written as objects of their fields and enums as `{tag: value}`, like `barg.to_plain`.
+"""
+
+import json
+import math
+import barg
+from barg.barg_lazy import _LeafDerivation, _StructDerivation, _EnumDerivation
+from typing import Optional
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_STRUCT, _ENUM, _LIST, _SCALAR = range(4)
+
+
+def _shape(value):
+    """Classifies a result value (derivation, lazy or eager object) without building any objects for it"""
+    if isinstance(value, _LeafDerivation):
+        return _SCALAR, value.value()
+    if isinstance(value, _StructDerivation):
+        return _STRUCT, [(name, v) for (name, _), v in zip(value.node.fields, value.fields)]
+    if isinstance(value, _EnumDerivation):
+        return _ENUM, (value.tag, value.value)
+    if isinstance(value, list):
+        return _LIST, value
+    if isinstance(value, barg.LazyStruct):
+        return _STRUCT, [(name, getattr(value, name)) for name, _ in value._lazy_node.fields]
+    kind = getattr(value, "type_", None)
+    if kind == barg.GenTyKind.STRUCT:
+        # only the declared fields, like the lazy paths above: $builtin.mark sets attributes besides them
+        names = getattr(type(value), "fields_", None)
+        if names is None:
+            names = [k for k in vars(value) if k != "type_" and not (k.startswith("mark_") and k.endswith("_"))]
+        return _STRUCT, [(name, getattr(value, name)) for name in names]
+    if kind == barg.GenTyKind.ENUM:
+        return _ENUM, (value.tag, value.value)
+    return _SCALAR, value
+
+
+class ResultSink:
+    """
+    Writes match results to `stream`. Fields whose names start with an underscore (unnamed sequence and struct
+    fields) are skipped unless `private` is set.
+    """
+
+    def __init__(self, stream, private: bool = True):
+        self.stream = stream
+        self.private = private
+
+    def _fields(self, fields):
+        return fields if self.private else [f for f in fields if not f[0].startswith("_")]
+
+    def write(self, value) -> None:
+        raise NotImplementedError
+
+
+class JsonSink(ResultSink):
+    """
+    Writes each result as one JSON document per line to a text stream. JSON has no infinite or NaN numbers, writing
+    such a float raises ValueError.
+    """
+
+    def write(self, value) -> None:
+        self._write(value)
+        self.stream.write("\n")
+
+    def _write(self, value) -> None:
+        write = self.stream.write
+        kind, data = _shape(value)
+        if kind == _STRUCT:
+            write("{")
+            for i, (name, field) in enumerate(self._fields(data)):
+                if i:
+                    write(", ")
+                write(json.dumps(name))
+                write(": ")
+                self._write(field)
+            write("}")
+        elif kind == _ENUM:
+            write("{")
+            write(json.dumps(str(data[0])))
+            write(": ")
+            self._write(data[1])
+            write("}")
+        elif kind == _LIST:
+            write("[")
+            for i, item in enumerate(data):
+                if i:
+                    write(", ")
+                self._write(item)
+            write("]")
+        elif isinstance(data, float) and not math.isfinite(data):
+            # json.dumps would write the non-standard Infinity/NaN, which strict JSON parsers reject
+            raise ValueError(f"cannot write the float {data} as JSON")
+        elif data is None or isinstance(data, (str, int, float, bool)):
+            write(json.dumps(data, ensure_ascii=False, allow_nan=False))
+        else:
+            write(json.dumps(str(data), ensure_ascii=False))
+
+
+class MsgpackSink(ResultSink):
+    """Writes each result as one msgpack object to a binary stream. Requires the msgpack package."""
+
+    def __init__(self, stream, private: bool = True):
+        if msgpack is None:
+            raise ImportError("MsgpackSink requires the msgpack package (pip install msgpack)")
+        super().__init__(stream, private)
+        self.packer = msgpack.Packer()
+
+    def write(self, value) -> None:
+        write = self.stream.write
+        packer = self.packer
+        kind, data = _shape(value)
+        if kind == _STRUCT:
+            fields = self._fields(data)
+            write(packer.pack_map_header(len(fields)))
+            for name, field in fields:
+                write(packer.pack(name))
+                self.write(field)
+        elif kind == _ENUM:
+            write(packer.pack_map_header(1))
+            write(packer.pack(str(data[0])))
+            self.write(data[1])
+        elif kind == _LIST:
+            write(packer.pack_array_header(len(data)))
+            for item in data:
+                self.write(item)
+        elif data is None or isinstance(data, (str, int, float, bool)):
+            write(packer.pack(data))
+        else:
+            write(packer.pack(str(data)))
+
+
+SINKS = {"json": JsonSink, "msgpack": MsgpackSink}
+
+
+def parse_to_sink(
+    string: str,
+    grammar: str,
+    sink: ResultSink,
+    error_out,
+    grammar_toplevel_name: str = "Toplevel",
+    barg_exec_transforms=None,
+) -> Optional[int]:
+    """
+    Matches `string` lazily and writes the first match to `sink`. Returns the number of consumed characters, or
+    None if there is no match (nothing is written then).
+    """
+    compiled = barg.compile_grammar(grammar, error_out, barg_exec_transforms)
+    barg.barg_lazy.install_lazy_matchers(compiled.toplevel)
+    m = next(compiled.parse(string, grammar_toplevel_name), None)
+    if m is None:
+        return None
+    sink.write(m[0])
+    return m[1]
@@ -0,0 +1,57 @@
+import barg
+from typing import Optional
+
+
+class Tracer:
+    """
+    Receives the match events of a parse. Install it with `CompiledGrammar.set_tracer` (or `barg.parse(..., tracer=...)`)
+    and override the callbacks you need. `node` is the AstNode being matched (in generated parsers, an object with
+    `rule`, `line` and `kind` attributes) and `pos` the input offset it is matched at.
+    Without a tracer, the matchers are not wrapped at all, so disabled tracing costs nothing.
+    """
+
+    def enter(self, node, pos: int):
+        """The matcher of `node` is started"""
+
+    def match(self, node, pos: int, ncons: int):
+        """The matcher of `node` yields a match of length `ncons`"""
+
+    def backtrack(self, node, pos: int):
+        """The matcher of `node` is resumed to find another match after it yielded one"""
+
+    def exit(self, node, pos: int):
+        """The matcher of `node` is exhausted or abandoned"""
+
+    def transform(self, node, pos: int, ncons: int):
+        """The transform of `node` was invoked on a match and returned (`match` follows)"""
+
+
+def traced_matcher(tracer: Tracer):
+    """Returns a wrap function for `barg.instrument` that reports the events of every node to `tracer`"""
+
+    def wrap(node: "barg.AstNode", match):
+        is_transform = isinstance(node, barg.AstTransform)
+
+        def traced_match(string: str, module: "barg.ModuleInfo", symbol: Optional[str] = None):
+            pos = module.input_length - len(string)
+            tracer.enter(node, pos)
+            try:
+                yielded = False
+                gen = match(string, module, symbol)
+                while True:
+                    if yielded:
+                        tracer.backtrack(node, pos)
+                    item = next(gen, None)
+                    if item is None:
+                        return
+                    if is_transform:
+                        tracer.transform(node, pos, item[1])
+                    tracer.match(node, pos, item[1])
+                    yielded = True
+                    yield item
+            finally:
+                tracer.exit(node, pos)
+
+        return traced_match
+
+    return wrap
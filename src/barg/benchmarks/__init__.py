@@ -0,0 +1,161 @@
+"""
+Benchmarks of the interpreter and the generated parsers on synthetic inputs of increasing size.
+Run them with `python -m barg bench` (see `--help`), or call `run_benchmarks` and `format_results`.
+"""
+
+import gc
+import json
+import math
+import os
+import sys
+import time
+import platform
+import tracemalloc
+import barg
+from typing import Callable, Dict, List, Optional
+from .cases import BenchCase, CASES
+
+BACKENDS = ("interp", "codegen")
+DEFAULT_SIZES = (25, 50, 100, 200)
+
+
+def interp_parser(case: BenchCase, grammar: str) -> Callable[[str], object]:
+    def parse(text: str):
+        errs = []
+        # the grammar is compiled when the generator is created, only the first next() is timed by the caller
+        g = barg.parse((text,), grammar, errs, case.toplevel_name)[0]
+        if errs:
+            raise barg.BadGrammarError("\n".join(errs))
+        return lambda: next(g)[0]
+
+    return parse
+
+
+def codegen_parser(case: BenchCase, grammar: str) -> Callable[[str], object]:
+    with open(os.path.join(os.path.dirname(barg.__file__), "barg_codegen_builtins.py")) as f:
+        head = f.read()
+    errs = []
+    code = barg.generate_python_parser(grammar, errs, head)
+    if errs:
+        raise barg.BadGrammarError("\n".join(errs))
+    globs = {"__name__": "barg_generated_parser"}
+    exec(code, globs)
+    toplevel = globs[case.toplevel_name]
+
+    def parse(text: str):
+        return lambda: toplevel.parse(text)
+
+    return parse
+
+
+def scaling_exponent(points: List[Dict]) -> Optional[float]:
+    """Slope of log(seconds) over log(chars) (least squares): 1 is linear, 2 quadratic, ..."""
+    xs = [math.log(p["chars"]) for p in points if p["seconds"] > 0]
+    ys = [math.log(p["seconds"]) for p in points if p["seconds"] > 0]
+    if len(xs) < 2:
+        return None
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    var = sum((x - mx) ** 2 for x in xs)
+    if var == 0:
+        return None
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var
+
+
+def measure(prepare: Callable[[str], Callable[[], object]], text: str, repeat: int) -> Dict:
+    best = math.inf
+    for _ in range(repeat):
+        run = prepare(text)
+        gc.collect()
+        t0 = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - t0)
+    # a separate run for memory, tracemalloc slows everything down
+    run = prepare(text)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "chars": len(text),
+        "seconds": best,
+        "chars_per_second": len(text) / best if best > 0 else None,
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(
+    cases: Optional[List[str]] = None,
+    backends: Optional[List[str]] = None,
+    sizes=DEFAULT_SIZES,
+    repeat: int = 3,
+    log=None,
+) -> Dict:
+    """
+    Runs the selected cases (all by default) on every backend and size. Failures (like a RecursionError at large
+    sizes) are recorded in the result instead of aborting the run. Returns a JSON-serializable dict.
+    """
+    selected = [c for c in CASES if cases is None or c.name in cases]
+    results = []
+    for case in selected:
+        grammar = case.load_grammar()
+        for backend in backends or BACKENDS:
+            result = {"case": case.name, "backend": backend, "points": [], "error": None}
+            results.append(result)
+            if grammar is None:
+                result["error"] = "grammar not found (docs/ is only available in a source checkout)"
+                continue
+            try:
+                make = interp_parser if backend == "interp" else codegen_parser
+                prepare = make(case, grammar)
+                for size in sizes:
+                    point = measure(prepare, case.make_input(size), repeat)
+                    point["size"] = size
+                    result["points"].append(point)
+                    if log is not None:
+                        print(f"{case.name}/{backend}: size {size} took {point['seconds']:.4f}s", file=log)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            result["scaling_exponent"] = scaling_exponent(result["points"])
+    return {
+        "barg_bench_version": 1,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "time": time.time(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def format_results(report: Dict) -> str:
+    header = f"{'case':<14} {'backend':<8} {'size':>6} {'chars':>8} {'ms':>10} {'kchars/s':>10} {'peak KiB':>10}"
+    lines = [header, "-" * len(header)]
+    for result in report["results"]:
+        name = f"{result['case']:<14} {result['backend']:<8}"
+        for p in result["points"]:
+            kcps = p["chars_per_second"] / 1000 if p["chars_per_second"] else float("nan")
+            lines.append(
+                f"{name} {p['size']:>6} {p['chars']:>8} {p['seconds'] * 1000:>10.2f} {kcps:>10.1f} {p['peak_bytes'] / 1024:>10.1f}"
+            )
+        if result.get("scaling_exponent") is not None:
+            lines.append(f"{name} scaling exponent {result['scaling_exponent']:.2f}")
+        if result["error"]:
+            lines.append(f"{name} error: {result['error']}")
+    return "\n".join(lines)
+
+
+def main(args) -> None:
+    if args.max_recursion_limit:
+        sys.setrecursionlimit(args.max_recursion_limit)
+    report = run_benchmarks(
+        args.cases, args.backends, args.sizes, args.repeat, log=sys.stderr
+    )
+    print(format_results(report))
+    if args.json:
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
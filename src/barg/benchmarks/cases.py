@@ -0,0 +1,119 @@
+import os
+import barg
+from typing import Callable, Optional
+
+DOCS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(barg.__file__)))),
+    "docs",
+)
+
+
+class BenchCase:
+    """
+    A grammar plus a generator of inputs of increasing size. `size` is a number of items (list entries, statements,
+    nesting levels, ...), not characters. The grammar is loaded lazily because the docs grammars only exist in a
+    source checkout.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        load_grammar: Callable[[], Optional[str]],
+        toplevel_name: str,
+        make_input: Callable[[int], str],
+    ):
+        self.name = name
+        self.load_grammar = load_grammar
+        self.toplevel_name = toplevel_name
+        self.make_input = make_input
+
+
+def docs_grammar(filename: str) -> Callable[[], Optional[str]]:
+    def load() -> Optional[str]:
+        path = os.path.join(DOCS_DIR, filename)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return f.read()
+
+    return load
+
+
+def json_input(size: int) -> str:
+    items = []
+    for i in range(size):
+        items.append(
+            f'{{"id": {i}, "name": "item{i}", "score": {i}.5, "tags": ["a", "b"], "ok": {"true" if i % 2 else "false"}, "next": null}}'
+        )
+    return "[\n" + ",\n".join(items) + "\n]"
+
+
+def grammar1_input(size: int) -> str:
+    # every fifth statement is malformed and skipped by the recovery pattern
+    lines = []
+    for i in range(size):
+        if i % 5 == 4:
+            lines.append(f"v{i} {i};")
+        elif i % 2:
+            lines.append(f"v{i} = v{i - 1};")
+        else:
+            lines.append(f"v{i} = {i};")
+    return "\n".join(lines) + "\n"
+
+
+NESTING_GRAMMAR = r"""
+Atom := "x";
+Paren := struct {
+    "\(",
+    inner: Expr,
+    "\)"
+};
+Expr := Paren | Atom;
+"""
+
+
+def nesting_input(size: int) -> str:
+    return "(" * size + "x" + ")" * size
+
+
+LONG_LIST_GRAMMAR = r"""
+Item := struct {
+    value: $builtin.int("\d+"),
+    ";"
+};
+Toplevel := Item*;
+"""
+
+
+def long_list_input(size: int) -> str:
+    return "".join(f"{i};" for i in range(size))
+
+
+ALTERNATION_WORDS = [f"kw{i}" for i in range(24)]
+ALTERNATION_GRAMMAR = (
+    "Word := "
+    + " | ".join(f'"{w}\\b"' for w in ALTERNATION_WORDS)
+    + r""";
+Item := struct {
+    word: Word,
+    "\s*"
+};
+Toplevel := Item*;
+"""
+)
+
+
+def alternation_input(size: int) -> str:
+    # mostly words late in the alternation, so most alternatives are tried and fail first
+    words = ALTERNATION_WORDS[-6:]
+    return " ".join(words[i % len(words)] for i in range(size))
+
+
+CASES = [
+    BenchCase("json", docs_grammar("json_grammar.barg"), "Json", json_input),
+    BenchCase("json_skip", docs_grammar("json_skip_grammar.barg"), "Json", json_input),
+    BenchCase("grammar1", docs_grammar("grammar1.barg"), "Toplevel", grammar1_input),
+    BenchCase("deep_nesting", lambda: NESTING_GRAMMAR, "Expr", nesting_input),
+    BenchCase("long_list", lambda: LONG_LIST_GRAMMAR, "Toplevel", long_list_input),
+    BenchCase("alternation", lambda: ALTERNATION_GRAMMAR, "Toplevel", alternation_input),
+]
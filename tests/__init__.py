@@ -1,6 +1,9 @@
+import os
 import unittest
 import barg
 
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs")
+
 
 class Exec(unittest.TestCase):
     def test1(self):
@@ -138,6 +141,772 @@ v4 = second_var;
             self.assertTrue(hasattr(stmt.expr, "_PYSCRIPT_RAN_SUCCESSFULLY"))
             self.assertTrue(stmt.expr._PYSCRIPT_RAN_SUCCESSFULLY)
 
+    def test_tokens(self):
+        test_grammar = """\
+tokens {
+    skip Whitespace: "\\s+",
+    Number: "-?\\d+",
+    Ident: "[a-zA-Z_]+",
+    Plus: "\\+",
+    Semi: ";",
+}
+
+Sum := struct {
+    lhs: $builtin.int(Number),
+    Plus,
+    rhs: Number | Ident,
+    Semi
+};
+
+Toplevel := Sum*;
+"""
+        test_source = "1 + 2;\n  3+ abc ;\n4 + 5"
+
+        errs = []
+        out = barg.parse((test_source,), test_grammar, errs, "Toplevel")
+        self.assertEqual(0, len(errs))
+        m = next(out[0])[0]
+        self.assertEqual(2, len(m))
+        self.assertEqual(1, m[0].lhs)
+        self.assertEqual("2", m[0].rhs)
+        self.assertEqual(3, m[1].lhs)
+        self.assertEqual("abc", m[1].rhs)
+
+        # `tokens` only starts a tokens section in front of `{`, elsewhere it is a plain name
+        test_grammar = 'tokens := "[a-z]+"; Toplevel := struct { tokens: tokens, " ", n: list[greedy 0..] { tokens } };'
+        m = next(barg.parse(("ab cd",), test_grammar, errs)[0])[0]
+        self.assertEqual(0, len(errs))
+        self.assertEqual(("ab", ["cd"]), (m.tokens, m.n))
+        self.assertEqual("ab", codegen_module(test_grammar)["Toplevel"].parse("ab cd").tokens)
+
+    def test_reparse(self):
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+        text = "[" + ", ".join(str(i) for i in range(50)) + "]"
+
+        errs = []
+        tree = barg.parse_incremental(text, grammar, errs, "Json")
+        self.assertEqual(0, len(errs))
+        self.assertTrue(tree.matched)
+        # the grammar went through the same passes as for barg.parse
+        self.assertEqual(barg.compile_grammar(grammar, errs).toplevel, tree._session.module.toplevel)
+        self.assertEqual(list(range(50)), tree.value.values)
+
+        # replace the 40 by 4.5, then append an item (the first edit moved the closing bracket to len(text))
+        pos = text.index("40")
+        tree = barg.reparse(
+            tree,
+            [
+                barg.TextEdit(pos, pos + 2, "4.5"),
+                barg.TextEdit(len(text), len(text), ", true"),
+            ],
+        )
+        expected = list(range(50))
+        expected[40] = 4.5
+        self.assertEqual(expected + [True], tree.value.values)
+        # the items in front of the edit are reused
+        self.assertLess(tree.computed, 100)
+        full = next(barg.parse((tree.text,), grammar, errs, "Json")[0])[0]
+        self.assertEqual(str(full), str(tree.value))
+
+        # recovered errors after an edit are at their new offsets, like in a fresh parse
+        tree = barg.parse_incremental("(ab)x1;(cd)", RECOVER_GRAMMAR, errs, "Items")
+        self.assertEqual((4, 7), (tree.value[1].start, tree.value[1].end))
+        tree = barg.reparse(tree, [barg.TextEdit(0, 0, "(zz)")])
+        full = next(barg.parse((tree.text,), RECOVER_GRAMMAR, errs, "Items")[0])[0]
+        self.assertEqual((8, 11), (full[2].start, full[2].end))
+        self.assertEqual(str(full), str(tree.value))
+        # edits in the input a recovery searched through for a synchronization token invalidate the error
+        for text, edit in (
+            ("x1;(ab)", barg.TextEdit(1, 2, "(zz")),
+            (")b1aaaa;", barg.TextEdit(6, 8, "")),
+            ("bxbd", barg.TextEdit(3, 4, ";")),
+        ):
+            tree = barg.reparse(barg.parse_incremental(text, RECOVER_GRAMMAR, errs, "Items"), [edit])
+            full = next(barg.parse((tree.text,), RECOVER_GRAMMAR, errs, "Items")[0])
+            self.assertEqual(str(full), str((tree.value, tree.ncons)))
+
+    def test_lazy(self):
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+        text = '{"a": [1, 2.5, "x", null], "b": {"c": "d"}}'
+
+        errs = []
+        eager = next(barg.parse((text,), grammar, errs, "Json")[0])[0]
+        lazy = next(barg.parse((text,), grammar, errs, "Json", lazy=True)[0])[0]
+        self.assertEqual(0, len(errs))
+        self.assertIsInstance(lazy, barg.LazyStruct)
+        self.assertEqual("a", lazy.items[0].key)
+        self.assertEqual([1, 2.5, "x", None], lazy.items[0].value.values)
+        # fields are built once and then cached
+        self.assertIs(lazy.items[1].value, lazy.items[1].value)
+        self.assertEqual(str(eager), str(lazy))
+        self.assertEqual(str(eager), str(barg.materialize(lazy)))
+        # leaves record their span in the input instead of keeping the input suffix they were matched on
+        text = "1," * 300
+        items = next(barg.parse((text,), 'Item := struct { v: "[0-9]+", "," }; Toplevel := Item*;', errs, lazy=True)[0])[0]
+        leaves = [item._lazy_fields["v"] for item in items]
+        self.assertTrue(all(leaf.text is text for leaf in leaves))
+        self.assertEqual((10, 11), (leaves[5].start, leaves[5].end))
+        self.assertEqual(["1"] * 300, [item.v for item in items])
+
+    def test_push_down_transforms(self):
+        test_grammar = """\
+Pair := $builtin.delete(struct {
+    key: "[a-z]+",
+    "=",
+    value: $builtin.int("\\d+"),
+}, key);
+
+Item := $builtin.mark(struct { pair: Pair, ";" }, ok) | "[^;]*;";
+Toplevel := $builtin.filter(Item*, ok);
+"""
+        tokens = barg.Lexer(test_grammar).tokenize()
+        ast = barg.Parser(tokens).parse()
+        barg.push_down_transforms(ast, barg.BARG_EXEC_BUILTINS)
+        defns = {a.identifier: a.expression for a in ast.assignments}
+        self.assertEqual(("key",), defns["Pair"].discard)
+        self.assertEqual("ok", defns["Toplevel"].keep_mark)
+
+        errs = []
+        m = next(barg.parse(("a=1;oops;b=2;",), test_grammar, errs)[0])[0]
+        self.assertEqual(0, len(errs))
+        self.assertEqual([None, None], [item.pair.key for item in m])
+        self.assertEqual([1, 2], [item.pair.value for item in m])
+
+    def test_specialize_transforms(self):
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+        ast = barg.Parser(barg.Lexer(grammar).tokenize()).parse()
+        barg.specialize_transforms(ast, barg.BARG_EXEC_BUILTINS)
+        defns = {a.identifier: a.expression for a in ast.assignments}
+        self.assertEqual("builtin.strip_quotes", defns["String"].name)
+        self.assertEqual("builtin.const", defns["Null"].name)
+
+        errs = []
+        m = next(barg.parse(('["a", true, false, null]',), grammar, errs, "Json")[0])[0]
+        self.assertEqual(0, len(errs))
+        self.assertEqual(["a", True, False, None], m.values)
+
+        test_grammar = 'Toplevel := $builtin.unescape("[^$]*");'
+        m = next(barg.parse(('a\\"b\\n\\u00e4',), test_grammar, errs)[0])[0]
+        self.assertEqual('a"b\nä', m)
+        # surrogate pairs are one character, like json.loads decodes them
+        text = "\\uD83D\\uDE00 \\ud83d\\ude00!"
+        self.assertEqual("😀 😀!", next(barg.parse((text,), test_grammar, errs)[0])[0])
+        self.assertEqual("😀 😀!", codegen_module(test_grammar)["Toplevel"].parse(text))
+
+        # mutable literals are not shared: every match gets a new object, also across parses
+        test_grammar = 'Toplevel := struct { a: $builtin.pyexpr("a", `[]`), b: $builtin.pyexpr("a", `[]`) };'
+        ast = barg.Parser(barg.Lexer(test_grammar).tokenize()).parse()
+        barg.specialize_transforms(ast, barg.BARG_EXEC_BUILTINS)
+        self.assertEqual("builtin.pyexpr", ast.assignments[0].expression.fields[0][1].name)
+        m = next(barg.parse(("aa",), test_grammar, errs)[0])[0]
+        self.assertIsNot(m.a, m.b)
+        m.a.append(1)
+        self.assertEqual([], next(barg.parse(("aa",), test_grammar, errs)[0])[0].a)
+        for code in ("[]", "{'a': [1]}", "(1, [2])"):
+            value, _ = barg.barg_exec_builtins.builtin_const(None, "", 0, None, code)
+            value2, _ = barg.barg_exec_builtins.builtin_const(None, "", 0, None, code)
+            self.assertIsNot(value, value2)
+        value, _ = barg.barg_exec_builtins.builtin_const(None, "", 0, None, "(1, 'a')")
+        self.assertIs(value, barg.barg_exec_builtins.builtin_const(None, "", 0, None, "(1, 'a')")[0])
+        parser = codegen_module(test_grammar)
+        m = parser["Toplevel"].parse("aa")
+        m.a.append(1)
+        self.assertEqual([], parser["Toplevel"].parse("aa").a)
+        const = parser["_builtin_const_"]
+        self.assertIsNot(const("", 0, None, "[]")[0], const("", 0, None, "[]")[0])
+
+    def test_profiler(self):
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+
+        errs = []
+        profiler = barg.Profiler()
+        g = barg.parse(("[1, 2, [3]]",), grammar, errs, "Json", profiler=profiler)[0]
+        self.assertEqual(3, len(next(g)[0].values))
+        stats = {(s.rule, s.kind): s for s in profiler.ranked()}
+        self.assertGreaterEqual(stats[("Int", "transform")].matches, 3)
+        self.assertGreaterEqual(stats[("List", "struct")].calls, 2)
+        self.assertGreater(stats[("Json", "enum")].cum_time, 0)
+        report = profiler.report(grammar, limit=len(profiler.stats))
+        self.assertIn("----> Json := Dict | List;", report)
+
+    def test_tracer(self):
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+
+        errs = []
+        tracer = EventCounter()
+        g = barg.parse(("[1, [2]]",), grammar, errs, "Json", tracer=tracer)[0]
+        self.assertEqual(2, len(next(g)[0].values))
+        g.close()
+        self.assertEqual(tracer.events["enter"], tracer.events["exit"])
+        self.assertGreater(tracer.events["backtrack"], 0)
+        self.assertGreaterEqual(tracer.events["transform"], 2)
+        # removing the tracer restores the plain matchers
+        module = barg.ModuleInfo(barg.Parser(barg.Lexer(grammar).tokenize()).parse(), {})
+        module.set_tracer(tracer)
+        self.assertIn("match", vars(module.definitions["Json"]))
+        module.set_tracer(None)
+        self.assertNotIn("match", vars(module.definitions["Json"]))
+
+    def test_bench(self):
+        from barg import benchmarks
+
+        report = benchmarks.run_benchmarks(["long_list"], sizes=(5, 10), repeat=1)
+        self.assertEqual(2, len(report["results"]))
+        for result in report["results"]:
+            self.assertIsNone(result["error"])
+            self.assertEqual([5, 10], [p["size"] for p in result["points"]])
+            self.assertIsNotNone(result["scaling_exponent"])
+
+    def test_budget_and_lint(self):
+        grammar = r"""
+        A := "a";
+        Xs := struct { A*, "b?" };
+        Empty := Xs*;
+        Nested := (A+)+;
+        Toplevel := struct { items: Nested, "c" };
+        """
+        ast = barg.Parser(barg.Lexer(grammar).tokenize()).parse()
+        self.assertEqual([4, 5], [line for line, _ in barg.lint_grammar(ast)])
+
+        errs = []
+        budget = barg.ParseBudget(max_steps=1000)
+        g = barg.parse(("a" * 25 + "d",), grammar, errs, budget=budget)[0]
+        with self.assertRaises(barg.ParseBudgetExceeded) as cm:
+            next(g)
+        self.assertEqual(1001, cm.exception.steps)
+        # the leaf of A (referenced directly, see barg.optimize) is matched by the backtracking lists of Nested
+        self.assertEqual(["A", "Nested"], [rule for rule, *_ in cm.exception.hottest[:2]])
+        g = barg.parse(("aaac",), grammar, errs, budget=budget)[0]
+        self.assertEqual(3, len(sum(next(g)[0].items, [])))
+
+    def test_nullable_list(self):
+        errs = []
+        with self.assertWarns(barg.GrammarWarning):
+            out = barg.parse(("x x  x!", "!"), NULLABLE_LIST_GRAMMAR, errs)
+        self.assertEqual(0, len(errs))
+        self.assertEqual(["x", "x", "x"], [i.x for i in next(out[0])[0].items])
+        self.assertEqual([], next(out[1])[0].items)
+
+    def test_async(self):
+        import asyncio
+
+        grammar = r"""
+        Item := struct { value: $builtin.int("\d+"), ";\s*" };
+        Toplevel := Item*;
+        """
+
+        async def run():
+            m, ncons = await barg.parse_async("1; 2;", grammar, yield_every=2)
+            errs = []
+            items = [i.value async for i in barg.iter_items_async("1; 2;3; x", grammar, errs)]
+            return barg.to_plain(m), ncons, items, errs
+
+        plain = [{"value": 1, "_0": "; "}, {"value": 2, "_0": ";"}]
+        self.assertEqual((plain, 5, [1, 2, 3], []), asyncio.run(run()))
+
+        # streaming sets up the input like every other parse (here: the leaf indexes) and compiles the grammar once
+        from unittest import mock
+
+        async def stream():
+            return [i.n async for i in barg.iter_items_async("12 345 6", PRESCAN_GRAMMAR, errs)]
+
+        errs = []
+        with mock.patch.object(barg.ModuleInfo, "index_leaves", autospec=True, wraps=barg.ModuleInfo.index_leaves) as index:
+            self.assertEqual((["12", "345", "6"], ["12", "345", "6"]), (asyncio.run(stream()), asyncio.run(stream())))
+        self.assertEqual(2, index.call_count)
+        compiled = barg.barg_async._compile(PRESCAN_GRAMMAR, errs, None)
+        self.assertIs(compiled, barg.barg_async._compile(PRESCAN_GRAMMAR, errs, None))
+        self.assertEqual([], errs)
+
+    def test_shared_grammar(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+        errs = []
+        compiled = barg.compile_grammar(grammar, errs)
+        self.assertEqual(0, len(errs))
+        n_types = len(compiled.generated_types)
+        texts = ["[" + ", ".join(str(j) for j in range(i)) + "]" for i in range(20)]
+        with ThreadPoolExecutor(4) as ex:
+            results = list(ex.map(lambda t: next(compiled.parse(t, "Json"))[0].values, texts))
+        self.assertEqual([list(range(i)) for i in range(20)], results)
+        # everything was prepared at compile time, parsing does not write to the shared grammar
+        self.assertEqual(n_types, len(compiled.generated_types))
+        for grammar, text in (
+            ('Toplevel := struct { x: $builtin.backtrack("a*"), "a" };', "aaa"),
+            ('tokens { A: "a+", skip S: " " } Toplevel := list[greedy 0..] { A };', "aa a"),
+        ):
+            compiled = barg.compile_grammar(grammar, errs)
+            cache = dict(compiled.regex_cache)
+            next(compiled.parse(text, "Toplevel"))
+            self.assertEqual(cache, compiled.regex_cache)
+
+    def test_json_sink(self):
+        import io
+        import json
+
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+        text = '{"a": [1, 2.5, "x", null], "b": {"c": true}}'
+
+        errs = []
+        out = io.StringIO()
+        ncons = barg.parse_to_sink(text, grammar, barg.JsonSink(out, private=False), errs, "Json")
+        self.assertEqual(0, len(errs))
+        self.assertEqual(len(text), ncons)
+        expected = {
+            "items": [
+                {"key": "a", "value": {"values": [1, 2.5, "x", None]}},
+                {"key": "b", "value": {"items": [{"key": "c", "value": True}]}},
+            ]
+        }
+        self.assertEqual(expected, json.loads(out.getvalue()))
+        # eagerly built results are written the same way
+        eager = next(barg.parse((text,), grammar, errs, "Json")[0])[0]
+        out = io.StringIO()
+        barg.JsonSink(out).write(eager)
+        self.assertEqual(barg.to_plain(eager), json.loads(out.getvalue()))
+
+        # eager and lazy results give the same document, marks are no fields
+        grammar = r"""
+        Item := $builtin.mark(struct { x: $builtin.float("[a-z]+|\d+"), ";" }, ok);
+        Toplevel := list[greedy 0..] { Item };
+        """
+        docs = []
+        for lazy in (False, True):
+            out = io.StringIO()
+            sink = barg.JsonSink(out)
+            sink.write(next(barg.parse(("1;22;",), grammar, errs, lazy=lazy)[0])[0])
+            docs.append(out.getvalue())
+            with self.assertRaises(ValueError):
+                sink.write(next(barg.parse(("1;inf;",), grammar, errs, lazy=lazy)[0])[0])
+        self.assertEqual('[{"x": 1.0, "_0": ";"}, {"x": 22.0, "_0": ";"}]\n', docs[0])
+        self.assertEqual(docs[0], docs[1])
+        self.assertEqual(0, len(errs))
+
+    def test_actions(self):
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+        actions = {
+            "Int": lambda i: i * 10,
+            "List": lambda l: sum(v for v in l.values if isinstance(v, int)),
+            "Key": str.upper,
+        }
+        errs = []
+        for lazy in (False, True):
+            g = barg.parse(('{"a": [1, 2, [3]], "b": 4}',), grammar, errs, "Json", actions=actions, lazy=lazy)
+            m = next(g[0])[0]
+            self.assertEqual(["A", "B"], [item.key for item in m.items])
+            self.assertEqual([60, 40], [item.value for item in m.items])
+        with self.assertRaises(barg.BadGrammarError):
+            barg.parse(("",), grammar, errs, "Json", actions={"Missing": str})
+        # actions run once per match in the result, not for matches that are backtracked out of
+        grammar = 'Num := "[0-9]+"; Toplevel := enum { a: struct { n: Num, ";" }, b: struct { n: Num, "." } };'
+        for lazy in (False, True):
+            calls = []
+            m = next(barg.parse(("12.",), grammar, errs, actions={"Num": lambda n: calls.append(n) or int(n)}, lazy=lazy)[0])[0]
+            self.assertEqual(("b", 12, ["12"]), (m.tag, m.value.n, calls))
+
+    def test_enum_modes(self):
+        errs = []
+        results = {
+            name: [m.v.tag for m, _ in barg.parse(("abc",), ENUM_MODES_GRAMMAR, errs, name)[0]]
+            for name in ("All", "First", "Longest")
+        }
+        self.assertEqual(0, len(errs))
+        # ordered choice commits to "a" and then fails on "bc", longest takes all of the input
+        self.assertEqual({"All": ["long"], "First": [], "Longest": ["longer"]}, results)
+
+    def test_hash_cons(self):
+        grammar = r"""
+        A := struct { x: "\d+", ";" };
+        B := list[0..] { struct { x: "\d+", ";" } };
+        C := struct { a: struct { x: "\d+", ";" } };
+        """
+        ast = barg.Parser(barg.Lexer(grammar).tokenize()).parse()
+        a, b, c = (assignment.expression for assignment in ast.assignments)
+        # identical sub-expressions are one node, rule expressions stay distinct
+        self.assertIs(b.expression, c.fields[0][1])
+        self.assertIsNot(a, b.expression)
+        self.assertEqual(a, b.expression)
+        self.assertEqual(hash(a), hash(b.expression))
+        with self.assertRaises(AttributeError):
+            a.fields = ()
+        # grammars are only equal with the same tokens, %skip and %prescan sections
+        toplevels = [
+            barg.Parser(barg.Lexer(head + 'A := "a";').tokenize()).parse()
+            for head in ("", "", '%skip := " ";', "%prescan := A;", 'tokens { a: "a" };')
+        ]
+        self.assertEqual(toplevels[0], toplevels[1])
+        self.assertEqual(hash(toplevels[0]), hash(toplevels[1]))
+        for i, x in enumerate(toplevels[1:]):
+            for y in toplevels[i + 2 :]:
+                self.assertNotEqual(x, y)
+
+    def test_leaf_matching(self):
+        errs = []
+        results = {
+            name: [m.a for m, _ in barg.parse((text,), LEAF_GRAMMAR, errs, name)[0]]
+            for name, text in (("Anchored", "xb"), ("Greedy", "aaa"), ("Backtracking", "aaa"))
+        }
+        self.assertEqual(0, len(errs))
+        self.assertEqual({"Anchored": [], "Greedy": [], "Backtracking": ["aa", "a", ""]}, results)
+        barg.parse(("",), 'A := $builtin.backtrack(struct { "a" });', errs, "A")
+        self.assertIn("builtin.backtrack takes exactly one argument", errs[0])
+
+    def test_leaf_plans(self):
+        plans = {p: barg.plan_leaf(p) for p in (r"\{", r"\s*", "[a-z_]+", r"\s*:\s*", "(true|false)")}
+        self.assertEqual(("literal", "{"), (plans[r"\{"].kind, plans[r"\{"].text))
+        self.assertEqual(("run", 0), (plans[r"\s*"].kind, plans[r"\s*"].min_count))
+        self.assertIn("\u3000", plans[r"\s*"].chars)
+        self.assertEqual(("run", 1), (plans["[a-z_]+"].kind, plans["[a-z_]+"].min_count))
+        # \s means something else to the stdlib engine, so only patterns without it may use re
+        self.assertEqual(("regex", "regex"), (plans[r"\s*:\s*"].kind, plans[r"\s*:\s*"].engine))
+        self.assertEqual(("regex", "re"), (plans["(true|false)"].kind, plans["(true|false)"].engine))
+        for pattern, plan in plans.items():
+            match = plan.matcher()
+            for text in ("{a", "  : x", "ab_c1", "true", "", "\x1c"):
+                m = barg.barg_leaf.regex.match(pattern, text)
+                self.assertEqual(None if m is None else m.end(), match(text), (pattern, text))
+
+    def test_skip(self):
+        with open(os.path.join(DOCS_DIR, "json_skip_grammar.barg")) as f:
+            grammar = f.read()
+        text = '  { "a" : [1 ,2.5, "x" ,null ] ,\n "b":{"c":true} }  '
+        errs = []
+        for lazy in (False, True):
+            m, ncons = next(barg.parse((text,), grammar, errs, "Json", lazy=lazy)[0])
+            self.assertEqual(0, len(errs))
+            self.assertEqual([1, 2.5, "x", None], m.items[0].value.values)
+            self.assertEqual(True, m.items[1].value.items[0].value)
+            # leading skipped input is consumed, trailing skipped input is not part of the match
+            self.assertEqual(len(text) - 2, ncons)
+        barg.parse(("",), '%ignore := "\\s*";', errs)
+        self.assertIn("unknown directive '%ignore'", errs[0])
+
+    def test_parse_error(self):
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+        errs = []
+        g = barg.parse(('[1, 2,\n  {"a": tru}]',), grammar, errs, "Json", raise_on_failure=True)[0]
+        with self.assertRaises(barg.ParseError) as cm:
+            next(g)
+        e = cm.exception
+        self.assertEqual((15, 2, 9), (e.offset, e.line, e.column))
+        self.assertIn('"(true|false)"', e.expected)
+        self.assertIn('"null"', e.expected)
+        self.assertEqual('  {"a": tru}]', e.source_line)
+        # matching inputs are not affected
+        g = barg.parse(("[1]",), grammar, errs, "Json", raise_on_failure=True)[0]
+        self.assertEqual([1], next(g)[0].values)
+
+        index = barg.LineIndex("ab\ncd\n\ne")
+        self.assertEqual([(1, 1), (1, 3), (2, 1), (3, 1), (4, 1)], [index.position(i) for i in (0, 2, 3, 6, 7)])
+        self.assertEqual("cd", index.line_text(2))
+
+    def test_passes(self):
+        errs = []
+        ast = barg.Parser(barg.Lexer(PASSES_GRAMMAR).tokenize()).parse()
+        manager = barg.PassManager()
+        manager.run(ast, barg.BARG_EXEC_BUILTINS, ["Toplevel"])
+        self.assertEqual([name for name, _ in barg.DEFAULT_PASSES], [name for name, *_ in manager.log])
+        ir = barg.format_ir(ast)
+        # Item is referenced directly, List by name (it is recursive), Unused and the text string are dropped
+        self.assertIn("Toplevel := struct { items: @List }", ir)
+        self.assertIn("list[greedy 0..] { enum { item: @Item, nested: List } }", ir)
+        self.assertIn("$builtin.pyexpr(@Name, `x.upper()`)", ir)
+        self.assertNotIn("Unused", ir)
+        m, _ = next(barg.parse(("[ab[c]]",), PASSES_GRAMMAR, errs)[0])
+        self.assertEqual(0, len(errs))
+        self.assertEqual("AB", m.items.items[0].value)
+        self.assertEqual("C", m.items.items[1].value.items[0].value)
+        # without roots, every rule can be matched
+        compiled = barg.compile_grammar(PASSES_GRAMMAR, errs)
+        self.assertEqual("u", next(compiled.parse("u", "Unused"))[0])
+
+    def test_recover(self):
+        errs = []
+        for lazy in (False, True):
+            m, ncons = next(barg.parse(("(ab)x1;(cd)",), RECOVER_GRAMMAR, errs, "Items", lazy=lazy)[0])
+            self.assertEqual(0, len(errs))
+            m = barg.materialize(m)
+            self.assertEqual(["ab", "cd"], [m[0].name, m[2].name])
+            self.assertIsInstance(m[1], barg.ErrorNode)
+            self.assertEqual((4, 7, "x1;"), (m[1].start, m[1].end, m[1].text))
+            self.assertEqual(11, ncons)
+        # the synchronization set need not be regex leaves
+        m, _ = next(barg.parse(("12end",), RECOVER_GRAMMAR, errs, "Other")[0])
+        self.assertEqual({"start": 0, "end": 5, "text": "12end"}, barg.to_plain(m))
+        # no synchronization token, no match
+        self.assertEqual([], list(barg.parse(("12",), RECOVER_GRAMMAR, errs, "Other")[0]))
+        barg.parse(("",), 'A := $builtin.recover("a");', errs)
+        self.assertIn("builtin.recover takes an expression", errs[0])
+
+    def test_alternation(self):
+        errs = []
+        compiled = barg.compile_grammar(ALTERNATION_GRAMMAR, errs)
+        self.assertEqual(0, len(errs))
+        module = compiled.context()
+        groups = module.definitions["Value"].alternation(module)
+        # the leaves around the struct variant are merged into two blocks, the keywords into a literal table
+        self.assertEqual(3, len(groups))
+        self.assertEqual(("regex", "x"), (groups[0].plan.kind, groups[1][0]))
+        self.assertEqual("literals", module.definitions["Keyword"].alternation(module)[0].plan.kind)
+        values = [(m.tag, m.value) for m, _ in compiled.parse("0x1f", "Value")]
+        self.assertEqual([("hex", 31), ("dec", 0)], values)
+        self.assertEqual([("word", "abc")], [(m.tag, m.value) for m, _ in compiled.parse("abc", "Value")])
+        self.assertEqual("iffy", next(compiled.parse("iffy", "Keyword"))[0].tag)
+        self.assertEqual("for", next(compiled.parse("for", "Keyword"))[0].tag)
+        # failures are reported for every variant of a block that did not match
+        g = barg.parse(("?",), ALTERNATION_GRAMMAR, errs, "Keyword", raise_on_failure=True)[0]
+        with self.assertRaises(barg.ParseError) as cm:
+            next(g)
+        self.assertEqual(['"for"', '"if "', '"iffy"', '"while"'], cm.exception.expected)
+        self.assertIsNone(barg.plan_alternation(["(a)\\1", "b"]))
+        self.assertIsNone(barg.plan_alternation(["a"]))
+
+    def test_prescan(self):
+        errs = []
+        compiled = barg.compile_grammar(PRESCAN_GRAMMAR, errs)
+        self.assertEqual(0, len(errs))
+        self.assertEqual(["[0-9]+", " *"], list(compiled.prescan))
+        module = compiled.context()
+        m, _ = next(compiled.toplevel.match("12 345 6", module, "Toplevel"))
+        self.assertEqual(["12", "345", "6"], [item.n for item in m])
+        self.assertEqual([0, 3, 7], list(module.leaf_indexes["[0-9]+"].starts))
+        self.assertEqual("ab", next(compiled.parse("ab", "Word"))[0])
+        # offsets inside a match were not tried by the scan, the leaf's own matcher runs there
+        index = barg.LeafIndex("aaa b", barg.scan_pattern("a+"))
+        untried, miss = barg.LeafIndex.UNTRIED, barg.LeafIndex.MISS
+        self.assertEqual([3, untried, untried, miss], list(index.table[:4]))
+        match = index.matcher(barg.plan_leaf("a+").matcher())
+        self.assertEqual((3, 2, None), (match("aaa b"), match("aa b"), match(" b")))
+        self.assertTrue(barg.prescannable('"[^"]*"'))
+        self.assertFalse(any(map(barg.prescannable, ("^a", "\\bif", "(?<=a)b", "(?i)a"))))
+        # patterns from profiling select the leaves just like the directive
+        profiler = barg.Profiler()
+        next(barg.parse(("1 2 3",), PRESCAN_GRAMMAR, errs, profiler=profiler)[0])
+        self.assertIn("[0-9]+", profiler.hot_leaves())
+        grammar = 'Toplevel := struct { "a", "[a-z]+" };'
+        self.assertEqual(["[a-z]+"], list(barg.compile_grammar(grammar, errs, prescan=["[a-z]+", "x"]).prescan))
+        with self.assertRaises(barg.BadGrammarError):
+            barg.compile_grammar('%prescan := A; A := struct { "a" };', errs)
+        with self.assertRaises(barg.BadGrammarError):
+            barg.compile_grammar('%prescan := A; A := "\\ba";', errs)
+        with self.assertRaises(barg.BadGrammarError):
+            barg.compile_grammar('%prescan := B; A := "a";', errs)
+
+    def test_cons_list(self):
+        self.assertEqual([1, 2, 3], barg.cons_to_list((3, (2, (1, None)))))
+        errs = []
+        text = "1," * 300
+        m, ncons = next(barg.parse((text,), 'Toplevel := list[0..] { struct { x: "\\d", "," } };', errs)[0])
+        self.assertEqual(len(text), ncons)
+        self.assertEqual(["1"] * 300, [item.x for item in m])
+
+
+LEAF_GRAMMAR = r"""
+Anchored := struct { a: "^a|b" };
+Greedy := struct { a: "a*", "a" };
+Backtracking := struct { a: $builtin.backtrack("a*"), "a" };
+"""
+
+PASSES_GRAMMAR = r"""
+Upper := `x.upper()`;
+Name := "[a-z]+";
+Item := $builtin.pyexpr(Name, Upper);
+List := struct { "\[", items: list[greedy 0..] { enum { item: Item, nested: List } }, "\]" };
+Toplevel := struct { items: List };
+Unused := "u";
+"""
+
+RECOVER_GRAMMAR = r"""
+Item := $builtin.recover(struct { "\(", name: Name, "\)" }, Semi);
+Items := Item*;
+Other := $builtin.recover(Name, Semi, End);
+Name := "[a-z]+";
+Semi := ";";
+End := struct { "end" };
+"""
+
+PRESCAN_GRAMMAR = r"""
+%prescan := Number, Space;
+Number := "[0-9]+";
+Space := " *";
+Word := "[a-z]+";
+Toplevel := list[greedy 0..] { struct { n: Number, Space } };
+"""
+
+ALTERNATION_GRAMMAR = r"""
+Value := enum {
+    hex: $builtin.pyexpr("0x[0-9a-f]+", `int(x, 16)`), dec: $builtin.int("[0-9]"), word: "[a-z]+",
+    x: struct { "\(", v: "[a-z]+", "\)" },
+    t: "true", f: "false"
+};
+Keyword := enum[first] { if: "if ", iffy: "iffy", for: "for", while: "while" };
+"""
+
+ENUM_MODES_GRAMMAR = r"""
+All := struct { v: enum { short: "a", long: "ab", longer: "abc" }, "c" };
+First := struct { v: enum[first] { short: "a", long: "ab", longer: "abc" }, "c" };
+Longest := struct { v: enum[longest] { short: "a", long: "ab", longer: "abc" }, "c?" };
+"""
+
+NULLABLE_LIST_GRAMMAR = r"""
+Item := struct { "\s*", x: "x?" };
+Toplevel := struct { items: Item*, "!" };
+"""
+
+
+class EventCounter(barg.Tracer):
+    def __init__(self):
+        self.events = {}
+
+    def count(self, event: str):
+        self.events[event] = self.events.get(event, 0) + 1
+
+    def enter(self, node, pos):
+        self.count("enter")
+
+    def exit(self, node, pos):
+        self.count("exit")
+
+    def match(self, node, pos, ncons):
+        self.count("match")
+
+    def backtrack(self, node, pos):
+        self.count("backtrack")
+
+    def transform(self, node, pos, ncons):
+        self.count("transform")
+
+
+def codegen_module(grammar: str, traced: bool = False) -> dict:
+    with open(os.path.join(os.path.dirname(barg.__file__), "barg_codegen_builtins.py")) as f:
+        head = f.read()
+    errs = []
+    code = barg.generate_python_parser(grammar, errs, head, traced)
+    assert not errs, errs
+    globs = {"__name__": "barg_generated_parser"}
+    exec(code, globs)
+    return globs
+
+
+class CodeGen(unittest.TestCase):
+    def test_tokens(self):
+        with open(os.path.join(DOCS_DIR, "json_tokens_grammar.barg")) as f:
+            parser = codegen_module(f.read())
+        m = parser["Json"].parse('{"a": [1, 2.5, true, null], "b": {"c": "d"}}')
+        self.assertEqual("a", m.items[0].key)
+        self.assertEqual([1, 2.5, True, None], m.items[0].value.values)
+        self.assertEqual("d", m.items[1].value.items[0].value)
+
+    def test_tracer(self):
+        with open(os.path.join(DOCS_DIR, "json_tokens_grammar.barg")) as f:
+            parser = codegen_module(f.read(), traced=True)
+        tracer = EventCounter()
+        parser["_set_tracer_"](tracer)
+        self.assertEqual([1, 2], parser["Json"].parse("[1, 2]").values)
+        self.assertEqual(tracer.events["enter"], tracer.events["exit"])
+        self.assertGreater(tracer.events["match"], 0)
+        parser["_set_tracer_"](None)
+        events = dict(tracer.events)
+        parser["Json"].parse("[1, 2]")
+        self.assertEqual(events, tracer.events)
+
+    def test_nullable_list(self):
+        with self.assertWarns(barg.GrammarWarning):
+            parser = codegen_module(NULLABLE_LIST_GRAMMAR)
+        self.assertEqual(["x", "x", ""], [i.x for i in parser["Toplevel"].parse("x x !").items])
+
+    def test_enum_modes(self):
+        parser = codegen_module(ENUM_MODES_GRAMMAR)
+        self.assertEqual("long", parser["All"].parse("abc").v.tag)
+        self.assertEqual("longer", parser["Longest"].parse("abc").v.tag)
+        with self.assertRaises(StopIteration):
+            parser["First"].parse("abc")
+
+    def test_leaf_plans(self):
+        with open(os.path.join(DOCS_DIR, "json_grammar.barg")) as f:
+            grammar = f.read()
+        code = barg.generate_python_parser(grammar, [])
+        self.assertIn("# literal matcher", code)
+        self.assertIn("# regex matcher (re engine)", code)
+        parser = codegen_module(grammar)
+        m = parser["Json"].parse('{"a": [1, 2.5, "x", null], "b": {"c": true}}')
+        self.assertEqual([1, 2.5, "x", None], m.items[0].value.values)
+        self.assertEqual(True, m.items[1].value.items[0].value)
+
+    def test_skip(self):
+        with open(os.path.join(DOCS_DIR, "json_skip_grammar.barg")) as f:
+            parser = codegen_module(f.read())
+        m = parser["Json"].parse('  { "a" : [1 ,2.5, "x" ,null ] ,\n "b":{"c":true} }  ')
+        self.assertEqual([1, 2.5, "x", None], m.items[0].value.values)
+        self.assertEqual(True, m.items[1].value.items[0].value)
+        parser = codegen_module('%skip := " *"; Toplevel := struct { a: "a", b: "b?" };')
+        self.assertEqual(("a", ""), (parser["Toplevel"].parse("a  c").a, parser["Toplevel"].parse("a  c").b))
+        self.assertEqual("b", parser["Toplevel"].parse("a  b").b)
+
+    def test_leaf_matching(self):
+        parser = codegen_module(LEAF_GRAMMAR)
+        self.assertEqual("aa", parser["Backtracking"].parse("aaa").a)
+        for name, text in (("Anchored", "xb"), ("Greedy", "aaa")):
+            with self.assertRaises(StopIteration):
+                parser[name].parse(text)
+
+    def test_passes(self):
+        code = barg.generate_python_parser(PASSES_GRAMMAR, [], roots=["Toplevel"])
+        self.assertNotIn("Unused", code)
+        self.assertIn("_TextString_('x.upper()')", code)
+        with open(os.path.join(os.path.dirname(barg.__file__), "barg_codegen_builtins.py")) as f:
+            head = f.read()
+        parser = {"__name__": "barg_generated_parser"}
+        exec(barg.generate_python_parser(PASSES_GRAMMAR, [], head, roots=["Toplevel"]), parser)
+        m = parser["Toplevel"].parse("[ab[c]]")
+        self.assertEqual("AB", m.items.items[0].value)
+        self.assertEqual("C", m.items.items[1].value.items[0].value)
+        self.assertIn("Unused", codegen_module(PASSES_GRAMMAR))
+
+    def test_recover(self):
+        code = barg.generate_python_parser(RECOVER_GRAMMAR, [])
+        self.assertIn("# recovering matcher", code)
+        self.assertIn("_regex_.compile('(?:;)')", code)
+        parser = codegen_module(RECOVER_GRAMMAR)
+        m = parser["Items"].parse("(ab)x1;(cd)")
+        self.assertEqual(["ab", "cd"], [m[0].name, m[2].name])
+        self.assertEqual((4, 7, "x1;"), (m[1].start, m[1].end, m[1].text))
+        self.assertEqual("12end", parser["Other"].parse("12end").text)
+
+    def test_prescan(self):
+        code = barg.generate_python_parser(PRESCAN_GRAMMAR, [])
+        self.assertIn("# prescanned leaf matcher", code)
+        self.assertEqual(2, code.count("_leaf_index_(_prescan"))
+        parser = codegen_module(PRESCAN_GRAMMAR)
+        self.assertEqual(["12", "345", "6"], [item.n for item in parser["Toplevel"].parse("12 345 6")])
+        # the index is rebuilt for every input
+        self.assertEqual(["7"], [item.n for item in parser["Toplevel"].parse("7")])
+        self.assertEqual("ab", parser["Word"].parse("ab"))
+
+    def test_alternation(self):
+        code = barg.generate_python_parser(ALTERNATION_GRAMMAR, [])
+        self.assertIn("(?P<_0>0x[0-9a-f]+)|(?P<_1>[0-9])|(?P<_2>[a-z]+)", code)
+        self.assertIn("{'iffy': (1,)}", code)
+        # traced parsers match each variant on its own
+        self.assertNotIn("(?P<_0>", barg.generate_python_parser(ALTERNATION_GRAMMAR, [], traced=True))
+        parser = codegen_module(ALTERNATION_GRAMMAR)
+        m = parser["Value"].parse("0x1f")
+        self.assertEqual(("hex", 31), (m.tag, m.value))
+        self.assertEqual("true", parser["Value"].parse("true").value)
+        self.assertEqual("v", parser["Value"].parse("(v)").value.v)
+        self.assertEqual("iffy", parser["Keyword"].parse("iffy").tag)
+        self.assertEqual("if", parser["Keyword"].parse("if x").tag)
+
 
 if __name__ == "__main__":
     unittest.main()